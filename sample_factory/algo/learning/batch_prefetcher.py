@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Deque, Dict
+
+from signal_slot.signal_slot import EventLoop, EventLoopObject, signal
+
+from sample_factory.algo.learning.batcher import Batcher
+from sample_factory.algo.learning.learner import Learner
+from sample_factory.algo.utils.torch_compile import compile_timing
+from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.timing import Timing
+
+
+class BatchPrefetcher(EventLoopObject):
+    """
+    Lives in its own thread of the learner process, between the Batcher and the LearnerWorker.
+    Prepares training batches (obs normalization, next-step values, advantages) ahead of time so that
+    the next batch is ready by the time the learner finishes training on the current one.
+    """
+
+    def __init__(self, evt_loop: EventLoop, learner: Learner, batcher: Batcher, max_prefetched_batches: int):
+        unique_name = f"{BatchPrefetcher.__name__}_{learner.policy_id}"
+        super().__init__(evt_loop, unique_name)
+
+        self.timing = Timing(name=f"BatchPrefetcher {learner.policy_id} profile")
+
+        self.learner: Learner = learner
+        self.batcher: Batcher = batcher
+
+        # the batch the learner is currently training on plus the batches prepared ahead of time
+        self.max_batches_in_flight: int = max_prefetched_batches + 1
+        self.num_batches_in_flight: int = 0
+
+        self.pending_batches: Deque[int] = deque()
+        self.prefetched_batches: Dict[int, AttrDict] = dict()
+
+    @signal
+    def prefetched_batch_available(self): ...
+
+    def on_new_training_batch(self, batch_idx: int):
+        self.pending_batches.append(batch_idx)
+        self._maybe_prefetch_batches()
+
+    def on_training_batch_released(self, _batch_idx: int, _training_iteration: int):
+        self.num_batches_in_flight -= 1
+        self._maybe_prefetch_batches()
+
+    def _maybe_prefetch_batches(self):
+        while self.pending_batches and self.num_batches_in_flight < self.max_batches_in_flight:
+            batch_idx = self.pending_batches.popleft()
+            # compiled model units would otherwise report compilation to the timing of the learner thread
+            with self.timing.add_time("prefetch_batch"), compile_timing(self.timing):
+                self.prefetched_batches[batch_idx] = self.learner.prefetch_batch(
+                    self.batcher.training_batches[batch_idx]
+                )
+
+            self.num_batches_in_flight += 1
+            self.prefetched_batch_available.emit(batch_idx)
+
+    def pop_prefetched_batch(self, batch_idx: int) -> AttrDict:
+        return self.prefetched_batches.pop(batch_idx)
@@ -115,12 +115,20 @@ class Batcher(HeartbeatStoppableEventLoopObject):
         self.traj_tensors = buffer_mgr.traj_tensors_torch
         self.training_batches: List[TensorDict] = []
 
+        # training batches are views into the shared trajectory buffers instead of copies, whenever possible
+        self.zero_copy = buffer_mgr.zero_copy_batches
+
         self.max_batches_to_accumulate = buffer_mgr.max_batches_to_accumulate
         self.available_batches = list(range(self.max_batches_to_accumulate))
         self.traj_tensors_to_release: List[List[Tuple[Device, slice]]] = [
             [] for _ in range(self.max_batches_to_accumulate)
         ]
 
+        # training batches that trajectories are copied into unless the batch is a view,
+        # with zero-copy batches these are only allocated when needed (trajectories are not contiguous)
+        self.batch_buffers: List[Optional[TensorDict]] = [None] * self.max_batches_to_accumulate
+        self.batch_is_view: List[bool] = [False] * self.max_batches_to_accumulate
+
     @signal
     def initialized(self): ...
 
@@ -140,19 +148,14 @@ class Batcher(HeartbeatStoppableEventLoopObject):
     def stop(self): ...
 
     def init(self):
-        device = policy_device(self.cfg, self.policy_id)
-        for i in range(self.max_batches_to_accumulate):
-            rnn_size = get_rnn_size(self.cfg)
-            training_batch = alloc_trajectory_tensors(
-                self.env_info,
-                self.traj_per_training_iteration,
-                self.cfg.rollout,
-                rnn_size,
-                device,
-                False,
-            )
-            self.training_batches.append(training_batch)
+        if self.zero_copy:
+            device = policy_device(self.cfg, self.policy_id)
+            assert list(self.traj_tensors.keys()) == [str(device)], "Zero-copy batches require a single sampling device"
+        else:
+            for batch_idx in range(self.max_batches_to_accumulate):
+                self._alloc_batch_buffer(batch_idx)
 
+        self.training_batches = list(self.batch_buffers)
         self.initialized.emit()
 
     def on_new_trajectories(self, trajectory_dicts: Iterable[Dict], device: str):
@@ -183,48 +186,91 @@ class Batcher(HeartbeatStoppableEventLoopObject):
                 self.available_batches.pop(0)
                 assert len(self.traj_tensors_to_release[batch_idx]) == 0
 
-                # extract slices of trajectories and copy them to the training batch
-                devices = list(self.slices_for_training.keys())
-                random.shuffle(devices)  # so that no sampling device is preferred
-
-                trajectories_copied = 0
-                remaining = self.traj_per_training_iteration - trajectories_copied
-                for device in devices:
-                    traj_tensors = self.traj_tensors[device]
-                    slices = self.slices_for_training[device]
-                    while remaining > 0 and (traj_slice := slices.get_at_most(remaining)):
-                        # copy data into the training buffer
-                        start = trajectories_copied
-                        stop = start + slice_len(traj_slice)
-
-                        # log.debug(f"Copying {traj_slice} trajectories from {device} to {batch_idx}")
-                        self.training_batches[batch_idx][start:stop] = traj_tensors[traj_slice]
-
-                        # remember that we need to release these trajectories
-                        self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
-
-                        trajectories_copied += slice_len(traj_slice)
-                        remaining = self.traj_per_training_iteration - trajectories_copied
-
-                assert trajectories_copied == self.traj_per_training_iteration and remaining == 0
+                if self.zero_copy and self._maybe_make_batch_view(batch_idx):
+                    self.batch_is_view[batch_idx] = True
+                else:
+                    if self.zero_copy:
+                        debug_log_every_n(100, "Trajectories are not contiguous, copying them into a training batch")
+                    self._copy_trajectories(batch_idx)
 
                 # signal the learner that we have a new training batch
                 self.training_batches_available.emit(batch_idx)
 
                 if self.cfg.async_rl:
-                    self._release_traj_tensors(batch_idx)
+                    if not self.batch_is_view[batch_idx]:
+                        self._release_traj_tensors(batch_idx)
                     if not self.available_batches:
                         debug_log_every_n(50, "Signal inference workers to stop experience collection...")
                         self.stop_experience_collection.emit()
 
+    def _maybe_make_batch_view(self, batch_idx: int) -> bool:
+        """
+        If there is a contiguous range of trajectories large enough for a whole training batch, the batch is just
+        a view into the shared trajectory buffers and no data is copied at all.
+        These trajectories are held until the learner is done with the batch.
+        """
+        for device, slices in self.slices_for_training.items():
+            if (traj_slice := slices.get_exactly(self.traj_per_training_iteration)) is not None:
+                self.training_batches[batch_idx] = self.traj_tensors[device][traj_slice]
+                self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
+                return True
+
+        return False
+
+    def _alloc_batch_buffer(self, batch_idx: int) -> TensorDict:
+        self.batch_buffers[batch_idx] = alloc_trajectory_tensors(
+            self.env_info,
+            self.traj_per_training_iteration,
+            self.cfg.rollout,
+            get_rnn_size(self.cfg),
+            policy_device(self.cfg, self.policy_id),
+            False,
+        )
+        return self.batch_buffers[batch_idx]
+
+    def _copy_trajectories(self, batch_idx: int) -> None:
+        # extract slices of trajectories and copy them to the training batch
+        devices = list(self.slices_for_training.keys())
+        random.shuffle(devices)  # so that no sampling device is preferred
+
+        training_batch = self.batch_buffers[batch_idx]
+        if training_batch is None:
+            training_batch = self._alloc_batch_buffer(batch_idx)
+        self.training_batches[batch_idx] = training_batch
+        trajectories_copied = 0
+        remaining = self.traj_per_training_iteration - trajectories_copied
+        for device in devices:
+            traj_tensors = self.traj_tensors[device]
+            slices = self.slices_for_training[device]
+            while remaining > 0 and (traj_slice := slices.get_at_most(remaining)):
+                # copy data into the training buffer
+                start = trajectories_copied
+                stop = start + slice_len(traj_slice)
+
+                # log.debug(f"Copying {traj_slice} trajectories from {device} to {batch_idx}")
+                training_batch[start:stop] = traj_tensors[traj_slice]
+
+                # remember that we need to release these trajectories
+                self.traj_tensors_to_release[batch_idx].append((device, traj_slice))
+
+                trajectories_copied += slice_len(traj_slice)
+                remaining = self.traj_per_training_iteration - trajectories_copied
+
+        assert trajectories_copied == self.traj_per_training_iteration and remaining == 0
+
     def on_training_batch_released(self, batch_idx: int, training_iteration: int):
         with self.timing.add_time("releasing_batches"):
             self.training_iteration = training_iteration
 
-            if not self.cfg.async_rl:
-                # in synchronous RL, we release the trajectories after they're processed by the learner
+            if not self.cfg.async_rl or self.batch_is_view[batch_idx]:
+                # in synchronous RL (or if the learner trains directly on the trajectory buffers),
+                # we release the trajectories after they're processed by the learner
                 self._release_traj_tensors(batch_idx)
 
+            if self.batch_is_view[batch_idx]:
+                self.training_batches[batch_idx] = self.batch_buffers[batch_idx]
+                self.batch_is_view[batch_idx] = False
+
             if not self.available_batches and self.cfg.async_rl:
                 debug_log_every_n(50, "Signal inference workers to resume experience collection...")
                 self.resume_experience_collection.emit()
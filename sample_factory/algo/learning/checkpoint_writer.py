@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import glob
+import os
+from dataclasses import dataclass
+from os.path import dirname, join
+from queue import Queue
+from threading import Lock, Thread
+from typing import Optional
+
+import torch
+
+from sample_factory.algo.utils.torch_utils import snapshot_state  # noqa: F401
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.utils import log
+
+
+def remove_old_checkpoints(checkpoint_dir: str, pattern: str, keep_checkpoints: int, verbose: bool) -> None:
+    while len(checkpoints := sorted(glob.glob(join(checkpoint_dir, pattern)))) > keep_checkpoints:
+        oldest_checkpoint = checkpoints[0]
+        if os.path.isfile(oldest_checkpoint):
+            if verbose:
+                log.debug("Removing %s", oldest_checkpoint)
+            os.remove(oldest_checkpoint)
+
+
+@dataclass
+class CheckpointJob:
+    checkpoint: dict
+    tmp_filepath: str
+    filepath: str
+    # rotation of old checkpoints after the new one is written, only if keep_checkpoints is not None
+    pattern: str = ""
+    keep_checkpoints: Optional[int] = None
+    verbose: bool = True
+    # whether other components should be notified once this checkpoint is on disk (see pop_completed())
+    notify: bool = False
+
+
+class CheckpointWriter:
+    """
+    Serializes checkpoints in a background thread of the learner process, so that training does not stop for
+    torch.save() and disk I/O. The training thread only takes a snapshot of the state (see snapshot_state()).
+
+    Checkpoints are written to a temporary file which is fsync-ed and then atomically renamed, so a crash
+    mid-save leaves us with a corrupted temp file rather than a corrupted checkpoint.
+    At most max_pending snapshots can wait in the queue, after which submit() blocks (back-pressure),
+    this bounds the memory used by snapshots if the disk can't keep up.
+    """
+
+    def __init__(self, policy_id: int, max_pending: int):
+        self.queue: Queue[Optional[CheckpointJob]] = Queue(maxsize=max_pending)
+        self.timing = Timing(name=f"CheckpointWriter {policy_id} profile")
+
+        self._completed_lock = Lock()
+        self._num_completed_to_notify = 0
+
+        self.thread = Thread(target=self._run, name=f"checkpoint_writer_{policy_id}", daemon=True)
+        self.thread.start()
+
+    def submit(self, job: CheckpointJob) -> None:
+        self.queue.put(job)
+
+    def _run(self) -> None:
+        while (job := self.queue.get()) is not None:
+            try:
+                with self.timing.add_time("write_checkpoint"):
+                    self._write(job)
+                if job.notify:
+                    with self._completed_lock:
+                        self._num_completed_to_notify += 1
+            except Exception:
+                log.exception(f"Could not save checkpoint {job.filepath}")
+            finally:
+                self.queue.task_done()
+
+        self.queue.task_done()
+
+    @staticmethod
+    def _write(job: CheckpointJob) -> None:
+        if job.verbose:
+            log.info("Saving %s...", job.filepath)
+
+        with open(job.tmp_filepath, "wb") as f:
+            torch.save(job.checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(job.tmp_filepath, job.filepath)
+
+        # make sure the rename itself is persisted
+        dir_fd = os.open(dirname(job.filepath), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        if job.keep_checkpoints is not None:
+            remove_old_checkpoints(dirname(job.filepath), job.pattern, job.keep_checkpoints, job.verbose)
+
+    def pop_completed(self) -> int:
+        """:return: number of checkpoints with notify=True written since the last call."""
+        with self._completed_lock:
+            num_completed, self._num_completed_to_notify = self._num_completed_to_notify, 0
+        return num_completed
+
+    def flush(self) -> None:
+        """Block until all submitted checkpoints are written."""
+        self.queue.join()
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
@@ -4,24 +4,41 @@ import glob
 import os
 import time
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from enum import IntEnum
 from os.path import join
-from typing import Callable, Dict, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
 from torch import Tensor
 from torch.nn import Module
 
+from sample_factory.algo.learning.checkpoint_writer import (
+    CheckpointJob,
+    CheckpointWriter,
+    remove_old_checkpoints,
+    snapshot_state,
+)
+from sample_factory.algo.learning.minibatch_sampler import MinibatchSampler
 from sample_factory.algo.learning.rnn_utils import build_core_out_from_seq, build_rnn_inputs
 from sample_factory.algo.utils.action_distributions import get_action_distribution, is_continuous_action_space
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.misc import LEARNER_ENV_STEPS, POLICY_ID_KEY, STATS_KEY, TRAIN_STATS, memory_stats
-from sample_factory.algo.utils.model_sharing import ParameterServer
+from sample_factory.algo.utils.model_sharing import ParameterServer, VersionedWeights
 from sample_factory.algo.utils.optimizers import Lamb
-from sample_factory.algo.utils.rl_utils import gae_advantages, prepare_and_normalize_obs
+from sample_factory.algo.utils.rl_utils import gae_advantages, prepare_and_normalize_obs, vtrace
 from sample_factory.algo.utils.shared_buffers import policy_device
 from sample_factory.algo.utils.tensor_dict import TensorDict, shallow_recursive_copy
-from sample_factory.algo.utils.torch_utils import masked_select, synchronize, to_scalar
+from sample_factory.algo.utils.torch_compile import compile_actor_critic, maybe_compile
+from sample_factory.algo.utils.torch_utils import (
+    DeferredReadback,
+    autocast_context,
+    masked_select,
+    stack_to_scalars,
+    synchronize,
+    to_scalar,
+)
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.model.actor_critic import ActorCritic, create_actor_critic
 from sample_factory.utils.attr_dict import AttrDict
@@ -31,11 +48,26 @@ from sample_factory.utils.timing import Timing
 from sample_factory.utils.typing import ActionDistribution, Config, InitModelData, PolicyID
 from sample_factory.utils.utils import ensure_dir_exists, experiment_dir, log
 
+# thresholds for the warnings about suspicious training statistics
+_HIGH_LOSS = 30.0
+_HIGH_KL = 100.0
+
+
+class _MinibatchStat(IntEnum):
+    """Per-minibatch scalars accumulated on the device when --deferred_train_stats is enabled."""
+
+    ACTOR_LOSS = 0
+    LOSS_ABS = 1
+    KL_MAX = 2
+
 
 class LearningRateScheduler:
     def update(self, current_lr, recent_kls):
         return current_lr
 
+    def uses_kls(self):
+        return False
+
     def invoke_after_each_minibatch(self):
         return False
 
@@ -53,6 +85,9 @@ class KlAdaptiveScheduler(LearningRateScheduler, ABC):
     def num_recent_kls_to_use(self) -> int:
         pass
 
+    def uses_kls(self):
+        return True
+
     def update(self, current_lr, recent_kls):
         num_kls_to_use = self.num_recent_kls_to_use()
         kls = recent_kls[-num_kls_to_use:]
@@ -114,10 +149,18 @@ def get_lr_scheduler(cfg) -> LearningRateScheduler:
 
 
 def model_initialization_data(
-    cfg: Config, policy_id: PolicyID, actor_critic: Module, policy_version: int, device: torch.device
+    cfg: Config,
+    policy_id: PolicyID,
+    actor_critic: Module,
+    policy_version: int,
+    device: torch.device,
+    versioned_weights: Optional[VersionedWeights] = None,
 ) -> InitModelData:
     # in serial mode we will just use the same actor_critic directly
     state_dict = None if cfg.serial_mode else actor_critic.state_dict()
+    if versioned_weights is not None:
+        # clients copy published snapshots of the weights instead of the live weights of the learner
+        state_dict = versioned_weights
     model_state = (policy_id, state_dict, device, policy_version)
     return model_state
 
@@ -157,6 +200,8 @@ class Learner(Configurable):
 
         # for multi-policy learning (i.e. with PBT) when we need to load weights of another policy
         self.policy_to_load: Optional[PolicyID] = None
+        # state of that policy if it was transferred in memory (see export_state()) rather than saved to disk
+        self.state_to_load: Optional[Dict] = None
 
         # decay rate at which summaries are collected
         # save summaries every 5 seconds in the beginning, but decay to every 4 minutes in the limit, because we
@@ -173,8 +218,15 @@ class Learner(Configurable):
         self.exploration_loss_func: Optional[Callable] = None
         self.kl_loss_func: Optional[Callable] = None
 
+        # batches can be prepared in a background thread of the learner process while we train on the previous one
+        self.prefetching: bool = not cfg.serial_mode and cfg.learner_prefetch_batches > 0
+        self.prefetch_stream: Optional[torch.cuda.Stream] = None
+
         self.is_initialized = False
 
+        # serializes checkpoints in a background thread, created in init()
+        self.checkpoint_writer: Optional[CheckpointWriter] = None
+
     def init(self) -> InitModelData:
         if self.cfg.exploration_loss_coeff == 0.0:
             self.exploration_loss_func = lambda action_distr, valids, num_invalids: 0.0
@@ -229,6 +281,17 @@ class Learner(Configurable):
         self.actor_critic._apply(share_mem)
         self.actor_critic.train()
 
+        if self.cfg.torch_compile:
+            # minibatch shapes are fixed, shapes of other forward passes are handled by automatic dynamic shapes
+            compile_mode = self.cfg.torch_compile_mode
+            compile_actor_critic(self.actor_critic, self.timing, dynamic=None, mode=compile_mode)
+            self._calculate_losses = maybe_compile(
+                self._calculate_losses, "Learner._calculate_losses", self.timing, dynamic=None, mode=compile_mode
+            )
+
+        if self.prefetching and self.device.type == "cuda":
+            self.prefetch_stream = torch.cuda.Stream(self.device)
+
         params = list(self.actor_critic.parameters())
 
         optimizer_cls = dict(adam=torch.optim.Adam, lamb=Lamb)
@@ -256,9 +319,19 @@ class Learner(Configurable):
         self.curr_lr = self.cfg.learning_rate if self.curr_lr is None else self.curr_lr
         self._apply_lr(self.curr_lr)
 
+        if self.cfg.async_checkpoint_queue_size > 0:
+            self.checkpoint_writer = CheckpointWriter(self.policy_id, self.cfg.async_checkpoint_queue_size)
+
         self.is_initialized = True
 
-        return model_initialization_data(self.cfg, self.policy_id, self.actor_critic, self.train_step, self.device)
+        return model_initialization_data(
+            self.cfg,
+            self.policy_id,
+            self.actor_critic,
+            self.train_step,
+            self.device,
+            self.param_server.versioned_weights,
+        )
 
     @staticmethod
     def checkpoint_dir(cfg, policy_id):
@@ -326,6 +399,10 @@ class Learner(Configurable):
         """A hook to be called after each optimizer step."""
         self.train_step += 1
 
+    def _prefetch_lock(self):
+        """With prefetching, batches are prepared (and normalizer statistics updated) concurrently with training."""
+        return self.param_server.policy_lock if self.prefetching else nullcontext()
+
     def _get_checkpoint_dict(self):
         checkpoint = {
             "train_step": self.train_step,
@@ -348,21 +425,25 @@ class Learner(Configurable):
         tmp_filepath = join(checkpoint_dir, f"{name_prefix}_temp")
         checkpoint_name = f"{name_prefix}_{self.train_step:09d}_{self.env_steps}{name_suffix}.pth"
         filepath = join(checkpoint_dir, checkpoint_name)
+
+        if self.checkpoint_writer is not None:
+            with self.timing.add_time("checkpoint_snapshot"), self._prefetch_lock():
+                snapshot = snapshot_state(checkpoint)
+                pattern = f"{name_prefix}_*"
+                job = CheckpointJob(snapshot, tmp_filepath, filepath, pattern, keep_checkpoints, verbose, notify=True)
+                self.checkpoint_writer.submit(job)
+            return True
+
         if verbose:
             log.info("Saving %s...", filepath)
 
         # This should protect us from a rare case where something goes wrong mid-save and we end up with a corrupted
         # checkpoint file. It better be a corrupted temp file.
-        torch.save(checkpoint, tmp_filepath)
+        with self._prefetch_lock():
+            torch.save(checkpoint, tmp_filepath)
         os.rename(tmp_filepath, filepath)
 
-        while len(checkpoints := self.get_checkpoints(checkpoint_dir, f"{name_prefix}_*")) > keep_checkpoints:
-            oldest_checkpoint = checkpoints[0]
-            if os.path.isfile(oldest_checkpoint):
-                if verbose:
-                    log.debug("Removing %s", oldest_checkpoint)
-                os.remove(oldest_checkpoint)
-
+        remove_old_checkpoints(checkpoint_dir, f"{name_prefix}_*", keep_checkpoints, verbose)
         return True
 
     def save(self) -> bool:
@@ -376,8 +457,16 @@ class Learner(Configurable):
 
         milestones_dir = ensure_dir_exists(join(checkpoint_dir, "milestones"))
         milestone_path = join(milestones_dir, f"{checkpoint_name}")
+        if self.checkpoint_writer is not None:
+            tmp_filepath = join(milestones_dir, "checkpoint_temp")
+            with self._prefetch_lock():
+                snapshot = snapshot_state(checkpoint)
+            self.checkpoint_writer.submit(CheckpointJob(snapshot, tmp_filepath, milestone_path))
+            return
+
         log.info("Saving a milestone %s", milestone_path)
-        torch.save(checkpoint, milestone_path)
+        with self._prefetch_lock():
+            torch.save(checkpoint, milestone_path)
 
     def save_best(self, policy_id, metric, metric_value) -> bool:
         if policy_id != self.policy_id:
@@ -394,8 +483,14 @@ class Learner(Configurable):
     def set_new_cfg(self, new_cfg: Dict) -> None:
         self.new_cfg = new_cfg
 
-    def set_policy_to_load(self, policy_to_load: PolicyID) -> None:
+    def set_policy_to_load(self, policy_to_load: PolicyID, state: Optional[Dict] = None) -> None:
         self.policy_to_load = policy_to_load
+        self.state_to_load = state
+
+    def export_state(self) -> Dict:
+        """Snapshot of the current state in shared memory that another learner can load, see set_policy_to_load()."""
+        with self.param_server.policy_lock:
+            return self.param_server.export_state(self._get_checkpoint_dict())
 
     def _maybe_update_cfg(self) -> None:
         if self.new_cfg is not None:
@@ -422,16 +517,21 @@ class Learner(Configurable):
         if self.policy_to_load is not None:
             with self.param_server.policy_lock:
                 # don't re-load progress if we are loading from another policy checkpoint
-                self.load_from_checkpoint(self.policy_to_load, load_progress=False)
+                if self.state_to_load is not None:
+                    log.debug(f"Loading state of policy {self.policy_to_load} transferred in memory")
+                    self._load_state(self.state_to_load, load_progress=False)
+                else:
+                    self.load_from_checkpoint(self.policy_to_load, load_progress=False)
 
             # make sure everything (such as policy weights) is committed to shared device memory
             synchronize(self.cfg, self.device)
             # this will force policy update on the inference worker (policy worker)
             # we add max_policy_lag steps so that all experience currently in batches is invalidated
             self.train_step += self.cfg.max_policy_lag + 1
-            self.policy_versions_tensor[self.policy_id] = self.train_step
+            self.param_server.update_weights(self.train_step, force=True, state_lock=self._prefetch_lock())
 
             self.policy_to_load = None
+            self.state_to_load = None
 
     @staticmethod
     def _policy_loss(ratio, adv, clip_ratio_low, clip_ratio_high, valids, num_invalids: int):
@@ -554,8 +654,11 @@ class Learner(Configurable):
 
             valids = mb.valids
 
+            # model forward passes run under bfloat16 autocast, losses are calculated in float32
+            mixed_precision: bool = self.cfg.bf16_autocast
+
         # calculate policy head outside of recurrent loop
-        with self.timing.add_time("forward_head"):
+        with self.timing.add_time("forward_head"), autocast_context(mixed_precision, self.device):
             head_outputs = self.actor_critic.forward_head(mb.normalized_obs)
             minibatch_size: int = head_outputs.size(0)
 
@@ -575,7 +678,7 @@ class Learner(Configurable):
                 rnn_states = mb.rnn_states[::recurrence]
 
         # calculate RNN outputs for each timestep in a loop
-        with self.timing.add_time("bptt"):
+        with self.timing.add_time("bptt"), autocast_context(mixed_precision, self.device):
             if self.cfg.use_rnn:
                 with self.timing.add_time("bptt_forward_core"):
                     core_output_seq, _ = self.actor_critic.forward_core(head_output_seq, rnn_states)
@@ -591,7 +694,8 @@ class Learner(Configurable):
 
         with self.timing.add_time("tail"):
             # calculate policy tail outside of recurrent loop
-            result = self.actor_critic.forward_tail(core_outputs, values_only=False, sample_actions=False)
+            with autocast_context(mixed_precision, self.device):
+                result = self.actor_critic.forward_tail(core_outputs, values_only=False, sample_actions=False)
             action_distribution = self.actor_critic.action_distribution()
             log_prob_actions = action_distribution.log_prob(mb.actions)
             ratio = torch.exp(log_prob_actions - mb.log_prob_actions)  # pi / pi_old
@@ -599,51 +703,27 @@ class Learner(Configurable):
             # super large/small values can cause numerical problems and are probably noise anyway
             ratio = torch.clamp(ratio, 0.05, 20.0)
 
-            values = result["values"].squeeze()
+            values = result["values"].squeeze().float()
 
             del core_outputs
 
         # these computations are not the part of the computation graph
         with torch.no_grad(), self.timing.add_time("advantages_returns"):
             if self.cfg.with_vtrace:
-                # V-trace parameters
-                rho_hat = torch.Tensor([self.cfg.vtrace_rho])
-                c_hat = torch.Tensor([self.cfg.vtrace_c])
-
-                ratios_cpu = ratio.cpu()
-                values_cpu = values.cpu()
-                rewards_cpu = mb.rewards_cpu
-                dones_cpu = mb.dones_cpu
-
-                vtrace_rho = torch.min(rho_hat, ratios_cpu)
-                vtrace_c = torch.min(c_hat, ratios_cpu)
-
-                vs = torch.zeros((num_trajectories * recurrence))
-                adv = torch.zeros((num_trajectories * recurrence))
-
-                next_values = values_cpu[recurrence - 1 :: recurrence] - rewards_cpu[recurrence - 1 :: recurrence]
-                next_values /= self.cfg.gamma
-                next_vs = next_values
-
-                for i in reversed(range(self.cfg.recurrence)):
-                    rewards = rewards_cpu[i::recurrence]
-                    dones = dones_cpu[i::recurrence]
-                    not_done = 1.0 - dones
-                    not_done_gamma = not_done * self.cfg.gamma
-
-                    curr_values = values_cpu[i::recurrence]
-                    curr_vtrace_rho = vtrace_rho[i::recurrence]
-                    curr_vtrace_c = vtrace_c[i::recurrence]
-
-                    delta_s = curr_vtrace_rho * (rewards + not_done_gamma * next_values - curr_values)
-                    adv[i::recurrence] = curr_vtrace_rho * (rewards + not_done_gamma * next_vs - curr_values)
-                    next_vs = curr_values + delta_s + not_done_gamma * curr_vtrace_c * (next_vs - next_values)
-                    vs[i::recurrence] = next_vs
-
-                    next_values = curr_values
-
-                targets = vs.to(self.device)
-                adv = adv.to(self.device)
+                # minibatch consists of trajectory segments of length recurrence, so we can view all per-step
+                # tensors as [num_trajectories, recurrence] and run V-trace on the learner device
+                traj_shape = (num_trajectories, recurrence)
+                vs, adv = vtrace(
+                    ratio.view(traj_shape),
+                    values.view(traj_shape),
+                    mb.rewards.view(traj_shape),
+                    mb.dones.view(traj_shape),
+                    self.cfg.vtrace_rho,
+                    self.cfg.vtrace_c,
+                    self.cfg.gamma,
+                )
+                targets = vs.reshape(-1)
+                adv = adv.reshape(-1)
             else:
                 # using regular GAE
                 adv = mb.advantages
@@ -687,6 +767,17 @@ class Learner(Configurable):
             # recent mean KL-divergences per minibatch, this used by LR schedulers
             recent_kls = []
 
+            # In deferred mode per-minibatch scalars stay on the device, we read them back once per iteration.
+            # This way we never have to wait for the device to finish the work we've already scheduled.
+            deferred_stats = self.cfg.deferred_train_stats
+            if deferred_stats:
+                minibatch_stats = torch.zeros(
+                    (self.cfg.num_epochs, self.cfg.num_batches_per_epoch, len(_MinibatchStat)), device=self.device
+                )
+                # (epoch, readback of [epoch actor loss, max abs loss]) for the epochs whose losses are in flight
+                epoch_loss_readbacks: List[Tuple[int, DeferredReadback]] = []
+                num_epochs_read_back = 0
+
             if self.cfg.with_vtrace:
                 assert (
                     self.cfg.recurrence == self.cfg.rollout and self.cfg.recurrence > 1
@@ -710,20 +801,32 @@ class Learner(Configurable):
 
             assert self.actor_critic.training
 
+            minibatch_sampler: Optional[MinibatchSampler] = None
+            if self.cfg.fused_minibatches and self.cfg.shuffle_minibatches and self.cfg.num_batches_per_epoch > 1:
+                with timing.add_time("minibatch_sampler_init"):
+                    minibatch_sampler = MinibatchSampler(
+                        gpu_buffer, experience_size, batch_size, self.cfg.recurrence, self.device
+                    )
+
+        force_summaries = False
         for epoch in range(self.cfg.num_epochs):
             with timing.add_time("epoch_init"):
                 if early_stop:
                     break
 
-                force_summaries = False
-                minibatches = self._get_minibatches(batch_size, experience_size)
+                if minibatch_sampler is None:
+                    minibatches = self._get_minibatches(batch_size, experience_size)
+                    num_minibatches = len(minibatches)
+                else:
+                    num_minibatches = minibatch_sampler.shuffle()
 
-            for batch_num in range(len(minibatches)):
+            for batch_num in range(num_minibatches):
                 with torch.no_grad(), timing.add_time("minibatch_init"):
-                    indices = minibatches[batch_num]
-
                     # current minibatch consisting of short trajectory segments with length == recurrence
-                    mb = self._get_minibatch(gpu_buffer, indices)
+                    if minibatch_sampler is None:
+                        mb = self._get_minibatch(gpu_buffer, minibatches[batch_num])
+                    else:
+                        mb = minibatch_sampler.get_minibatch(batch_num)
 
                     # enable syntactic sugar that allows us to access dict's keys as object attributes
                     mb = AttrDict(mb)
@@ -745,21 +848,25 @@ class Learner(Configurable):
                     critic_loss = value_loss
                     loss: Tensor = actor_loss + critic_loss
 
-                    epoch_actor_losses[batch_num] = float(actor_loss)
-
-                    high_loss = 30.0
-                    if torch.abs(loss) > high_loss:
-                        log.warning(
-                            "High loss value: l:%.4f pl:%.4f vl:%.4f exp_l:%.4f kl_l:%.4f (recommended to adjust the --reward_scale parameter)",
-                            to_scalar(loss),
-                            to_scalar(policy_loss),
-                            to_scalar(value_loss),
-                            to_scalar(exploration_loss),
-                            to_scalar(kl_loss),
-                        )
-
-                        # perhaps something weird is happening, we definitely want summaries from this step
-                        force_summaries = True
+                    if deferred_stats:
+                        mb_stats = minibatch_stats[epoch, batch_num]
+                        mb_stats[_MinibatchStat.ACTOR_LOSS] = actor_loss.detach()
+                        mb_stats[_MinibatchStat.LOSS_ABS] = loss.detach().abs()
+                    else:
+                        epoch_actor_losses[batch_num] = float(actor_loss)
+
+                        if torch.abs(loss) > _HIGH_LOSS:
+                            log.warning(
+                                "High loss value: l:%.4f pl:%.4f vl:%.4f exp_l:%.4f kl_l:%.4f (recommended to adjust the --reward_scale parameter)",
+                                to_scalar(loss),
+                                to_scalar(policy_loss),
+                                to_scalar(value_loss),
+                                to_scalar(exploration_loss),
+                                to_scalar(kl_loss),
+                            )
+
+                            # perhaps something weird is happening, we definitely want summaries from this step
+                            force_summaries = True
 
                 with torch.no_grad(), timing.add_time("kl_divergence"):
                     # if kl_old is not None it is already calculated above
@@ -772,10 +879,15 @@ class Learner(Configurable):
                         kl_old = action_distribution.kl_divergence(old_action_distribution)
                         kl_old = masked_select(kl_old, mb.valids, num_invalids)
 
-                    kl_old_mean = float(kl_old.mean().item())
+                    if deferred_stats:
+                        kl_old_mean = kl_old.mean()
+                        if kl_old.numel() > 0:
+                            mb_stats[_MinibatchStat.KL_MAX] = kl_old.max()
+                    else:
+                        kl_old_mean = float(kl_old.mean().item())
+                        if kl_old.numel() > 0 and kl_old.max().item() > _HIGH_KL:
+                            log.warning(f"KL-divergence is very high: {kl_old.max().item():.4f}")
                     recent_kls.append(kl_old_mean)
-                    if kl_old.numel() > 0 and kl_old.max().item() > 100:
-                        log.warning(f"KL-divergence is very high: {kl_old.max().item():.4f}")
 
                 # update the weights
                 with timing.add_time("update"):
@@ -808,7 +920,7 @@ class Learner(Configurable):
                     self._after_optimizer_step()
 
                     if self.lr_scheduler.invoke_after_each_minibatch():
-                        self.curr_lr = self.lr_scheduler.update(self.curr_lr, recent_kls)
+                        self._update_lr(recent_kls)
 
                     # collect and report summaries
                     should_record_summaries = with_summaries
@@ -821,31 +933,102 @@ class Learner(Configurable):
                         del summary_vars
                         force_summaries = False
 
-                    # make sure everything (such as policy weights) is committed to shared device memory
-                    synchronize(self.cfg, self.device)
-                    # this will force policy update on the inference worker (policy worker)
-                    self.policy_versions_tensor[self.policy_id] = self.train_step
+                    self._publish_policy_version()
 
             # end of an epoch
             if self.lr_scheduler.invoke_after_each_epoch():
-                self.curr_lr = self.lr_scheduler.update(self.curr_lr, recent_kls)
-
-            new_epoch_actor_loss = float(np.mean(epoch_actor_losses))
-            loss_delta_abs = abs(prev_epoch_actor_loss - new_epoch_actor_loss)
-            if loss_delta_abs < early_stopping_tolerance:
-                early_stop = True
-                log.debug(
-                    "Early stopping after %d epochs (%d sgd steps), loss delta %.7f",
-                    epoch + 1,
-                    num_sgd_steps,
-                    loss_delta_abs,
+                self._update_lr(recent_kls)
+
+            if deferred_stats:
+                # evaluate early stopping lazily, only for the epochs whose losses have already arrived on the host
+                epoch_stats = minibatch_stats[epoch]
+                epoch_losses = torch.stack(
+                    [
+                        epoch_stats[:, _MinibatchStat.ACTOR_LOSS].mean(),
+                        epoch_stats[:, _MinibatchStat.LOSS_ABS].max(),
+                    ]
                 )
+                epoch_loss_readbacks.append((epoch, DeferredReadback(epoch_losses)))
+                new_epoch_actor_losses = []
+                while epoch_loss_readbacks and epoch_loss_readbacks[0][1].ready():
+                    loss_epoch, readback = epoch_loss_readbacks.pop(0)
+                    epoch_actor_loss, max_loss_abs = readback.get().tolist()
+                    new_epoch_actor_losses.append((loss_epoch, epoch_actor_loss))
+                    num_epochs_read_back = loss_epoch + 1
+                    # we definitely want summaries after a high loss, we get them from the next minibatch
+                    force_summaries |= max_loss_abs > _HIGH_LOSS
+            else:
+                new_epoch_actor_losses = [(epoch, float(np.mean(epoch_actor_losses)))]
+
+            for loss_epoch, new_epoch_actor_loss in new_epoch_actor_losses:
+                loss_delta_abs = abs(prev_epoch_actor_loss - new_epoch_actor_loss)
+                if loss_delta_abs < early_stopping_tolerance:
+                    early_stop = True
+                    log.debug(
+                        "Early stopping after %d epochs (%d sgd steps), loss delta %.7f",
+                        loss_epoch + 1,
+                        num_sgd_steps,
+                        loss_delta_abs,
+                    )
+                    break
+
+                prev_epoch_actor_loss = new_epoch_actor_loss
+
+            if early_stop:
                 break
 
-            prev_epoch_actor_loss = new_epoch_actor_loss
+        if deferred_stats:
+            with torch.no_grad(), timing.add_time("deferred_stats"):
+                # the single readback of everything we accumulated during this training iteration
+                minibatch_stats = minibatch_stats[: epoch + 1].cpu()
+                self._report_deferred_warnings(minibatch_stats)
+
+                # high losses we haven't seen yet, the last minibatch is the closest we can get to them now
+                unseen_losses = minibatch_stats[num_epochs_read_back:, :, _MinibatchStat.LOSS_ABS]
+                force_summaries |= unseen_losses.numel() > 0 and unseen_losses.max().item() > _HIGH_LOSS
+                if force_summaries:
+                    summary_vars = {**locals(), **loss_summaries}
+                    stats_and_summaries = self._record_summaries(AttrDict(summary_vars))
+                    del summary_vars
+
+                if stats_and_summaries is not None:
+                    stats_and_summaries = self._summaries_to_scalars(stats_and_summaries)
 
         return stats_and_summaries
 
+    def _publish_policy_version(self) -> None:
+        # make sure everything (such as policy weights) is committed to shared device memory
+        synchronize(self.cfg, self.device)
+        # this will force policy update on the inference worker (policy worker)
+        self.param_server.update_weights(self.train_step, state_lock=self._prefetch_lock())
+
+    def _update_lr(self, recent_kls: List[float | Tensor]) -> None:
+        if self.cfg.deferred_train_stats and self.lr_scheduler.uses_kls():
+            # KL-adaptive schedulers need actual values, so here we have no choice but to wait for the device
+            recent_kls = stack_to_scalars(recent_kls)
+        self.curr_lr = self.lr_scheduler.update(self.curr_lr, recent_kls)
+
+    def _report_deferred_warnings(self, minibatch_stats: Tensor) -> None:
+        """Warnings that we would otherwise issue immediately after each minibatch."""
+        max_loss_abs = minibatch_stats[:, :, _MinibatchStat.LOSS_ABS].max().item()
+        if max_loss_abs > _HIGH_LOSS:
+            log.warning(
+                "High loss value: %.4f (recommended to adjust the --reward_scale parameter)",
+                max_loss_abs,
+            )
+
+        max_kl = minibatch_stats[:, :, _MinibatchStat.KL_MAX].max().item()
+        if max_kl > _HIGH_KL:
+            log.warning(f"KL-divergence is very high: {max_kl:.4f}")
+
+    @staticmethod
+    def _summaries_to_scalars(stats: AttrDict) -> AttrDict:
+        tensor_keys = [key for key, value in stats.items() if isinstance(value, Tensor)]
+        scalars = stack_to_scalars([stats[key] for key in tensor_keys])
+        for key, value in zip(tensor_keys, scalars):
+            stats[key] = value
+        return stats
+
     def _record_summaries(self, train_loop_vars) -> AttrDict:
         var = train_loop_vars
 
@@ -861,10 +1044,8 @@ class Learner(Configurable):
         stats.valids_fraction = var.mb.valids.float().mean()
         stats.same_policy_fraction = (var.mb.policy_id == self.policy_id).float().mean()
 
-        grad_norm = (
-            sum(p.grad.data.norm(2).item() ** 2 for p in self.actor_critic.parameters() if p.grad is not None) ** 0.5
-        )
-        stats.grad_norm = grad_norm
+        grad_norms = [p.grad.data.norm(2) for p in self.actor_critic.parameters() if p.grad is not None]
+        stats.grad_norm = torch.stack(grad_norms).norm(2) if grad_norms else 0.0
         stats.loss = var.loss
         stats.value = var.values.mean()
         stats.entropy = var.action_distribution.entropy().mean()
@@ -887,7 +1068,7 @@ class Learner(Configurable):
         if hasattr(var.action_distribution, "summaries"):
             stats.update(var.action_distribution.summaries())
 
-        if var.epoch == self.cfg.num_epochs - 1 and var.batch_num == len(var.minibatches) - 1:
+        if var.epoch == self.cfg.num_epochs - 1 and var.batch_num == var.num_minibatches - 1:
             # we collect these stats only for the last PPO batch, or every time if we're only doing one batch, IMPALA-style
             valid_ratios = masked_select(var.ratio, var.mb.valids, var.num_invalids)
             ratio_mean = torch.abs(1.0 - valid_ratios).mean().detach()
@@ -912,21 +1093,23 @@ class Learner(Configurable):
             stats.num_sgd_steps = var.num_sgd_steps
 
         # this caused numerical issues on some versions of PyTorch with second moment reaching infinity
-        adam_max_second_moment = 0.0
-        for key, tensor_state in self.optimizer.state.items():
-            if "exp_avg_sq" in tensor_state:
-                adam_max_second_moment = max(tensor_state["exp_avg_sq"].max().item(), adam_max_second_moment)
-        stats.adam_max_second_moment = adam_max_second_moment
+        second_moments = [s["exp_avg_sq"].max() for s in self.optimizer.state.values() if "exp_avg_sq" in s]
+        stats.adam_max_second_moment = torch.stack(second_moments).max().clamp_min(0.0) if second_moments else 0.0
 
         version_diff = (var.curr_policy_version - var.mb.policy_version)[var.mb.policy_id == self.policy_id]
         stats.version_diff_avg = version_diff.mean()
         stats.version_diff_min = version_diff.min()
         stats.version_diff_max = version_diff.max()
 
-        for key, value in stats.items():
-            stats[key] = to_scalar(value)
+        if self.cfg.deferred_train_stats:
+            # stats will be read back from the device at the end of the training iteration,
+            # we don't want to keep the autograd graph of this minibatch alive until then
+            for key, value in stats.items():
+                if isinstance(value, Tensor):
+                    stats[key] = value.detach()
+            return stats
 
-        return stats
+        return self._summaries_to_scalars(stats)
 
     def _prepare_and_normalize_obs(self, obs: TensorDict) -> TensorDict:
         og_shape = dict()
@@ -937,8 +1120,8 @@ class Learner(Configurable):
             obs[key] = x.view((x.shape[0] * x.shape[1],) + x.shape[2:])
 
         # hold the lock while we alter the state of the normalizer since they can be used in other processes too
-        with self.param_server.policy_lock:
-            normalized_obs = prepare_and_normalize_obs(self.actor_critic, obs)
+        # (only while we merge the statistics of the batch, they are calculated outside of the lock)
+        normalized_obs = prepare_and_normalize_obs(self.actor_critic, obs, stats_lock=self.param_server.policy_lock)
 
         # restore original shape
         for key, x in normalized_obs.items():
@@ -946,7 +1129,9 @@ class Learner(Configurable):
 
         return normalized_obs
 
-    def _prepare_batch(self, batch: TensorDict) -> Tuple[TensorDict, int, int]:
+    def _prepare_batch(
+        self, batch: TensorDict, defer_returns_normalization: bool = False
+    ) -> Tuple[TensorDict, int, int]:
         with torch.no_grad():
             # create a shallow copy so we can modify the dictionary
             # we still reference the same buffers though
@@ -968,9 +1153,11 @@ class Learner(Configurable):
             del buff["obs"]  # don't need non-normalized obs anymore
 
             # calculate estimated value for the next step (T+1)
+            # with prefetching this runs concurrently with SGD, so we must not read the weights mid optimizer step
             normalized_last_obs = buff["normalized_obs"][:, -1]
-            next_values = self.actor_critic(normalized_last_obs, buff["rnn_states"][:, -1], values_only=True)["values"]
-            buff["values"][:, -1] = next_values
+            with self._prefetch_lock():
+                next_values = self.actor_critic(normalized_last_obs, buff["rnn_states"][:, -1], values_only=True)
+            buff["values"][:, -1] = next_values["values"]
 
             if self.cfg.normalize_returns:
                 # Since our value targets are normalized, the values will also have normalized statistics.
@@ -1004,6 +1191,7 @@ class Learner(Configurable):
                     buff["valids"],
                     self.cfg.gamma,
                     self.cfg.gae_lambda,
+                    self.cfg.gae_block_size,
                 )
                 # here returns are not normalized yet, so we should use denormalized values
                 buff["returns"] = buff["advantages"] + buff["valids"][:, :-1] * denormalized_values[:, :-1]
@@ -1018,11 +1206,9 @@ class Learner(Configurable):
                 d[k] = v.reshape((dataset_size,) + tuple(v.shape[2:]))
 
             buff["dones_cpu"] = buff["dones"].to("cpu", copy=True, dtype=torch.float, non_blocking=True)
-            buff["rewards_cpu"] = buff["rewards"].to("cpu", copy=True, dtype=torch.float, non_blocking=True)
 
-            # return normalization parameters are only used on the learner, no need to lock the mutex
-            if self.cfg.normalize_returns:
-                self.actor_critic.returns_normalizer(buff["returns"])  # in-place
+            if self.cfg.normalize_returns and not defer_returns_normalization:
+                self._normalize_returns(buff)
 
             num_invalids = dataset_size - buff["valids"].sum().item()
             if num_invalids > 0:
@@ -1030,22 +1216,84 @@ class Learner(Configurable):
                 if invalid_fraction > 0.5:
                     log.warning(f"{self.policy_id=} batch has {invalid_fraction:.2%} of invalid samples")
 
-                # invalid action values can cause problems when we calculate logprobs
-                # here we set them to 0 just to be safe
-                invalid_indices = (buff["valids"] == 0).nonzero().squeeze()
-                buff["actions"][invalid_indices] = 0
-                # likewise, some invalid values of log_prob_actions can cause NaNs or infs
-                buff["log_prob_actions"][invalid_indices] = -1  # -1 seems like a safe value
+                self._sanitize_invalid_steps(buff, buff["valids"] == 0)
 
             return buff, dataset_size, num_invalids
 
-    def train(self, batch: TensorDict) -> Optional[Dict]:
+    @staticmethod
+    def _sanitize_invalid_steps(buff: TensorDict, invalid: Tensor) -> None:
+        # invalid action values can cause problems when we calculate logprobs
+        # here we set them to 0 just to be safe
+        invalid_indices = invalid.nonzero().squeeze()
+        buff["actions"][invalid_indices] = 0
+        # likewise, some invalid values of log_prob_actions can cause NaNs or infs
+        buff["log_prob_actions"][invalid_indices] = -1  # -1 seems like a safe value
+
+    def _normalize_returns(self, buff: TensorDict) -> None:
+        # only valid steps contribute to the statistics, returns of the invalid steps are never used as targets.
+        # Return normalization parameters are only used on the learner, but with prefetching this runs
+        # concurrently with publishing the weights and saving checkpoints, which read the same state_dict
+        with self._prefetch_lock():
+            self.actor_critic.returns_normalizer(buff["returns"], valids=buff["valids"])  # in-place
+
+    def prefetch_batch(self, batch: TensorDict) -> AttrDict:
+        """
+        Prepare the training batch ahead of time, while the learner is still busy with the previous one.
+        Called from the prefetcher thread. On GPU all work is issued on a separate CUDA stream so it can overlap
+        with SGD on the main stream.
+        """
+        ready_event = None
+        # some of the steps can become stale before we train on this batch, so we update the return normalization
+        # statistics only after they are masked out, see _use_prefetched_batch()
+        if self.prefetch_stream is None:
+            buff, experience_size, num_invalids = self._prepare_batch(batch, defer_returns_normalization=True)
+        else:
+            # the batcher copies trajectories into the training batch on the default stream
+            self.prefetch_stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(self.prefetch_stream):
+                buff, experience_size, num_invalids = self._prepare_batch(batch, defer_returns_normalization=True)
+                ready_event = torch.cuda.Event()
+                ready_event.record(self.prefetch_stream)
+
+        return AttrDict(buff=buff, experience_size=experience_size, num_invalids=num_invalids, ready_event=ready_event)
+
+    def _use_prefetched_batch(self, prefetched: AttrDict) -> Tuple[TensorDict, int, int]:
+        buff, experience_size, num_invalids = prefetched.buff, prefetched.experience_size, prefetched.num_invalids
+
+        if prefetched.ready_event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(prefetched.ready_event)
+            # tensors were allocated on the prefetch stream, make sure the allocator does not reuse their memory
+            # before we're done with them on the main stream
+            for _, _, v in iterate_recursively(buff):
+                if v.is_cuda:
+                    v.record_stream(stream)
+
+        # the batch was validated against an older train_step, some of the experience might have become too old since
+        # then. Policy versions only grow along the trajectory and advantages are propagated backwards in time,
+        # so masking out the stale steps does not change advantages and returns of the remaining valid steps.
+        stale = buff["valids"] & (self.train_step - buff["policy_version"] >= self.cfg.max_policy_lag)
+        num_stale = stale.sum().item()
+        if num_stale > 0:
+            buff["valids"][stale] = False
+            num_invalids += num_stale
+            self._sanitize_invalid_steps(buff, stale)
+
+        if self.cfg.normalize_returns:
+            self._normalize_returns(buff)
+
+        return buff, experience_size, num_invalids
+
+    def train(self, batch: TensorDict, prefetched: Optional[AttrDict] = None) -> Optional[Dict]:
         with self.timing.add_time("misc"):
             self._maybe_update_cfg()
             self._maybe_load_policy()
 
         with self.timing.add_time("prepare_batch"):
-            buff, experience_size, num_invalids = self._prepare_batch(batch)
+            if prefetched is None:
+                buff, experience_size, num_invalids = self._prepare_batch(batch)
+            else:
+                buff, experience_size, num_invalids = self._use_prefetched_batch(prefetched)
 
         if num_invalids >= experience_size:
             if self.cfg.with_pbt:
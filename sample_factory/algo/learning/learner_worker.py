@@ -9,6 +9,7 @@ import torch
 from signal_slot.signal_slot import EventLoop, Timer, signal
 from torch import Tensor
 
+from sample_factory.algo.learning.batch_prefetcher import BatchPrefetcher
 from sample_factory.algo.learning.batcher import Batcher
 from sample_factory.algo.learning.learner import Learner
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
@@ -20,6 +21,7 @@ from sample_factory.algo.utils.shared_buffers import BufferMgr
 from sample_factory.algo.utils.torch_utils import init_torch_runtime
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.utils.gpu_utils import cuda_envvars_for_policy
+from sample_factory.utils.tracing import init_tracing, save_process_trace
 from sample_factory.utils.typing import Config, PolicyID
 from sample_factory.utils.utils import init_file_logger, log
 
@@ -35,6 +37,7 @@ def init_learner_process(sf_context: SampleFactoryContext, learner_worker: Learn
 
     cfg = learner_worker.cfg
     init_file_logger(cfg)
+    init_tracing(cfg)
 
     try:
         psutil.Process().nice(cfg.default_niceness)
@@ -66,9 +69,18 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
         self.batcher_thread: Optional[Thread] = None
 
         policy_versions_tensor: Tensor = buffer_mgr.policy_versions
-        self.param_server = ParameterServer(policy_id, policy_versions_tensor, cfg.serial_mode)
+        self.param_server = ParameterServer(policy_id, policy_versions_tensor, cfg.serial_mode, cfg.weight_slots)
         self.learner: Learner = Learner(cfg, env_info, policy_versions_tensor, policy_id, self.param_server)
 
+        self.prefetcher: Optional[BatchPrefetcher] = None
+        self.prefetcher_thread: Optional[Thread] = None
+        if self.learner.prefetching:
+            prefetcher_event_loop = EventLoop("prefetcher_evt_loop")
+            self.prefetcher = BatchPrefetcher(
+                prefetcher_event_loop, self.learner, self.batcher, cfg.learner_prefetch_batches
+            )
+            prefetcher_event_loop.owner = self.prefetcher
+
         # total number of full training iterations (potentially multiple minibatches/epochs per iteration)
         self.training_iteration_since_resume: int = 0
 
@@ -93,26 +105,46 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
     @signal
     def saved_model(self): ...
 
+    @signal
+    def exported_model(self): ...
+
     @signal
     def stop(self): ...
 
     def save(self) -> bool:
         if self.learner.save():
-            self.saved_model.emit(self.learner.policy_id)
+            self._on_model_saved()
             return True
         return False
 
     def save_best(self, policy_id: PolicyID, metric: str, metric_value: float) -> bool:
         if self.learner.save_best(policy_id, metric, metric_value):
-            self.saved_model.emit(self.learner.policy_id)
+            self._on_model_saved()
             return True
         return False
 
+    def _on_model_saved(self) -> None:
+        if self.learner.checkpoint_writer is None:
+            self.saved_model.emit(self.learner.policy_id)
+        else:
+            # with async checkpoints we let others know only when the checkpoint is actually on disk
+            self._report_written_checkpoints()
+
+    def _report_written_checkpoints(self) -> None:
+        if self.learner.checkpoint_writer is not None:
+            for _ in range(self.learner.checkpoint_writer.pop_completed()):
+                self.saved_model.emit(self.learner.policy_id)
+
     def save_milestone(self) -> None:
         self.learner.save_milestone()
 
-    def load(self, policy_to_load: PolicyID) -> None:
-        self.learner.set_policy_to_load(policy_to_load)
+    def export_model(self) -> None:
+        """Share the latest model and optimizer state with other learners without saving a checkpoint."""
+        if self.learner.is_initialized:
+            self.exported_model.emit(self.learner.policy_id, self.learner.export_state())
+
+    def load(self, policy_to_load: PolicyID, state: Optional[Dict] = None) -> None:
+        self.learner.set_policy_to_load(policy_to_load, state)
 
     def on_update_cfg(self, new_cfg: Dict) -> None:
         self.learner.set_new_cfg(new_cfg)
@@ -125,9 +157,20 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
     def join_batcher_thread(self):
         self.batcher_thread.join()
 
+    def start_prefetcher_thread(self):
+        self.prefetcher.event_loop.process = self.event_loop.process
+        self.prefetcher_thread = Thread(target=self.prefetcher.event_loop.exec)
+        self.prefetcher_thread.start()
+
+    def join_prefetcher_thread(self):
+        self.prefetcher.event_loop.stop()
+        self.prefetcher_thread.join()
+
     def init(self):
         if not self.cfg.serial_mode:
             self.start_batcher_thread()
+        if self.prefetcher is not None:
+            self.start_prefetcher_thread()
 
         init_model_data = self.learner.init()
         # signal other components that the model is ready
@@ -141,23 +184,44 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
     def on_new_training_batch(self, batch_idx: int):
         stats = self.learner.train(self.batcher.training_batches[batch_idx])
+        self._after_training_batch(batch_idx, stats)
+
+    def on_prefetched_training_batch(self, batch_idx: int):
+        prefetched = self.prefetcher.pop_prefetched_batch(batch_idx)
+        stats = self.learner.train(self.batcher.training_batches[batch_idx], prefetched)
+        self._after_training_batch(batch_idx, stats)
 
+    def _after_training_batch(self, batch_idx: int, stats: Optional[Dict]):
         self.training_iteration_since_resume += 1
         self.training_batch_released.emit(batch_idx, self.training_iteration_since_resume)
         self.finished_training_iteration.emit(self.training_iteration_since_resume)
         if stats is not None:
             self.report_msg.emit(stats)
 
+        self._report_written_checkpoints()
+
     # noinspection PyMethodMayBeStatic
     def _cleanup_cache(self):
         torch.cuda.empty_cache()
 
     def on_stop(self, *args):
         self.learner.save()
+        if self.learner.checkpoint_writer is not None:
+            self.learner.checkpoint_writer.close()
+            self._report_written_checkpoints()
         if not self.cfg.serial_mode:
             self.join_batcher_thread()
 
-        self.stop.emit(self.object_id, {self.object_id: self.learner.timing})
+        timings = {self.object_id: self.learner.timing}
+        if self.prefetcher is not None:
+            self.join_prefetcher_thread()
+            timings[self.prefetcher.object_id] = self.prefetcher.timing
+        if self.learner.checkpoint_writer is not None:
+            timings[f"{self.object_id}_checkpoint_writer"] = self.learner.checkpoint_writer.timing
+
+        if not self.cfg.serial_mode:
+            save_process_trace(self.cfg)
+        self.stop.emit(self.object_id, timings)
 
         super().on_stop(*args)
         del self.learner.actor_critic
@@ -1,13 +1,30 @@
-from typing import Tuple
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
 
+import numpy as np
 import torch
 
 # noinspection PyPep8Naming
 from torch.nn.utils.rnn import PackedSequence, invert_permutation
 
+from sample_factory.algo.utils.torch_compile import disable_compile
 from sample_factory.utils.utils import log
 
 
+class PackInfo(NamedTuple):
+    rollout_starts: torch.Tensor
+    is_same_episode: Optional[torch.Tensor]
+    select_inds: torch.Tensor
+    inverted_select_inds: torch.Tensor
+    batch_sizes: torch.Tensor
+    sorted_indices: torch.Tensor
+
+
+# pack info for the most recently seen layouts of sequences, see _pack_info()
+_PACK_INFO_CACHE_SIZE = 64
+_pack_info_cache: OrderedDict[Tuple, PackInfo] = OrderedDict()
+
+
 def _build_pack_info_from_dones(
     dones: torch.Tensor, T: int
 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
@@ -56,10 +73,7 @@ def _build_pack_info_from_dones(
     is_new_episode[:, 0] = 0
     is_new_episode = is_new_episode.view((-1,))
 
-    lengths, sorted_indices = torch.sort(rollout_lengths, descending=True)
-    # We will want these on the CPU for torch.unique_consecutive,
-    # so move now.
-    cpu_lengths = lengths.to(device="cpu", non_blocking=True)
+    lengths, sorted_indices = torch.sort(rollout_lengths, descending=True, stable=True)
 
     # We need to keep the original unpermuted rollout_starts, because the permutation is later applied
     # internally in the RNN implementation.
@@ -69,46 +83,81 @@ def _build_pack_info_from_dones(
     #       hx = self.permute_hidden(hx, sorted_indices)
     rollout_starts_sorted = rollout_starts_orig.index_select(0, sorted_indices)
 
-    select_inds = torch.empty(num_samples, device=dones.device, dtype=torch.int64)
+    max_length = int(lengths[0].item())
+    timesteps = torch.arange(max_length, device=dones.device).view(max_length, 1)
+
+    # [max_length, num_sequences] mask of sequences that are still going at each timestep. Since the sequences
+    # are sorted by length, these are always the first batch_sizes[t] sequences
+    is_active = lengths.view(1, -1) > timesteps
 
-    max_length = int(cpu_lengths[0].item())
     # batch_sizes is *always* on the CPU
-    batch_sizes = torch.empty((max_length,), device="cpu", dtype=torch.int64)
+    batch_sizes = is_active.sum(dim=1).to(device="cpu", dtype=torch.int64)
 
-    offset = 0
-    prev_len = 0
-    num_valid_for_length = lengths.size(0)
+    # for a set of sequences [1, 2, 3], [4, 5], [6, 7], [8]
+    # these indices will be 1,4,6,8,2,5,7,3
+    # (all first steps in all trajectories, then all second steps, etc.)
+    select_inds = (rollout_starts_sorted.view(1, -1) + timesteps)[is_active]
 
-    unique_lengths = torch.unique_consecutive(cpu_lengths)
-    # Iterate over all unique lengths in reverse as they sorted
-    # in decreasing order
-    for i in range(len(unique_lengths) - 1, -1, -1):
-        valids = lengths[0:num_valid_for_length] > prev_len
-        num_valid_for_length = int(valids.float().sum().item())
+    # Make sure we have an index for all elements
+    assert select_inds.numel() == num_samples
+    assert is_new_episode.shape[0] == num_samples
 
-        next_len = int(unique_lengths[i])
+    return rollout_starts_orig, is_new_episode, select_inds, batch_sizes, sorted_indices
 
-        batch_sizes[prev_len:next_len] = num_valid_for_length
 
-        new_inds = (
-            rollout_starts_sorted[0:num_valid_for_length].view(1, num_valid_for_length)
-            + torch.arange(prev_len, next_len, device=rollout_starts_sorted.device).view(next_len - prev_len, 1)
-        ).view(-1)
+def _done_mask_signature(dones: torch.Tensor) -> Optional[bytes]:
+    """Compact representation of the done mask that identifies the layout of sequences, None if there are no dones."""
+    dones = dones.detach().cpu().numpy() != 0
+    return np.packbits(dones).tobytes() if dones.any() else None
 
-        # for a set of sequences [1, 2, 3], [4, 5], [6, 7], [8]
-        # these indices will be 1,4,6,8,2,5,7,3
-        # (all first steps in all trajectories, then all second steps, etc.)
-        select_inds[offset : offset + new_inds.numel()] = new_inds
 
-        offset += new_inds.numel()
+@disable_compile
+def _pack_info(dones: torch.Tensor, T: int, device: torch.device) -> PackInfo:
+    """
+    Memoized version of _build_pack_info_from_dones() that also moves the index tensors to the target device.
+    Many minibatches share the same layout of sequences (e.g. no dones at all, which is the common case
+    for long episodes, or the same episode boundaries in every minibatch for fixed-length episodes),
+    so we only build indices once per layout.
+    """
+    done_mask_signature = _done_mask_signature(dones)
+    key = (T, len(dones), done_mask_signature, str(device))
+    if (pack_info := _pack_info_cache.get(key)) is not None:
+        _pack_info_cache.move_to_end(key)
+        return pack_info
+
+    if done_mask_signature is None:
+        # fast path: no episode boundaries, every rollout is a single sequence of length T
+        num_sequences = len(dones) // T
+        rollout_starts = torch.arange(0, len(dones), T, device=device)
+        is_same_episode = None  # no need to zero-out any rnn states
+        select_inds = torch.arange(len(dones), device=device).view(num_sequences, T).t().reshape(-1)
+        batch_sizes = torch.full((T,), num_sequences, dtype=torch.int64)
+        sorted_indices = torch.arange(num_sequences, device=device)
+    else:
+        rollout_starts, is_new_episode, select_inds, batch_sizes, sorted_indices = _build_pack_info_from_dones(dones, T)
+        is_same_episode = (1 - is_new_episode.view(-1, 1)).index_select(0, rollout_starts).to(device)
+        rollout_starts, select_inds, sorted_indices = (
+            t.to(device) for t in (rollout_starts, select_inds, sorted_indices)
+        )
 
-        prev_len = next_len
+    pack_info = PackInfo(
+        rollout_starts, is_same_episode, select_inds, invert_permutation(select_inds), batch_sizes, sorted_indices
+    )
 
-    # Make sure we have an index for all elements
-    assert offset == num_samples
-    assert is_new_episode.shape[0] == num_samples
+    _pack_info_cache[key] = pack_info
+    if len(_pack_info_cache) > _PACK_INFO_CACHE_SIZE:
+        _pack_info_cache.popitem(last=False)
+
+    return pack_info
 
-    return rollout_starts_orig, is_new_episode, select_inds, batch_sizes, sorted_indices
+
+def pack_info_cache_size() -> int:
+    """Number of sequence layouts with memoized pack info, see _pack_info()."""
+    return len(_pack_info_cache)
+
+
+def clear_pack_info_cache() -> None:
+    _pack_info_cache.clear()
 
 
 def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
@@ -127,19 +176,9 @@ def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
         rnn_states are the corresponding rnn state, zeroed on the episode boundary
         inverted_select_inds can be passed to build_core_out_from_seq so the RNN output can be retrieved
     """
-    rollout_starts, is_new_episode, select_inds, batch_sizes, sorted_indices = _build_pack_info_from_dones(dones_cpu, T)
-    inverted_select_inds = invert_permutation(select_inds)
-
-    def device(t):
-        return t.to(device=x.device)
-
-    select_inds = device(select_inds)
-    inverted_select_inds = device(inverted_select_inds)
-    sorted_indices = device(sorted_indices)
-    rollout_starts = device(rollout_starts)
-    is_new_episode = device(is_new_episode)
+    pack_info = _pack_info(dones_cpu, T, x.device)
 
-    x_seq = PackedSequence(x.index_select(0, select_inds), batch_sizes, sorted_indices)
+    x_seq = PackedSequence(x.index_select(0, pack_info.select_inds), pack_info.batch_sizes, pack_info.sorted_indices)
 
     # We zero-out rnn states for timesteps at the beginning of the episode.
     # rollout_starts are indices of all starts of sequences
@@ -147,11 +186,11 @@ def build_rnn_inputs(x, dones_cpu, rnn_states, T: int):
     # (1 - is_new_episode.view(-1, 1)).index_select(0, rollout_starts) gives us a zero for every beginning of
     # the sequence that is actually also a start of a new episode, and by multiplying this RNN state by zero
     # we ensure no information transfer across episode boundaries.
-    rnn_states = rnn_states.index_select(0, rollout_starts)
-    is_same_episode = (1 - is_new_episode.view(-1, 1)).index_select(0, rollout_starts)
-    rnn_states = rnn_states * is_same_episode
+    rnn_states = rnn_states.index_select(0, pack_info.rollout_starts)
+    if pack_info.is_same_episode is not None:
+        rnn_states = rnn_states * pack_info.is_same_episode
 
-    return x_seq, rnn_states, inverted_select_inds
+    return x_seq, rnn_states, pack_info.inverted_select_inds
 
 
 def build_core_out_from_seq(x_seq: PackedSequence, inverted_select_inds):
@@ -15,9 +15,19 @@ from tensorboardX import SummaryWriter
 from sample_factory.algo.learning.batcher import Batcher
 from sample_factory.algo.learning.learner_worker import LearnerWorker
 from sample_factory.algo.sampling.sampler import AbstractSampler
-from sample_factory.algo.sampling.stats import samples_stats_handler, stats_msg_handler, timing_msg_handler
+from sample_factory.algo.sampling.stats import (
+    WindowedStats,
+    samples_stats_handler,
+    stats_msg_handler,
+    timing_msg_handler,
+    window_max,
+    window_mean,
+    window_min,
+)
+from sample_factory.algo.utils.async_summary_writer import AsyncSummaryWriter, PolicySummaryWriter
 from sample_factory.algo.utils.env_info import EnvInfo, obtain_env_info_in_a_separate_process
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
+from sample_factory.algo.utils.memory_planner import check_memory_budget
 from sample_factory.algo.utils.misc import (
     EPISODIC,
     LEARNER_ENV_STEPS,
@@ -33,10 +43,13 @@ from sample_factory.cfg.configurable import Configurable
 from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.dicts import iterate_recursively
 from sample_factory.utils.gpu_utils import set_global_cuda_envvars
+from sample_factory.utils.metrics_server import Metric, MetricsServer
 from sample_factory.utils.timing import Timing
+from sample_factory.utils.tracing import clear_traces, init_tracing, merge_traces
 from sample_factory.utils.typing import PolicyID, StatusCode
 from sample_factory.utils.utils import (
     cfg_file,
+    child_processes_memory_mb,
     debug_log_every_n,
     ensure_dir_exists,
     experiment_dir,
@@ -135,11 +148,26 @@ class Runner(EventLoopObject, Configurable):
 
         init_wandb(self.cfg)  # should be done before writers are initialized
 
-        self.writers: Dict[int, SummaryWriter] = dict()
+        summary_dirs = dict()
         for policy_id in range(self.cfg.num_policies):
             summary_dir = join(summaries_dir(experiment_dir(cfg=self.cfg)), str(policy_id))
-            summary_dir = ensure_dir_exists(summary_dir)
-            self.writers[policy_id] = SummaryWriter(summary_dir, flush_secs=cfg.flush_summaries_interval)
+            summary_dirs[policy_id] = ensure_dir_exists(summary_dir)
+
+        self.async_summary_writer: Optional[AsyncSummaryWriter] = None
+        self.summaries_dropped = 0
+        if self.cfg.async_summaries_queue_size > 0 and self.cfg.with_wandb:
+            log.warning("Async summaries are not compatible with wandb, writing summaries in the runner process")
+        elif self.cfg.async_summaries_queue_size > 0:
+            self.async_summary_writer = AsyncSummaryWriter(
+                summary_dirs, cfg.flush_summaries_interval, cfg.async_summaries_queue_size
+            )
+
+        self.writers: Dict[int, SummaryWriter | PolicySummaryWriter] = dict()
+        for policy_id, summary_dir in summary_dirs.items():
+            if self.async_summary_writer is None:
+                self.writers[policy_id] = SummaryWriter(summary_dir, flush_secs=cfg.flush_summaries_interval)
+            else:
+                self.writers[policy_id] = self.async_summary_writer.writers[policy_id]
 
         # global msg handlers for messages from algo components
         self.msg_handlers: Dict[str, List[MsgHandler]] = {
@@ -175,6 +203,10 @@ class Runner(EventLoopObject, Configurable):
         if self.cfg.save_milestones_sec > 0:
             periodic(self.cfg.save_milestones_sec, self._save_milestone_policy)
 
+        self.metrics_server: Optional[MetricsServer] = None
+        if self.cfg.metrics_port is not None:
+            periodic(self.report_interval_sec, self._update_metrics)
+
         periodic(self.heartbeat_report_sec, self._check_heartbeat)
 
         self.heartbeat_dict = {}
@@ -265,13 +297,13 @@ class Runner(EventLoopObject, Configurable):
         for _, key, value in iterate_recursively(s):
             if key not in runner.policy_avg_stats:
                 runner.policy_avg_stats[key] = [
-                    deque(maxlen=runner.cfg.stats_avg) for _ in range(runner.cfg.num_policies)
+                    WindowedStats(maxlen=runner.cfg.stats_avg) for _ in range(runner.cfg.num_policies)
                 ]
 
             if isinstance(value, np.ndarray) and value.ndim > 0:
                 if len(value) > runner.policy_avg_stats[key][policy_id].maxlen:
                     # increase maxlen to make sure we never ignore any stats from the environments
-                    runner.policy_avg_stats[key][policy_id] = deque(maxlen=len(value))
+                    runner.policy_avg_stats[key][policy_id] = WindowedStats(maxlen=len(value))
 
                 runner.policy_avg_stats[key][policy_id].extend(value)
             else:
@@ -339,7 +371,7 @@ class Runner(EventLoopObject, Configurable):
             for policy_id in range(self.cfg.num_policies):
                 reward_stats = self.policy_avg_stats["reward"][policy_id]
                 if len(reward_stats) > 0:
-                    policy_reward_stats.append((policy_id, f"{np.mean(reward_stats):.3f}"))
+                    policy_reward_stats.append((policy_id, f"{window_mean(reward_stats):.3f}"))
             log.debug("Avg episode reward: %r", policy_reward_stats)
 
     def _update_stats_and_print_report(self):
@@ -379,9 +411,11 @@ class Runner(EventLoopObject, Configurable):
                     writer.add_scalar("perf/_fps", fps, env_steps)
 
                 writer.add_scalar("stats/master_process_memory_mb", float(memory_mb), env_steps)
+                if self.async_summary_writer is not None:
+                    writer.add_scalar("stats/summaries_dropped", self.async_summary_writer.num_dropped, env_steps)
                 for key, value in self.avg_stats.items():
                     if len(value) >= value.maxlen or (len(value) > 10 and self.total_train_seconds > 300):
-                        writer.add_scalar(f"stats/{key}", np.mean(value), env_steps)
+                        writer.add_scalar(f"stats/{key}", window_mean(value), env_steps)
 
                 for key, value in self.stats.items():
                     writer.add_scalar(f"stats/{key}", value, env_steps)
@@ -393,35 +427,108 @@ class Runner(EventLoopObject, Configurable):
                 if len(stat[policy_id]) >= stat[policy_id].maxlen or (
                     len(stat[policy_id]) > 10 and self.total_train_seconds > 300
                 ):
-                    stat_value = np.mean(stat[policy_id])
+                    stat_value = window_mean(stat[policy_id])
 
                     if "/" in key:
                         # custom summaries have their own sections in tensorboard
                         avg_tag = key
                         min_tag = f"{key}_min"
                         max_tag = f"{key}_max"
+                        median_tag = f"{key}_median"
                     elif key in ("reward", "len"):
                         # reward and length get special treatment
                         avg_tag = f"{key}/{key}"
                         min_tag = f"{key}/{key}_min"
                         max_tag = f"{key}/{key}_max"
+                        median_tag = f"{key}/{key}_median"
                     else:
                         avg_tag = f"policy_stats/avg_{key}"
                         min_tag = f"policy_stats/avg_{key}_min"
                         max_tag = f"policy_stats/avg_{key}_max"
+                        median_tag = f"policy_stats/avg_{key}_median"
 
                     writer.add_scalar(avg_tag, float(stat_value), env_steps)
 
-                    # for key stats report min/max as well
+                    # for key stats report min/max/median as well
                     if key in ("reward", "true_objective", "len"):
-                        writer.add_scalar(min_tag, float(min(stat[policy_id])), env_steps)
-                        writer.add_scalar(max_tag, float(max(stat[policy_id])), env_steps)
+                        writer.add_scalar(min_tag, window_min(stat[policy_id]), env_steps)
+                        writer.add_scalar(max_tag, window_max(stat[policy_id]), env_steps)
+                        if isinstance(stat[policy_id], WindowedStats):
+                            writer.add_scalar(median_tag, stat[policy_id].quantile(0.5), env_steps)
 
             self._observers_call(AlgoObserver.extra_summaries, self, policy_id, writer, env_steps)
 
         for w in self.writers.values():
             w.flush()
 
+        if self.async_summary_writer is not None and self.async_summary_writer.num_dropped > self.summaries_dropped:
+            self.summaries_dropped = self.async_summary_writer.num_dropped
+            log.warning(f"Summary writer can't keep up, {self.summaries_dropped} summaries dropped so far")
+
+    def _collect_metrics(self) -> List[Metric]:
+        fps_stats, sample_throughput = self._get_perf_stats()
+
+        fps = Metric("sf_fps", "Environment steps per second (all policies), averaged over the interval")
+        for interval, fps_value in zip(self.avg_stats_intervals, fps_stats):
+            fps.add(fps_value, interval_sec=int(interval * self.report_interval_sec))
+
+        env_steps = Metric("sf_env_steps_total", "Environment steps per policy", "counter")
+        samples = Metric("sf_samples_collected_total", "Samples collected per policy", "counter")
+        throughput = Metric("sf_sample_throughput", "Samples per second processed per policy")
+        lag = Metric("sf_policy_lag", "Policy version difference between sampling and training")
+        for policy_id in range(self.cfg.num_policies):
+            if policy_id in self.env_steps:
+                env_steps.add(self.env_steps[policy_id], policy=policy_id)
+            samples.add(self.samples_collected[policy_id], policy=policy_id)
+            throughput.add(sample_throughput[policy_id], policy=policy_id)
+            for key, value in self.policy_lag[policy_id].items():
+                lag.add(value, policy=policy_id, stat=key.replace("version_diff_", ""))
+
+        timing = Metric("sf_timing_avg_seconds", "Average time of operations reported by components")
+        for key, value in self.avg_stats.items():
+            if len(value) > 0:
+                timing.add(window_mean(value), key=key)
+
+        stats = Metric("sf_stats", "Scalar stats reported by components (i.e. memory of learners, inference workers)")
+        for key, value in self.stats.items():
+            if isinstance(value, (int, float, np.number)):
+                stats.add(float(value), key=key)
+
+        queue_size = Metric("sf_queue_size", "Number of messages in the event loop queue of the process")
+        for p_name, qsize in self.queue_size_dict.items():
+            queue_size.add(qsize, process=p_name)
+
+        buffers_free = Metric("sf_trajectory_buffers_free", "Trajectory buffers available to rollout workers")
+        buffers_occupancy = Metric("sf_trajectory_buffers_occupancy", "Fraction of trajectory buffers in use")
+        if self.buffer_mgr is not None:
+            for device, num_buffers in self.buffer_mgr.buffers_per_device.items():
+                num_free = self.buffer_mgr.num_free_trajectories(device)
+                buffers_free.add(num_free, device=device)
+                buffers_occupancy.add(1.0 - num_free / max(1, num_buffers), device=device)
+
+        memory = Metric("sf_process_memory_mb", "Resident memory of the process")
+        memory.add(memory_consumption_mb(), process="runner")
+        for p_name, memory_mb in child_processes_memory_mb().items():
+            memory.add(memory_mb, process=p_name)
+
+        return [
+            fps,
+            env_steps,
+            samples,
+            throughput,
+            lag,
+            timing,
+            stats,
+            queue_size,
+            buffers_free,
+            buffers_occupancy,
+            memory,
+        ]
+
+    def _update_metrics(self):
+        if self.metrics_server is not None:
+            self.metrics_server.update(self._collect_metrics())
+
     def _propagate_training_info(self):
         """
         Send the training stats (such as the number of processed env steps) to the sampler.
@@ -471,7 +578,7 @@ class Runner(EventLoopObject, Configurable):
 
                 stats = self.policy_avg_stats[metric][policy_id]
                 if len(stats) > 0:
-                    avg_metric = np.mean(stats)
+                    avg_metric = window_mean(stats)
                     self.save_best.emit(policy_id, metric, avg_metric)
 
     @staticmethod
@@ -529,14 +636,25 @@ class Runner(EventLoopObject, Configurable):
         if not preprocess_cfg(self.cfg, self.env_info):
             return ExperimentStatus.FAILURE
 
+        # make sure buffers fit into memory before we allocate anything
+        if not check_memory_budget(self.cfg, self.env_info):
+            return ExperimentStatus.FAILURE
+
         log.debug(f"Starting experiment with the following configuration:\n{cfg_str(self.cfg)}")
 
         init_file_logger(self.cfg)
+        if self.cfg.trace_events:
+            clear_traces(self.cfg)
+        init_tracing(self.cfg)
         self._save_cfg()
         save_git_diff(experiment_dir(self.cfg))
 
         self.buffer_mgr = BufferMgr(self.cfg, self.env_info)
 
+        if self.cfg.metrics_port is not None:
+            self.metrics_server = MetricsServer("127.0.0.1", self.cfg.metrics_port)
+            log.info(f"Serving metrics at http://127.0.0.1:{self.metrics_server.port}/metrics")
+
         self._observers_call(AlgoObserver.on_init, self)
 
         return ExperimentStatus.SUCCESS
@@ -640,7 +758,14 @@ class Runner(EventLoopObject, Configurable):
             sampler.connect_trajectory_buffers_available(batcher.trajectory_buffers_available)
 
             # batcher gives learner batches of trajectories ready for learning
-            batcher.training_batches_available.connect(learner_worker.on_new_training_batch)
+            if (prefetcher := learner_worker.prefetcher) is not None:
+                # batches are prepared ahead of time in a separate thread, the prefetcher keeps track of batches
+                # in flight to limit the number of batches prepared in advance
+                batcher.training_batches_available.connect(prefetcher.on_new_training_batch)
+                prefetcher.prefetched_batch_available.connect(learner_worker.on_prefetched_training_batch)
+                learner_worker.training_batch_released.connect(prefetcher.on_training_batch_released)
+            else:
+                batcher.training_batches_available.connect(learner_worker.on_new_training_batch)
             # once learner is done with a training batch, it is given back to the batcher
             learner_worker.training_batch_released.connect(batcher.on_training_batch_released)
 
@@ -740,6 +865,13 @@ class Runner(EventLoopObject, Configurable):
 
         for w in self.writers.values():
             w.flush()
+        if self.async_summary_writer is not None:
+            self.async_summary_writer.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+        # all other processes saved their traces before they stopped
+        merge_traces(self.cfg)
 
         assert self.event_loop.owner is self
         self.event_loop.stop()
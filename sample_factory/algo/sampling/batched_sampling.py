@@ -13,6 +13,7 @@ from sample_factory.algo.sampling.sampling_utils import VectorEnvRunner, record_
 from sample_factory.algo.utils.env_info import EnvInfo, check_env_info
 from sample_factory.algo.utils.make_env import BatchedVecEnv, SequentialVectorizeWrapper, make_env_func_batched
 from sample_factory.algo.utils.misc import EPISODIC, POLICY_ID_KEY
+from sample_factory.algo.utils.subprocess_vec_env import SubprocessVectorizeWrapper
 from sample_factory.algo.utils.tensor_dict import TensorDict
 from sample_factory.algo.utils.torch_utils import synchronize
 from sample_factory.envs.env_utils import (
@@ -156,7 +157,7 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
         Actually instantiate the env instances.
         Also creates ActorState objects that hold the state of individual actors in (potentially) multi-agent envs.
         """
-        envs: List[BatchedVecEnv] = []
+        env_configs: List[AttrDict] = []
         for env_i in range(self.num_envs):
             vector_idx = self.split_idx * self.num_envs + env_i
 
@@ -169,20 +170,30 @@ class BatchedVectorEnvRunner(VectorEnvRunner):
                 env_id=env_id,
             )
 
-            # log.info('Creating env %r... %d-%d-%d', env_config, self.worker_idx, self.split_idx, env_i)
-            # a vectorized environment - we assume that it always provides a dict of vectors of obs, rewards, etc.
-            env: BatchedVecEnv = make_env_func_batched(self.cfg, env_config)
-            check_env_info(env, self.env_info, self.cfg)
+            env_configs.append(env_config)
 
-            env.seed(env_id)  # since Gym 0.26 seeding is done in reset(), we do it in BatchedVecEnv class
-            envs.append(env)
-
-        if len(envs) == 1:
-            # assuming this is already a vectorized environment
-            assert envs[0].num_agents >= 1  # sanity check
-            self.vec_env = envs[0]
+        if self.cfg.env_subprocesses > 0:
+            # envs are created and stepped in child processes
+            self.vec_env = SubprocessVectorizeWrapper(
+                self.cfg, self.env_info, env_configs, num_processes=self.cfg.env_subprocesses
+            )
         else:
-            self.vec_env = SequentialVectorizeWrapper(envs)
+            envs: List[BatchedVecEnv] = []
+            for env_config in env_configs:
+                # log.info('Creating env %r... %d-%d-%d', env_config, self.worker_idx, self.split_idx, env_i)
+                # a vectorized environment - we assume that it always provides a dict of vectors of obs, rewards, etc.
+                env: BatchedVecEnv = make_env_func_batched(self.cfg, env_config)
+                check_env_info(env, self.env_info, self.cfg)
+
+                env.seed(env_config.env_id)  # since Gym 0.26 seeding is done in reset(), we do it in BatchedVecEnv
+                envs.append(env)
+
+            if len(envs) == 1:
+                # assuming this is already a vectorized environment
+                assert envs[0].num_agents >= 1  # sanity check
+                self.vec_env = envs[0]
+            else:
+                self.vec_env = SequentialVectorizeWrapper(envs, num_threads=self.cfg.env_step_threads)
 
         self.env_training_info_interface = find_training_info_interface(self.vec_env)
 
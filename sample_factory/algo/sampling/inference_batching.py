@@ -0,0 +1,130 @@
+from collections import deque
+from typing import Deque, Dict, Sequence
+
+import numpy as np
+
+from sample_factory.utils.utils import log
+
+# always poll the request queue at least once, even if the latency budget is already exhausted by the forward pass
+MIN_WAIT_DEADLINE = 0.001
+
+
+class AdaptiveInferenceBatching:
+    """
+    Chooses how many inference requests to wait for, and for how long, given a target p99 latency.
+
+    Inference cost is modelled as fixed_cost + per_request_cost * num_requests (least squares over recent steps),
+    and requests are assumed to arrive at the rate measured over the same window. The largest batch that
+    can be collected and processed within the target latency is what we wait for, and the wait deadline is
+    whatever remains of the latency budget after the forward pass. On top of this model, measured p99 latency
+    scales the budget down (multiplicatively) when it exceeds the target and slowly lets it recover otherwise.
+
+    Latency of each request is measured from the moment a rollout worker enqueues it until its outputs are sent back,
+    so requests that queued up while the previous batch was processed are accounted for.
+    """
+
+    def __init__(
+        self,
+        target_latency: float,
+        min_num_requests: int,
+        wait_deadline: float,
+        max_num_requests: int,
+        window: int = 200,
+        update_every: int = 20,
+    ):
+        self.target_latency = target_latency
+        self.max_num_requests = max(1, max_num_requests)
+
+        # current operating point, starting from the conservative defaults
+        self.min_num_requests = max(1, min(min_num_requests, self.max_num_requests))
+        self.wait_deadline = max(MIN_WAIT_DEADLINE, min(wait_deadline, target_latency))
+
+        # per processed batch
+        self.batch_sizes: Deque[int] = deque([], maxlen=window)
+        self.step_times: Deque[float] = deque([], maxlen=window)
+        # per request, a batch usually has many of them
+        self.latencies: Deque[float] = deque([], maxlen=window * 10)
+
+        # per loop iteration, including the ones where no requests arrived
+        self.num_arrived: Deque[int] = deque([], maxlen=window)
+        self.wall_times: Deque[float] = deque([], maxlen=window)
+
+        self.budget_scale = 1.0
+        self.p99_latency = 0.0
+        self.fixed_cost = 0.0
+        self.per_request_cost = 0.0
+        self.arrival_rate = 0.0
+
+        self.update_every = update_every
+        self.steps_since_update = 0
+
+    def record_idle(self, wait_time: float) -> None:
+        """We waited for requests but none arrived. Counts towards the arrival rate estimate."""
+        self.num_arrived.append(0)
+        self.wall_times.append(wait_time)
+
+    def record_step(self, num_requests: int, wall_time: float, step_time: float, latencies: Sequence[float]) -> None:
+        """
+        :param wall_time: total time spent on this batch, waiting for requests included
+        :param step_time: time spent processing the batch (i.e. the forward pass, excluding weight updates)
+        :param latencies: latency of each request of the batch, from enqueueing it to sending back the outputs
+        """
+        self.batch_sizes.append(num_requests)
+        self.step_times.append(step_time)
+        self.latencies.extend(latencies)
+
+        self.num_arrived.append(num_requests)
+        self.wall_times.append(wall_time)
+
+        self.steps_since_update += 1
+        if self.steps_since_update >= self.update_every:
+            self.steps_since_update = 0
+            self._update_operating_point()
+
+    def _fit_cost_model(self) -> None:
+        requests = np.array(self.batch_sizes, dtype=np.float64)
+        step_times = np.array(self.step_times, dtype=np.float64)
+
+        mean_n, mean_t = requests.mean(), step_times.mean()
+        var_n = ((requests - mean_n) ** 2).mean()
+        if var_n > 1e-6:
+            per_request_cost = max(0.0, ((requests - mean_n) * (step_times - mean_t)).mean() / var_n)
+            fixed_cost = max(0.0, mean_t - per_request_cost * mean_n)
+        else:
+            # all batches had the same size, conservatively treat the whole cost as a fixed one
+            per_request_cost, fixed_cost = 0.0, mean_t
+
+        self.fixed_cost, self.per_request_cost = fixed_cost, per_request_cost
+
+    def _update_operating_point(self) -> None:
+        self._fit_cost_model()
+        self.arrival_rate = sum(self.num_arrived) / max(sum(self.wall_times), 1e-9)
+
+        self.p99_latency = float(np.percentile(self.latencies, 99))
+        if self.p99_latency > self.target_latency:
+            self.budget_scale = max(0.05, self.budget_scale * 0.8)
+        else:
+            self.budget_scale = min(1.0, self.budget_scale + 0.05)
+
+        budget = self.target_latency * self.budget_scale
+        # largest batch such that the time to collect it plus the time to process it fits into the budget
+        time_per_request = 1.0 / max(self.arrival_rate, 1e-9) + self.per_request_cost
+        num_requests = int((budget - self.fixed_cost) / time_per_request)
+        self.min_num_requests = max(1, min(num_requests, self.max_num_requests))
+
+        expected_step_time = self.fixed_cost + self.per_request_cost * self.min_num_requests
+        self.wait_deadline = max(MIN_WAIT_DEADLINE, budget - expected_step_time)
+
+    def summaries(self) -> Dict[str, float]:
+        return dict(
+            inference_min_num_requests=self.min_num_requests,
+            inference_wait_deadline_ms=self.wait_deadline * 1000,
+            inference_p99_latency_ms=self.p99_latency * 1000,
+        )
+
+    def log_operating_point(self, object_id: str) -> None:
+        log.debug(
+            f"{object_id}: wait for {self.min_num_requests} requests for at most {self.wait_deadline * 1000:.1f} ms, "
+            f"p99 latency {self.p99_latency * 1000:.1f} ms, arrival rate {self.arrival_rate:.1f}/s, "
+            f"cost {self.fixed_cost * 1000:.2f} + {self.per_request_cost * 1000:.3f} ms/request"
+        )
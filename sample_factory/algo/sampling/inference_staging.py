@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sample_factory.algo.utils.tensor_dict import TensorDict
+from sample_factory.algo.utils.tensor_utils import ensure_torch_tensor
+
+
+class InferenceStaging:
+    """
+    Persistent buffers for the inputs and outputs of the inference step, preallocated for the largest possible batch
+    (all envs of all rollout workers) and reused for every batch. Requests are copied directly into the buffers,
+    instead of allocating new tensors for every batch with cat() or fancy indexing.
+
+    If the inference device is a GPU and experience is sampled on CPU, buffers are allocated in pinned memory
+    which enables asynchronous (non_blocking) host-to-device and device-to-host copies.
+
+    If normalize_obs is True we also keep float32 buffers on the inference device that hold normalized observations
+    (see ObservationNormalizer).
+    """
+
+    def __init__(
+        self,
+        traj_tensors: TensorDict,
+        policy_output_tensors: Tensor | TensorDict,
+        max_batch_size: int,
+        inference_device: torch.device | str,
+        normalize_obs: bool = False,
+    ):
+        self.max_batch_size = max_batch_size
+        self.sampling_device = traj_tensors["rnn_states"].device
+        self.inference_device = torch.device(inference_device)
+        self.pinned = self.sampling_device.type == "cpu" and self.inference_device.type == "cuda"
+
+        # trajectory tensors are [num_traj, rollout + 1, *sample_shape]
+        self.obs = TensorDict({key: self._alloc(x, 2) for key, x in traj_tensors["obs"].items()})
+        self.rnn_states = self._alloc(traj_tensors["rnn_states"], 2)
+
+        self.normalized_obs: Optional[TensorDict] = None
+        if normalize_obs:
+            self.normalized_obs = TensorDict(
+                {
+                    key: torch.empty((max_batch_size,) + x.shape[2:], dtype=torch.float32, device=self.inference_device)
+                    for key, x in traj_tensors["obs"].items()
+                }
+            )
+
+        self.outputs: Optional[Tensor | TensorDict] = None
+        if isinstance(policy_output_tensors, TensorDict):
+            # batched sampling: policy outputs are [num_workers, num_splits, num_envs * num_agents, *sample_shape],
+            # we only need intermediate buffers if the outputs have to travel between devices
+            if self.sampling_device.type != self.inference_device.type:
+                self.outputs = TensorDict({key: self._alloc(x, 3) for key, x in policy_output_tensors.items()})
+        else:
+            # non-batched sampling: concatenated outputs [num_workers, num_splits, num_envs, num_agents, output_size]
+            self.outputs = self._alloc(policy_output_tensors, 4)
+
+    def _alloc(self, x: Tensor, num_leading_dims: int) -> Tensor:
+        shape = (self.max_batch_size,) + tuple(x.shape[num_leading_dims:])
+        return torch.empty(shape, dtype=x.dtype, device=self.sampling_device, pin_memory=self.pinned)
+
+    def _to_inference_device(self, num_samples: int) -> Tuple[TensorDict, Tensor]:
+        obs = TensorDict({key: x[:num_samples] for key, x in self.obs.items()})
+        rnn_states = self.rnn_states[:num_samples]
+        if self.pinned:
+            # Async copies from the staging buffers. We only overwrite the staging buffers on the next inference step
+            # which starts after we waited for the policy outputs of this step (see wait_for_outputs())
+            obs = TensorDict({key: x.to(self.inference_device, non_blocking=True) for key, x in obs.items()})
+            rnn_states = rnn_states.to(self.inference_device, non_blocking=True)
+
+        return obs, rnn_states
+
+    def gather_slices(self, traj_tensors: TensorDict, traj_indices: List) -> Tuple[TensorDict, Tensor]:
+        """
+        Batched sampling: copy observations and rnn states of the current rollout step of every request
+        into the staging buffers.
+        :param traj_indices: (slice of trajectories, rollout step) for every request
+        :return: observations and rnn states of the entire batch, on the inference device
+        """
+        if len(traj_indices) == 1 and not self.pinned:
+            # a single request does not need to be stacked, we can use it directly from the trajectory buffers
+            traj_idx = traj_indices[0]
+            obs = TensorDict({key: ensure_torch_tensor(x[traj_idx]) for key, x in traj_tensors["obs"].items()})
+            return obs, ensure_torch_tensor(traj_tensors["rnn_states"][traj_idx])
+
+        num_samples = 0
+        for traj_idx in traj_indices:
+            rnn_states = ensure_torch_tensor(traj_tensors["rnn_states"][traj_idx])
+            n = rnn_states.shape[0]
+            self.rnn_states[num_samples : num_samples + n].copy_(rnn_states)
+            for key, x in traj_tensors["obs"].items():
+                self.obs[key][num_samples : num_samples + n].copy_(ensure_torch_tensor(x[traj_idx]))
+            num_samples += n
+
+        return self._to_inference_device(num_samples)
+
+    def gather_steps(
+        self, traj_tensors: TensorDict, traj_buffer_idx: np.ndarray, rollout_step: np.ndarray
+    ) -> Tuple[TensorDict, Tensor]:
+        """
+        Non-batched sampling: gather individual steps of different trajectories into the staging buffers.
+        :return: observations and rnn states of the entire batch, on the inference device
+        """
+        num_samples = len(traj_buffer_idx)
+        rollout_len = traj_tensors["rnn_states"].shape[1]
+        # index into [num_traj * (rollout + 1), *sample_shape] views of the trajectory tensors
+        flat_indices = torch.from_numpy(traj_buffer_idx * rollout_len + rollout_step).to(self.sampling_device)
+
+        def gather(dst: Tensor, x: Tensor | np.ndarray):
+            torch.index_select(ensure_torch_tensor(x).flatten(0, 1), 0, flat_indices, out=dst[:num_samples])
+
+        gather(self.rnn_states, traj_tensors["rnn_states"])
+        for key, x in traj_tensors["obs"].items():
+            gather(self.obs[key], x)
+
+        return self._to_inference_device(num_samples)
+
+    def wait_for_outputs(self) -> None:
+        if self.pinned:
+            # unlike synchronize(), we need this in serial mode too: we read the outputs on the host right away
+            torch.cuda.current_stream(self.inference_device).synchronize()
+
+    def outputs_to_sampling_device(self, policy_outputs: TensorDict, num_samples: int) -> TensorDict:
+        """
+        Batched sampling: copy policy outputs to the sampling device all at once,
+        rather than one small transfer per request.
+        """
+        outputs = TensorDict()
+        for key, value in policy_outputs.items():
+            outputs[key] = self.outputs[key][:num_samples]
+            outputs[key].copy_(value, non_blocking=self.pinned)
+
+        self.wait_for_outputs()
+        return outputs
+
+    def concat_outputs(
+        self, policy_outputs: TensorDict, output_names: Sequence[str], output_sizes: Sequence[int], num_samples: int
+    ) -> Tensor:
+        """
+        Non-batched sampling: concatenate policy outputs into a single [num_samples, output_size] float tensor
+        on CPU, in the order of output_names.
+        """
+        outputs = self.outputs[:num_samples]
+        ofs = 0
+        for name, size in zip(output_names, output_sizes):
+            # copy_() also takes care of the dtype conversion, i.e. for integer actions
+            outputs[:, ofs : ofs + size].copy_(
+                policy_outputs[name].reshape(num_samples, size), non_blocking=self.pinned
+            )
+            ofs += size
+
+        self.wait_for_outputs()
+        return outputs
@@ -12,6 +12,9 @@ import psutil
 import torch
 from signal_slot.signal_slot import TightLoop, Timer, signal
 
+from sample_factory.algo.sampling.inference_batching import AdaptiveInferenceBatching
+from sample_factory.algo.sampling.inference_staging import InferenceStaging
+from sample_factory.algo.sampling.quantized_inference import QuantizedPolicy
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
@@ -27,12 +30,18 @@ from sample_factory.algo.utils.model_sharing import ParameterServer, make_parame
 from sample_factory.algo.utils.rl_utils import prepare_and_normalize_obs
 from sample_factory.algo.utils.shared_buffers import policy_device
 from sample_factory.algo.utils.tensor_dict import TensorDict, to_numpy
-from sample_factory.algo.utils.tensor_utils import cat_tensors, dict_of_lists_cat, ensure_torch_tensor
-from sample_factory.algo.utils.torch_utils import inference_context, init_torch_runtime, synchronize
+from sample_factory.algo.utils.tensor_utils import ensure_torch_tensor
+from sample_factory.algo.utils.torch_compile import compile_actor_critic
+from sample_factory.algo.utils.torch_utils import (
+    autocast_context,
+    inference_context,
+    init_torch_runtime,
+    synchronize,
+)
 from sample_factory.cfg.configurable import Configurable
-from sample_factory.utils.dicts import dict_of_lists_append_idx
 from sample_factory.utils.gpu_utils import cuda_envvars_for_policy
 from sample_factory.utils.timing import Timing
+from sample_factory.utils.tracing import init_tracing, save_process_trace
 from sample_factory.utils.typing import Device, InitModelData, MpQueue, PolicyID
 from sample_factory.utils.utils import debug_log_every_n, init_file_logger, log
 
@@ -51,6 +60,7 @@ def init_inference_process(sf_context: SampleFactoryContext, worker: InferenceWo
 
     cfg = worker.cfg
     init_file_logger(cfg)
+    init_tracing(cfg)
 
     try:
         if cfg.num_workers > 1:
@@ -91,6 +101,7 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         self.policy_output_tensors: Dict[Device, TensorDict] = copy.copy(buffer_mgr.policy_output_tensors_torch)
 
         self.device: torch.device = policy_device(cfg, policy_id)
+        self.env_info = env_info
         self.param_client = make_parameter_client(cfg.serial_mode, param_server, cfg, env_info, self.timing)
         self.inference_queue = inference_queue
 
@@ -107,6 +118,26 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         self.min_num_requests = max(1, min_num_requests)
         log.info(f"{self.object_id}: min num requests: %d", self.min_num_requests)
 
+        # Very conservative timer. Only wait a little bit, then continue with what we've got.
+        self.wait_for_min_requests = 0.025
+
+        self.adaptive_batching: Optional[AdaptiveInferenceBatching] = None
+        if cfg.inference_p99_latency_ms > 0 and not cfg.serial_mode:
+            # at most one request per split of each rollout worker can be pending at any time
+            max_num_requests = self.cfg.num_workers * self.cfg.worker_num_splits
+            self.adaptive_batching = AdaptiveInferenceBatching(
+                cfg.inference_p99_latency_ms / 1000,
+                self.min_num_requests,
+                self.wait_for_min_requests,
+                max_num_requests,
+            )
+
+        # all envs of all rollout workers can be in the same batch
+        self.max_batch_size = cfg.num_workers * cfg.num_envs_per_worker * env_info.num_agents
+        self.staging: Dict[Device, InferenceStaging] = dict()
+        self.batch_staging: Optional[InferenceStaging] = None  # staging buffers used for the current batch
+        self.quantized_policy: Optional[QuantizedPolicy] = None
+
         self.requests = []
         self.total_num_samples = self.last_report_samples = 0
 
@@ -143,10 +174,6 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         if self.is_initialized:
             return
 
-        if "cpu" in self.traj_tensors:
-            self.traj_tensors["cpu"] = to_numpy(self.traj_tensors["cpu"])
-            self.policy_output_tensors["cpu"] = to_numpy(self.policy_output_tensors["cpu"])
-
         state_dict = None
         policy_version = 0
         if init_model_data is not None:
@@ -156,6 +183,25 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
         self.param_client.on_weights_initialized(state_dict, self.device, policy_version)
 
+        normalize_obs = self.param_client.actor_critic.obs_normalizer.should_normalize
+        for device, traj_tensors in self.traj_tensors.items():
+            self.staging[device] = InferenceStaging(
+                traj_tensors, self.policy_output_tensors[device], self.max_batch_size, self.device, normalize_obs
+            )
+
+        if "cpu" in self.traj_tensors:
+            self.traj_tensors["cpu"] = to_numpy(self.traj_tensors["cpu"])
+            self.policy_output_tensors["cpu"] = to_numpy(self.policy_output_tensors["cpu"])
+
+        if self.cfg.quantized_inference and QuantizedPolicy.is_supported(self.device):
+            self.quantized_policy = QuantizedPolicy(self.cfg, self.env_info, self.policy_id)
+
+        if self.cfg.torch_compile:
+            # inference batch size depends on how many requests we got, compile for dynamic shapes right away
+            compile_actor_critic(
+                self.param_client.actor_critic, self.timing, dynamic=True, mode=self.cfg.torch_compile_mode
+            )
+
         # we can create and connect Timers and EventLoopObjects here because they all interact within one loop
         self.inference_loop = TightLoop(self.event_loop)
         self.inference_loop.iteration.connect(self._run)
@@ -182,25 +228,15 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
     def _batch_slices(self, timing):
         with timing.add_time("deserialize"):
-            obs = dict()
-            rnn_states = []
-            for actor_idx, split_idx, traj_idx, device in self.requests:
-                # TODO: what should we do with data sampled on different devices
-                traj_tensors = self.traj_tensors[device]
-                dict_of_lists_append_idx(obs, traj_tensors["obs"], traj_idx)
-                rnn_states.append(traj_tensors["rnn_states"][traj_idx])
+            # TODO: what should we do with data sampled on different devices
+            # should we handle a situation where experience comes from multiple devices?
+            # i.e. we use multiple GPUs for sampling but inference/learning is on a single GPU
+            device = self.requests[0][-1]
+            traj_indices = [traj_idx for _, _, traj_idx, _, _ in self.requests]
 
         with timing.add_time("stack"):
-            if len(rnn_states) == 1:
-                for obs_key, tensor_list in obs.items():
-                    obs[obs_key] = tensor_list[0]
-                rnn_states = rnn_states[0]
-            else:
-                # cat() will fail if samples are on different devices
-                # should we handle a situation where experience comes from multiple devices?
-                # i.e. we use multiple GPUs for sampling but inference/learning is on a single GPU
-                dict_of_lists_cat(obs)
-                rnn_states = cat_tensors(rnn_states)
+            self.batch_staging = self.staging[device]
+            obs, rnn_states = self.batch_staging.gather_slices(self.traj_tensors[device], traj_indices)
 
         return obs, rnn_states
 
@@ -209,20 +245,19 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
             indices = []
             for request in self.requests:
                 # TODO: what should we do with data sampled on different devices
-                actor_idx, split_idx, request_data, device = request
+                actor_idx, split_idx, request_data, _, device = request
                 for env_idx, agent_idx, traj_buffer_idx, rollout_step in request_data:
                     index = [traj_buffer_idx, rollout_step]
                     indices.append(index)
 
-            indices = tuple(np.array(indices).T)
-            traj_tensors = self.traj_tensors[device]  # TODO: multiple sampling devices?
-            observations = traj_tensors["obs"][indices]
-            rnn_states = traj_tensors["rnn_states"][indices]
+            traj_buffer_idx, rollout_step = np.array(indices).T
 
         with timing.add_time("stack"):
-            for key, x in observations.items():
-                observations[key] = ensure_torch_tensor(x)
-            rnn_states = ensure_torch_tensor(rnn_states)
+            # TODO: multiple sampling devices?
+            self.batch_staging = self.staging[device]
+            observations, rnn_states = self.batch_staging.gather_steps(
+                self.traj_tensors[device], traj_buffer_idx, rollout_step
+            )
 
         return observations, rnn_states
 
@@ -244,17 +279,22 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         if policy_outputs["actions"].ndim < 2:
             policy_outputs["actions"] = policy_outputs["actions"].unsqueeze(-1)
 
+        staging = self.staging[requests[0][-1]]  # TODO: multiple sampling devices?
+        if staging.outputs is not None:
+            # outputs go to a different device, transfer them all at once instead of once per request
+            policy_outputs = staging.outputs_to_sampling_device(policy_outputs, num_samples)
+
         # assuming all workers provide the same number of samples
         samples_per_actor = num_samples // len(requests)
         ofs = 0
         devices_to_sync = set()
-        for actor_idx, split_idx, _, device in requests:
+        for actor_idx, split_idx, _, _, device in requests:
             self.policy_output_tensors[device][actor_idx, split_idx] = policy_outputs[ofs : ofs + samples_per_actor]
             ofs += samples_per_actor
             devices_to_sync.add(device)
 
         signals_to_send: AdvanceRolloutSignals = dict()
-        for actor_idx, split_idx, _, _ in requests:
+        for actor_idx, split_idx, _, _, _ in requests:
             payload = (split_idx, self.policy_id)
             if actor_idx in signals_to_send:
                 signals_to_send[actor_idx].append(payload)
@@ -269,30 +309,22 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         return signals_to_send
 
     def _prepare_policy_outputs_non_batched(
-        self, _num_samples: int, policy_outputs: TensorDict, requests: List
+        self, num_samples: int, policy_outputs: TensorDict, requests: List
     ) -> AdvanceRolloutSignals:
         # Respect sampling device instead of just dumping everything on cpu?
         # Although it is hard to imagine a scenario where we have a non-batched env with observations on gpu
         device = "cpu"
 
-        with self.timing.add_time("to_cpu"):
-            for key, output_value in policy_outputs.items():
-                policy_outputs[key] = output_value.to(device)
-
         # concat all tensors into a single tensor for performance
-        output_tensors = []
-        for name in self.buffer_mgr.output_names:
-            output_value = policy_outputs[name].float()
-            while output_value.dim() <= 1:
-                output_value.unsqueeze_(-1)
-            output_tensors.append(output_value)
-
-        output_tensors = torch.cat(output_tensors, dim=1)
+        with self.timing.add_time("to_cpu"):
+            output_tensors = self.staging[device].concat_outputs(
+                policy_outputs, self.buffer_mgr.output_names, self.buffer_mgr.output_sizes, num_samples
+            )
 
         signals_to_send: AdvanceRolloutSignals = dict()
         output_indices = []
         for request in requests:
-            actor_idx, split_idx, request_data, _ = request
+            actor_idx, split_idx, request_data, _, _ = request
             for env_idx, agent_idx, traj_buffer_idx, rollout_step in request_data:
                 output_indices.append([actor_idx, split_idx, env_idx, agent_idx])
 
@@ -310,6 +342,22 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
         return signals_to_send
 
+    def _quantized_forward(self, normalized_obs, rnn_states, action_mask, timing) -> TensorDict:
+        quantized_policy = self.quantized_policy
+        quantized_actor_critic = quantized_policy.actor_critic
+        policy_outputs = quantized_actor_critic(normalized_obs, rnn_states, action_mask=action_mask)
+
+        if quantized_policy.should_measure_kl():
+            with timing.add_time("quantized_kl"):
+                # action distributions are re-created on every forward pass, so we can keep the reference
+                quantized_distribution = quantized_actor_critic.action_distribution()
+                # full precision model with the same weights, so we only measure the error of the quantization
+                float_model = quantized_policy.float_model
+                float_model(normalized_obs, rnn_states, action_mask=action_mask)
+                quantized_policy.record_kl(float_model.action_distribution(), quantized_distribution)
+
+        return policy_outputs
+
     def _handle_policy_steps(self, timing):
         with inference_context(self.cfg.serial_mode):
             obs, rnn_states = self._batch_func(timing)
@@ -324,12 +372,29 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
                 action_mask = (
                     ensure_torch_tensor(obs.pop("action_mask")).to(self.device) if "action_mask" in obs else None
                 )
-                normalized_obs = prepare_and_normalize_obs(actor_critic, obs)
+                # normalized observations are only needed until the end of this step, so we can reuse the buffers
+                normalized_obs = prepare_and_normalize_obs(actor_critic, obs, out=self.batch_staging.normalized_obs)
                 rnn_states = ensure_torch_tensor(rnn_states).to(self.device).float()
 
+            policy_version = self.param_client.policy_version
+            if self.quantized_policy is not None:
+                with timing.add_time("quantize"):
+                    self.quantized_policy.update(actor_critic, policy_version)
+                # re-quantization is rate-limited, so the quantized policy can be older than the latest weights
+                policy_version = self.quantized_policy.policy_version
+
             with timing.add_time("forward"):
-                policy_outputs = actor_critic(normalized_obs, rnn_states, action_mask=action_mask)
-                policy_outputs["policy_version"] = torch.empty([num_samples]).fill_(self.param_client.policy_version)
+                with autocast_context(self.cfg.bf16_autocast, self.device):
+                    if self.quantized_policy is None:
+                        policy_outputs = actor_critic(normalized_obs, rnn_states, action_mask=action_mask)
+                    else:
+                        policy_outputs = self._quantized_forward(normalized_obs, rnn_states, action_mask, timing)
+                if self.cfg.bf16_autocast:
+                    # outputs go to float32 trajectory buffers, and new rnn states are the inputs of the next step
+                    for key, value in policy_outputs.items():
+                        if value.is_floating_point():
+                            policy_outputs[key] = value.float()
+                policy_outputs["policy_version"] = torch.empty([num_samples]).fill_(policy_version)
 
             with timing.add_time("prepare_outputs"):
                 signals_to_send = self._prepare_policy_outputs_func(num_samples, policy_outputs, self.requests)
@@ -347,11 +412,13 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
             pass
 
     def _get_inference_requests_async(self):
-        # Very conservative timer. Only wait a little bit, then continue with what we've got.
-        wait_for_min_requests = 0.025
+        min_num_requests, wait_for_min_requests = self.min_num_requests, self.wait_for_min_requests
+        if self.adaptive_batching is not None:
+            min_num_requests = self.adaptive_batching.min_num_requests
+            wait_for_min_requests = self.adaptive_batching.wait_deadline
 
         waiting_started = time.time()
-        while len(self.requests) < self.min_num_requests and time.time() - waiting_started < wait_for_min_requests:
+        while len(self.requests) < min_num_requests and time.time() - waiting_started < wait_for_min_requests:
             try:
                 with self.timing.timeit("wait_policy"), self.timing.add_time("wait_policy_total"):
                     policy_requests = self.inference_queue.get_many(timeout=0.005)
@@ -360,17 +427,31 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
                 pass
 
     def _run(self):
+        waiting_started = time.time()
         self._get_inference_requests_func()
         if not self.requests:
+            if self.adaptive_batching is not None:
+                self.adaptive_batching.record_idle(time.time() - waiting_started)
             return
 
+        num_requests = len(self.requests)
+        enqueue_times = [enqueue_time for _, _, _, enqueue_time, _ in self.requests]
+
         with self.timing.add_time("update_model"):
             self.param_client.ensure_weights_updated()
 
+        # weight updates are not part of the inference cost we model, so the step time does not include them
+        step_started = time.time()
         with self.timing.timeit("one_step"), self.timing.add_time("handle_policy_step"):
-            self.request_count.append(len(self.requests))
+            self.request_count.append(num_requests)
             self._handle_policy_steps(self.timing)
 
+        if self.adaptive_batching is not None:
+            # actions are sent back now, this is the end of the latency of each individual request
+            now = time.time()
+            latencies = [now - enqueue_time for enqueue_time in enqueue_times]
+            self.adaptive_batching.record_step(num_requests, now - waiting_started, now - step_started, latencies)
+
     def _report_stats(self):
         if "one_step" not in self.timing:
             return
@@ -382,6 +463,11 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
         stats = memory_stats("policy_worker", self.device)
         if len(self.request_count) > 0:
             stats["avg_request_count"] = np.mean(self.request_count)
+        if self.adaptive_batching is not None:
+            stats.update(self.adaptive_batching.summaries())
+            self.adaptive_batching.log_operating_point(self.object_id)
+        if self.quantized_policy is not None:
+            stats.update(self.quantized_policy.summaries())
 
         self.report_msg.emit(
             {
@@ -405,5 +491,7 @@ class InferenceWorker(HeartbeatStoppableEventLoopObject, Configurable):
             self.param_client.cleanup()
             del self.param_client
 
+        if not self.cfg.serial_mode:
+            save_process_trace(self.cfg)
         self.stop.emit(self.object_id, {self.object_id: self.timing})
         super().on_stop(*args)
@@ -22,6 +22,111 @@ from sample_factory.utils.typing import Config, MpQueue, PolicyID
 from sample_factory.utils.utils import debug_log_every_n, log, set_attr_if_exists
 
 
+def actions_for_env(env_info: EnvInfo, actions: np.ndarray) -> np.ndarray | List | Any:
+    """Convert actions of a single agent calculated by the policy worker to the format the environment expects."""
+    if env_info.all_discrete or isinstance(env_info.action_space, gym.spaces.Discrete):
+        return _process_action_space(actions, is_discrete=True)
+    elif isinstance(env_info.action_space, gym.spaces.Box):
+        return _process_action_space(actions, is_discrete=False)
+    elif isinstance(env_info.action_space, gym.spaces.Tuple):
+        out_actions = []
+        for split, space in zip(np.split(actions, np.cumsum(env_info.action_splits)[:-1]), env_info.action_space):
+            is_discrete = isinstance(space, gym.spaces.Discrete)
+            out_actions.append(_process_action_space(split, is_discrete))
+        return out_actions
+
+    raise NotImplementedError(f"Unknown action space type: {type(env_info.action_space)}")
+
+
+def _process_action_space(actions: np.ndarray, is_discrete: bool) -> np.ndarray | Any:
+    if is_discrete:
+        actions = actions.astype(np.int32)
+        if actions.size == 1:
+            # this will turn a 1-element array into single Python scalar (int). Works for 0-D and 1-D arrays.
+            actions = actions.item()
+    else:
+        if actions.ndim == 0:
+            # envs with continuous actions typically expect a vector of actions (i.e. Mujoco)
+            # if there's only one action (i.e. Mujoco pendulum) then we need to make it a 1D vector
+            actions = np.expand_dims(actions, -1)
+
+    return actions
+
+
+def episodic_stats(info: Dict, episode_reward, episode_duration, policy_id: PolicyID) -> Dict[str, Any]:
+    stats = dict(
+        reward=episode_reward,
+        len=episode_duration,
+        episode_extra_stats=info.get("episode_extra_stats", dict()),
+    )
+
+    if (true_objective := info.get("true_objective", episode_reward)) is not None:
+        stats["true_objective"] = true_objective
+
+    episode_wrapper_stats = record_episode_statistics_wrapper_stats(info)
+    if episode_wrapper_stats is not None:
+        wrapper_rew, wrapper_len = episode_wrapper_stats
+        stats["RecordEpisodeStatistics_reward"] = wrapper_rew
+        stats["RecordEpisodeStatistics_len"] = wrapper_len
+
+    report = {EPISODIC: stats, POLICY_ID_KEY: policy_id}
+    return report
+
+
+def trajectory_buffers_per_policy(
+    traj_policy_ids, curr_policy_id: PolicyID, curr_traj_buffer_idx: int, traj_tensors: TensorDict, traj_buffer_queue
+) -> Dict[PolicyID, int]:
+    """
+    We could change policy id in the middle of the rollout (i.e. on the episode boundary), in which case
+    this trajectory should be sent to two learners, one for the original policy id, one for the new one.
+    The part of the experience that belongs to a different policy will be ignored on the learner.
+
+    :param traj_policy_ids: policy id of every step of the trajectory, -1 for steps of an inactive agent
+    :return: trajectory buffer to send to the learner of each policy, in the order of policy ids
+    """
+    policy_buffers: Dict[PolicyID, int] = dict()
+
+    unique_policies = np.unique(traj_policy_ids)
+    if len(unique_policies) > 1:
+        debug_log_every_n(1000, f"Multiple policies in trajectory buffer: {unique_policies} (-1 means inactive agent)")
+
+    for policy_id in unique_policies:
+        policy_id = int(policy_id)
+        if policy_id == -1:
+            # The entire trajectory belongs to an inactive agent, we send it to the current policy learner
+            # the ideal solution would be to ditch this rollout entirely but this can mess with the
+            # sync mode algorithm for counting how many trajectories we should advance at a time.
+            # Learner will carefully mask the inactive (invalid) data so it should be okay to do this.
+            policy_id = curr_policy_id
+
+        if policy_id in policy_buffers:
+            # we already created a request for this policy
+            continue
+
+        traj_buffer_idx = curr_traj_buffer_idx
+        if traj_buffer_idx in policy_buffers.values():
+            # This rollout needs to be sent to multiple learners, i.e. because the policy changed in the middle
+            # of the rollout. If we use the same shared buffer on multiple learners, we need some mechanism
+            # to guarantee that this buffer will only be released once. It seems easier to just copy all data to
+            # a new buffer for each additional learner. This should be a very rare event so the performance impact
+            # is negligible.
+            try:
+                traj_buffer_idx = traj_buffer_queue.get(block=True, timeout=100)
+            except Empty:
+                log.error(
+                    f"Lost trajectory for {policy_id=} ({traj_policy_ids}) since we could not find a trajectory buffer!"
+                )
+                continue
+
+            buffer = traj_tensors[traj_buffer_idx]
+            buffer[:] = traj_tensors[curr_traj_buffer_idx]  # copy TensorDict data recursively
+
+        policy_buffers[policy_id] = traj_buffer_idx
+
+    assert len(policy_buffers), "We ought to send our buffer to at least one learner"
+    return policy_buffers
+
+
 class ActorState:
     """
     State of a single actor (agent) in a multi-agent environment.
@@ -140,37 +245,7 @@ class ActorState:
         """
         :return: the latest set of actions for this actor, calculated by the policy worker for the last observation
         """
-        actions = ensure_numpy_array(self.last_actions)
-
-        if self.env_info.all_discrete or isinstance(self.env_info.action_space, gym.spaces.Discrete):
-            return self._process_action_space(actions, is_discrete=True)
-        elif isinstance(self.env_info.action_space, gym.spaces.Box):
-            return self._process_action_space(actions, is_discrete=False)
-        elif isinstance(self.env_info.action_space, gym.spaces.Tuple):
-            out_actions = []
-            for split, space in zip(
-                np.split(actions, np.cumsum(self.env_info.action_splits)[:-1]), self.env_info.action_space
-            ):
-                is_discrete = isinstance(space, gym.spaces.Discrete)
-                out_actions.append(self._process_action_space(split, is_discrete))
-            return out_actions
-
-        raise NotImplementedError(f"Unknown action space type: {type(self.env_info.action_space)}")
-
-    @staticmethod
-    def _process_action_space(actions: np.ndarray, is_discrete: bool) -> np.ndarray | Any:
-        if is_discrete:
-            actions = actions.astype(np.int32)
-            if actions.size == 1:
-                # this will turn a 1-element array into single Python scalar (int). Works for 0-D and 1-D arrays.
-                actions = actions.item()
-        else:
-            if actions.ndim == 0:
-                # envs with continuous actions typically expect a vector of actions (i.e. Mujoco)
-                # if there's only one action (i.e. Mujoco pendulum) then we need to make it a 1D vector
-                actions = np.expand_dims(actions, -1)
-
-        return actions
+        return actions_for_env(self.env_info, ensure_numpy_array(self.last_actions))
 
     def record_env_step(self, reward, terminated: bool, truncated: bool, info, rollout_step):
         """
@@ -230,57 +305,21 @@ class ActorState:
         last_step_data = dict(obs=self.last_obs, rnn_states=self.last_rnn_state)
         self.set_trajectory_data(last_step_data, self.cfg.rollout)
 
-        # We could change policy id in the middle of the rollout (i.e. on the episode boundary), in which case
-        # this trajectory should be sent to two learners, one for the original policy id, one for the new one.
-        # The part of the experience that belongs to a different policy will be ignored on the learner.
-        trajectories = []
-        policy_buffers: Dict[PolicyID, int] = dict()
-
-        unique_policies = np.unique(self.curr_traj_buffer["policy_id"])
-        if len(unique_policies) > 1:
-            debug_log_every_n(
-                1000, f"Multiple policies in trajectory buffer: {unique_policies} (-1 means inactive agent)"
-            )
-
-        for policy_id in unique_policies:
-            policy_id = int(policy_id)
-            if policy_id == -1:
-                # The entire trajectory belongs to an inactive agent, we send it to the current policy learner
-                # the ideal solution would be to ditch this rollout entirely but this can mess with the
-                # sync mode algorithm for counting how many trajectories we should advance at a time.
-                # Learner will carefully mask the inactive (invalid) data so it should be okay to do this.
-                policy_id = self.curr_policy_id
-
-            if policy_id in policy_buffers:
-                # we already created a request for this policy
-                continue
-
-            traj_buffer_idx = self.curr_traj_buffer_idx
-            if traj_buffer_idx in policy_buffers.values():
-                # This rollout needs to be sent to multiple learners, i.e. because the policy changed in the middle
-                # of the rollout. If we use the same shared buffer on multiple learners, we need some mechanism
-                # to guarantee that this buffer will only be released once. It seems easier to just copy all data to
-                # a new buffer for each additional learner. This should be a very rare event so the performance impact
-                # is negligible.
-                try:
-                    traj_buffer_idx = self.traj_buffer_queue.get(block=True, timeout=100)
-                except Empty:
-                    log.error(
-                        f"Lost trajectory for {policy_id=} ({self.curr_traj_buffer['policy_id']}) since we could not find a trajectory buffer!"
-                    )
-                    continue
-
-                buffer = self.traj_tensors[traj_buffer_idx]
-                buffer[:] = self.curr_traj_buffer  # copy TensorDict data recursively
-
-            policy_buffers[policy_id] = traj_buffer_idx
+        policy_buffers = trajectory_buffers_per_policy(
+            self.curr_traj_buffer["policy_id"],
+            self.curr_policy_id,
+            self.curr_traj_buffer_idx,
+            self.traj_tensors,
+            self.traj_buffer_queue,
+        )
 
+        trajectories = []
+        for policy_id, traj_buffer_idx in policy_buffers.items():
             t_id = f"{policy_id}_{self.worker_idx}_{self.split_idx}_{self.env_idx}_{self.agent_idx}_{self.num_trajectories}"
             traj_dict = dict(t_id=t_id, length=rollout_step, policy_id=policy_id, traj_buffer_idx=traj_buffer_idx)
             trajectories.append(traj_dict)
             self.num_trajectories += 1
 
-        assert len(policy_buffers), "We ought to send our buffer to at least one learner"
         self.needs_buffer = True
 
         return trajectories
@@ -291,23 +330,7 @@ class ActorState:
             self.reset_rnn_state()
 
     def _episodic_stats(self, info: Dict) -> Dict[str, Any]:
-        stats = dict(
-            reward=self.last_episode_reward,
-            len=self.last_episode_duration,
-            episode_extra_stats=info.get("episode_extra_stats", dict()),
-        )
-
-        if (true_objective := info.get("true_objective", self.last_episode_reward)) is not None:
-            stats["true_objective"] = true_objective
-
-        episode_wrapper_stats = record_episode_statistics_wrapper_stats(info)
-        if episode_wrapper_stats is not None:
-            wrapper_rew, wrapper_len = episode_wrapper_stats
-            stats["RecordEpisodeStatistics_reward"] = wrapper_rew
-            stats["RecordEpisodeStatistics_len"] = wrapper_len
-
-        report = {EPISODIC: stats, POLICY_ID_KEY: self.curr_policy_id}
-        return report
+        return episodic_stats(info, self.last_episode_reward, self.last_episode_duration, self.curr_policy_id)
 
 
 class NonBatchedVectorEnvRunner(VectorEnvRunner):
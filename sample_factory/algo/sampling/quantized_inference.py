@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import copy
+import time
+import warnings
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+from torch import nn
+
+from sample_factory.algo.utils.env_info import EnvInfo
+from sample_factory.model.actor_critic import ActorCritic, create_actor_critic
+from sample_factory.utils.typing import Config, PolicyID
+from sample_factory.utils.utils import log
+
+# layer types supported by PyTorch dynamic quantization
+QUANTIZED_LAYER_TYPES = {nn.Linear, nn.GRU, nn.LSTM, nn.GRUCell, nn.LSTMCell}
+
+
+def _quantize_dynamic_func():
+    # torch.ao.quantization since PyTorch 1.10, torch.quantization before that
+    quantization = getattr(getattr(torch, "ao", None), "quantization", None) or getattr(torch, "quantization", None)
+    return getattr(quantization, "quantize_dynamic", None)
+
+
+@torch.no_grad()
+def round_conv_weights_to_int8(model: nn.Module) -> None:
+    """Simulate symmetric per-output-channel int8 weights of conv layers (weights stay float32)."""
+    for module in model.modules():
+        if isinstance(module, (nn.Conv1d, nn.Conv2d, nn.Conv3d)):
+            w = module.weight
+            scale = w.abs().amax(dim=tuple(range(1, w.dim())), keepdim=True).clamp_(min=1e-12) / 127
+            w.copy_(torch.round(w / scale).clamp_(-127, 127) * scale)
+
+
+def quantize_actor_critic(actor_critic: ActorCritic, quantize_conv: bool) -> ActorCritic:
+    """
+    :return: a copy of the model with linear and recurrent layers replaced by int8 dynamically quantized versions
+        (weights are quantized ahead of time, activations on the fly). CPU only.
+    """
+    quantized = copy.deepcopy(actor_critic)
+    if quantize_conv:
+        round_conv_weights_to_int8(quantized)
+
+    with warnings.catch_warnings():
+        # eager mode quantization is deprecated in recent PyTorch versions in favor of torchao
+        warnings.simplefilter("ignore")
+        quantized = _quantize_dynamic_func()(quantized, QUANTIZED_LAYER_TYPES, dtype=torch.qint8, inplace=True)
+
+    quantized.eval()
+    return quantized
+
+
+class QuantizedPolicy:
+    """
+    Int8 copy of the latest policy used by the inference worker to generate actions.
+    Quantization is not free, so the copy is refreshed at most once every refresh_interval_sec seconds, even if new
+    weights arrive more often.
+    Every kl_interval steps we measure the KL divergence between the action distributions of the full precision
+    and the quantized policy, which shows how much additional off-policy-ness the quantization introduces.
+    """
+
+    def __init__(self, cfg: Config, env_info: EnvInfo, policy_id: PolicyID):
+        self.policy_id = policy_id
+        self.quantize_conv = cfg.quantize_conv_layers
+        self.kl_interval = cfg.quantized_kl_interval
+        self.refresh_interval_sec = cfg.quantized_refresh_interval_sec
+
+        # Plain (i.e. not compiled) float32 model that we load the latest weights into before quantization.
+        # We can't just copy the inference model since it can be modified at runtime (i.e. by torch.compile())
+        # This also serves as a reference for the KL divergence, since it has the same weights as the quantized copy.
+        self.float_model = create_actor_critic(cfg, env_info.obs_space, env_info.action_space)
+        self.float_model.eval()
+
+        self.actor_critic: Optional[ActorCritic] = None
+        self.policy_version = -1
+        self.last_update_time = 0.0
+        self.update_times = deque(maxlen=100)
+
+        self.num_steps = 0
+        self.kl = deque(maxlen=100)
+
+    @staticmethod
+    def is_supported(device: torch.device) -> bool:
+        if device.type != "cpu":
+            log.warning(f"Quantized inference is only supported on CPU, using the full precision model on {device}")
+            return False
+        if _quantize_dynamic_func() is None:
+            log.warning("Dynamic quantization is not available in this version of PyTorch, using full precision model")
+            return False
+        return True
+
+    def update(self, actor_critic: ActorCritic, policy_version: int) -> bool:
+        """
+        Re-quantize the model if we have a newer version of the weights and the previous refresh was long enough ago.
+        :return: True if the model was updated.
+        """
+        if self.actor_critic is not None:
+            if policy_version == self.policy_version:
+                return False
+            if time.time() - self.last_update_time < self.refresh_interval_sec:
+                return False
+
+        start = time.time()
+        self.float_model.load_state_dict(actor_critic.state_dict())
+        self.actor_critic = quantize_actor_critic(self.float_model, self.quantize_conv)
+        self.policy_version = policy_version
+
+        self.last_update_time = time.time()
+        self.update_times.append(self.last_update_time - start)
+        return True
+
+    def should_measure_kl(self) -> bool:
+        self.num_steps += 1
+        return self.kl_interval > 0 and self.num_steps % self.kl_interval == 0
+
+    def record_kl(self, full_precision_distribution, quantized_distribution) -> None:
+        kl = full_precision_distribution.kl_divergence(quantized_distribution)
+        self.kl.append(kl.mean().item())
+
+    def summaries(self) -> Dict[str, float]:
+        summaries = dict()
+        if self.kl:
+            summaries[f"quantized_kl_p{self.policy_id}"] = float(np.mean(self.kl))
+        if self.update_times:
+            # compare to the forward pass time of the inference worker to see if quantization pays off
+            summaries[f"quantize_time_ms_p{self.policy_id}"] = 1000 * float(np.mean(self.update_times))
+        return summaries
@@ -11,6 +11,7 @@ from signal_slot.signal_slot import signal
 from sample_factory.algo.sampling.batched_sampling import BatchedVectorEnvRunner
 from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
 from sample_factory.algo.sampling.sampling_utils import VectorEnvRunner, rollout_worker_device
+from sample_factory.algo.sampling.vectorized_actor_states import NonBatchedVectorizedEnvRunner
 from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.heartbeat import HeartbeatStoppableEventLoopObject
@@ -20,6 +21,7 @@ from sample_factory.algo.utils.torch_utils import inference_context
 from sample_factory.cfg.configurable import Configurable
 from sample_factory.utils.gpu_utils import set_gpus_for_process
 from sample_factory.utils.timing import Timing
+from sample_factory.utils.tracing import init_tracing, save_process_trace
 from sample_factory.utils.typing import MpQueue, PolicyID
 from sample_factory.utils.utils import (
     cores_for_worker_process,
@@ -43,6 +45,7 @@ def init_rollout_worker_process(sf_context: SampleFactoryContext, worker: Rollou
 
     cfg = worker.cfg
     init_file_logger(cfg)
+    init_tracing(cfg)
 
     # on MacOS, psutil.Process() has no method 'cpu_affinity'
     if hasattr(psutil.Process(), "cpu_affinity"):
@@ -133,7 +136,12 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
 
     def init(self):
         for split_idx in range(self.num_splits):
-            env_runner_cls = BatchedVectorEnvRunner if self.cfg.batched_sampling else NonBatchedVectorEnvRunner
+            if self.cfg.batched_sampling:
+                env_runner_cls = BatchedVectorEnvRunner
+            elif self.cfg.vectorized_actor_states:
+                env_runner_cls = NonBatchedVectorizedEnvRunner
+            else:
+                env_runner_cls = NonBatchedVectorEnvRunner
 
             env_runner = env_runner_cls(
                 self.cfg,
@@ -199,7 +207,8 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         """Distribute action requests to their corresponding queues."""
 
         for policy_id, requests in policy_inputs.items():
-            policy_request = (self.worker_idx, split_idx, requests, self.sampling_device)
+            # enqueue time lets the inference worker measure the latency of individual requests
+            policy_request = (self.worker_idx, split_idx, requests, time.time(), self.sampling_device)
             self.inference_queues[policy_id].put(policy_request)
 
         if not policy_inputs:
@@ -304,5 +313,7 @@ class RolloutWorker(HeartbeatStoppableEventLoopObject, Configurable):
         timings = dict()
         if self.worker_idx in [0, self.cfg.num_workers - 1]:
             timings[self.object_id] = self.timing
+        if not self.cfg.serial_mode:
+            save_process_trace(self.cfg)
         self.stop.emit(self.object_id, timings)
         super().on_stop(*args)
@@ -5,19 +5,124 @@ see evaluation_sampling_api.py for an example of a custom stats observer.
 """
 
 from collections import deque
-from typing import Any
+from typing import Any, Deque, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
 
 from sample_factory.algo.utils.misc import SAMPLES_COLLECTED
 from sample_factory.utils.typing import PolicyID
 
 
+class WindowedStats:
+    """
+    Drop-in replacement for deque(maxlen=...) of scalar stats that keeps the window aggregates ready for reporting,
+    so summaries do not require a pass over every window on every summary tick:
+
+    * mean: np.mean() over the window values exactly as they were added, i.e. identical to np.mean() over a deque
+      with the same contents. Calculated on demand and cached until the window changes.
+    * quantiles (i.e. median): np.quantile() over the window, cached the same way.
+    * min/max: monotonic queues, amortized O(1) per value.
+
+    Appending a value is O(1), windows that did not change since the last summary cost nothing to report.
+    NaNs make the mean and quantiles NaN (like np.mean/np.quantile) but are ignored by min/max.
+    """
+
+    def __init__(self, iterable: Iterable = (), maxlen: Optional[int] = None):
+        self.maxlen = maxlen
+        self._values: Deque[Any] = deque(maxlen=maxlen)
+        self._num_added = 0  # total number of values ever added, used as a timestamp for min/max queues
+
+        self._min_queue: Deque[Tuple[int, Any]] = deque()
+        self._max_queue: Deque[Tuple[int, Any]] = deque()
+
+        # aggregates of the current window, reset whenever the window changes
+        self._mean: Optional[float] = None
+        self._quantiles: Dict[float, float] = dict()
+
+        self.extend(iterable)
+
+    def append(self, value: Any) -> None:
+        if self.maxlen == 0:
+            return
+
+        if len(self._values) == self.maxlen:
+            evicted_idx = self._num_added - len(self._values)
+            if self._min_queue and self._min_queue[0][0] == evicted_idx:
+                self._min_queue.popleft()
+            if self._max_queue and self._max_queue[0][0] == evicted_idx:
+                self._max_queue.popleft()
+
+        # values are stored as is (not converted to float) so np.mean() uses the same dtype as with a plain deque
+        self._values.append(value)
+        idx = self._num_added
+        self._num_added += 1
+        self._mean = None
+        self._quantiles.clear()
+
+        if value != value:  # NaN
+            return
+
+        while self._min_queue and self._min_queue[-1][1] >= value:
+            self._min_queue.pop()
+        self._min_queue.append((idx, value))
+        while self._max_queue and self._max_queue[-1][1] <= value:
+            self._max_queue.pop()
+        self._max_queue.append((idx, value))
+
+    def extend(self, values: Iterable) -> None:
+        for v in values:
+            self.append(v)
+
+    def window_mean(self) -> float:
+        if self._mean is None:
+            self._mean = float(np.mean(self._values)) if self._values else float("nan")
+        return self._mean
+
+    def quantile(self, q: float) -> float:
+        """Same as np.quantile() with the default linear interpolation."""
+        if q not in self._quantiles:
+            self._quantiles[q] = float(np.quantile(self._values, q)) if self._values else float("nan")
+        return self._quantiles[q]
+
+    def window_min(self) -> float:
+        return float(self._min_queue[0][1]) if self._min_queue else float("nan")
+
+    def window_max(self) -> float:
+        return float(self._max_queue[0][1]) if self._max_queue else float("nan")
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._values)
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        return np.array(self._values, dtype=dtype)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self._values)}, maxlen={self.maxlen})"
+
+
+def window_mean(values) -> float:
+    """Mean of a WindowedStats or any other collection of stats (i.e. a deque created by custom user code)."""
+    return values.window_mean() if isinstance(values, WindowedStats) else float(np.mean(values))
+
+
+def window_min(values) -> float:
+    return values.window_min() if isinstance(values, WindowedStats) else float(min(values))
+
+
+def window_max(values) -> float:
+    return values.window_max() if isinstance(values, WindowedStats) else float(max(values))
+
+
 def timing_msg_handler(stats_observer: Any, msg: dict) -> None:
     """We use duck typing here, assuming that stats_observer object has avg_stats dict."""
     assert hasattr(stats_observer, "avg_stats"), f"stats_observer object has no avg_stats dict: {stats_observer}"
 
     for k, v in msg["timing"].items():
         if k not in stats_observer.avg_stats:
-            stats_observer.avg_stats[k] = deque([], maxlen=50)
+            stats_observer.avg_stats[k] = WindowedStats(maxlen=50)
         stats_observer.avg_stats[k].append(v)
 
 
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import gymnasium as gym
+import numpy as np
+
+from sample_factory.algo.sampling.non_batched_sampling import (
+    NonBatchedVectorEnvRunner,
+    actions_for_env,
+    episodic_stats,
+    trajectory_buffers_per_policy,
+)
+from sample_factory.algo.utils.env_info import check_env_info
+from sample_factory.algo.utils.make_env import make_env_func_non_batched
+from sample_factory.envs.env_utils import find_training_info_interface, set_reward_shaping, set_training_info
+from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.typing import PolicyID
+from sample_factory.utils.utils import log, set_attr_if_exists
+
+
+class NonBatchedVectorizedEnvRunner(NonBatchedVectorEnvRunner):
+    """
+    Same as NonBatchedVectorEnvRunner, but instead of one ActorState object per agent the state of all agents is
+    kept in contiguous arrays indexed by the agent ("struct of arrays"), agent_idx = env_i * num_agents + agent_i.
+    Policy outputs, observations, rewards, etc. are written into trajectory buffers with a single indexed assignment
+    per tensor instead of a Python loop over agents. Per-agent Python code only runs on episode boundaries
+    and to convert actions to the format the environments expect.
+
+    The behavior is identical to the ActorState-based implementation (same trajectories, requests, and episodic
+    stats, in the same order).
+    """
+
+    def __init__(
+        self,
+        cfg,
+        env_info,
+        num_envs,
+        worker_idx,
+        split_idx,
+        buffer_mgr,
+        sampling_device: str,
+        training_info: List[Optional[Dict[str, Any]]],
+    ):
+        super().__init__(cfg, env_info, num_envs, worker_idx, split_idx, buffer_mgr, sampling_device, training_info)
+        assert sampling_device == "cpu", "Vectorized actor states are only supported with CPU observations"
+
+        n = self.num_envs * self.num_agents
+        self.env_indices = np.repeat(np.arange(self.num_envs), self.num_agents)
+        self.agent_indices = np.tile(np.arange(self.num_agents), self.num_envs)
+        self.global_env_indices = np.zeros(self.num_envs, dtype=np.int64)
+
+        self.curr_policy_id = np.zeros(n, dtype=np.int64)
+        self.curr_traj_buffer_idx = np.zeros(n, dtype=np.int64)
+        self.needs_buffer = np.ones(n, dtype=bool)
+        self.is_active = np.ones(n, dtype=bool)
+        self.ready = np.zeros(n, dtype=bool)
+        self.num_trajectories = np.zeros(n, dtype=np.int64)
+        self.last_episode_reward: Optional[np.ndarray] = None  # allocated on the first step, see _process_env_steps()
+        self.last_episode_duration = np.zeros(n, dtype=np.float64)
+
+        traj_tensors = self.traj_tensors
+        self.last_obs = {k: np.zeros((n,) + v.shape[2:], dtype=v.dtype) for k, v in traj_tensors["obs"].items()}
+        self.last_rnn_state = np.zeros((n,) + traj_tensors["rnn_states"].shape[2:], dtype=np.float32)
+        self.last_actions = np.zeros((n,) + traj_tensors["actions"].shape[2:], dtype=np.float32)
+
+        # policy outputs are squished together into a single tensor, here we remember where each of them is
+        output_offsets = np.cumsum([0] + list(buffer_mgr.output_sizes))
+        self.policy_output_slices = {
+            name: slice(output_offsets[i], output_offsets[i + 1]) for i, name in enumerate(buffer_mgr.output_names)
+        }
+
+        self.training_info_interfaces = []
+
+        action_space = self.env_info.action_space
+        self.scalar_discrete_actions = self.last_actions.shape[1:] == (1,) and (
+            self.env_info.all_discrete or isinstance(action_space, gym.spaces.Discrete)
+        )
+
+    def _agent_slice(self, env_i: int) -> slice:
+        return slice(env_i * self.num_agents, (env_i + 1) * self.num_agents)
+
+    def init(self, timing: Timing):
+        for env_i in range(self.num_envs):
+            vector_idx = self.split_idx * self.num_envs + env_i
+
+            # global env id within the entire system
+            global_env_idx = self.worker_idx * self.cfg.num_envs_per_worker + vector_idx
+            self.global_env_indices[env_i] = global_env_idx
+
+            env_config = AttrDict(
+                worker_index=self.worker_idx,
+                vector_index=vector_idx,
+                env_id=global_env_idx,
+            )
+
+            env = make_env_func_non_batched(self.cfg, env_config=env_config)
+            check_env_info(env, self.env_info, self.cfg)
+
+            self.envs.append(env)
+            self.training_info_interfaces.append(find_training_info_interface(env))
+
+            for agent_i in range(self.num_agents):
+                agent_idx = env_i * self.num_agents + agent_i
+                self.curr_policy_id[agent_idx] = self.policy_mgr.get_policy_for_agent(agent_i, env_i, global_env_idx)
+                self._env_set_curr_policy(agent_idx)
+
+        self._reset()
+
+    def _env_set_curr_policy(self, agent_idx: int):
+        """See ActorState._env_set_curr_policy()."""
+        env = self.envs[self.env_indices[agent_idx]]
+        set_attr_if_exists(env.unwrapped, "curr_policy_idx", int(self.curr_policy_id[agent_idx]))
+
+    def _reset(self):
+        for env_i, e in enumerate(self.envs):
+            seed = int(self.global_env_indices[env_i])
+            observations, info = e.reset(seed=seed)  # new way of doing seeding since Gym 0.26.0
+
+            if self.cfg.decorrelate_envs_on_one_worker:
+                env_i_split = self.num_envs * self.split_idx + env_i
+                decorrelate_steps = self.cfg.rollout * env_i_split
+
+                log.info("Decorrelating experience for %d frames...", decorrelate_steps)
+                for decorrelate_step in range(decorrelate_steps):
+                    actions = [e.action_space.sample(obs.get("action_mask")) for obs in observations]
+                    observations, rew, terminated, truncated, info = e.step(actions)
+
+            self._set_last_obs(env_i, observations)
+
+        self.last_rnn_state[:] = 0.0
+        self.env_step_ready = True
+
+    def _set_last_obs(self, env_i: int, observations):
+        agents = self._agent_slice(env_i)
+        for key, last_obs in self.last_obs.items():
+            for agent_i, obs in enumerate(observations):
+                last_obs[agents.start + agent_i] = obs[key]
+
+    def _process_policy_outputs(self, policy_id, timing):
+        active = self.is_active
+        assert not np.any(self.curr_policy_id[active] == -1)
+
+        # via shared memory mechanism the new data should already be copied into the shared tensors
+        mask = active & (self.curr_policy_id == policy_id)
+        if np.any(mask):
+            with timing.add_time("split_output_tensors"):
+                outputs = self.policy_output_tensors.reshape(len(mask), -1)[mask]
+
+            # save parsed trajectory outputs directly into the trajectory buffer
+            buffers = self.curr_traj_buffer_idx[mask]
+            for name, output_slice in self.policy_output_slices.items():
+                if name not in self.traj_tensors:
+                    continue
+                t = self.traj_tensors[name]
+                t[buffers, self.rollout_step] = outputs[:, output_slice].reshape((len(buffers),) + t.shape[2:])
+
+            self.last_actions[mask] = outputs[:, self.policy_output_slices["actions"]]
+            # this is an rnn state for the next iteration in the rollout
+            self.last_rnn_state[mask] = outputs[:, self.policy_output_slices["new_rnn_states"]]
+
+            self.ready[mask] = True
+
+        return not np.any(active & ~self.ready)
+
+    def _env_actions(self) -> List[List]:
+        """Actions for all envs, in the format expected by env.step()."""
+        if self.scalar_discrete_actions:
+            # fast path for the most common case, produces the same Python ints as actions_for_env()
+            actions = self.last_actions[:, 0].astype(np.int32).tolist()
+        else:
+            actions = [actions_for_env(self.env_info, a.squeeze()) for a in self.last_actions]
+
+        return [actions[self._agent_slice(env_i)] for env_i in range(self.num_envs)]
+
+    def _process_env_steps(self, new_obs, rewards, terminated, truncated, infos) -> List[Dict]:
+        """Process outputs of env.step() for all envs in the vector at once."""
+        step = self.rollout_step
+        buffers = self.curr_traj_buffer_idx
+
+        if self.last_episode_reward is None:
+            # ActorState sums up scalar rewards starting from a Python number, we accumulate in the same dtype
+            # to report exactly the same episode rewards
+            reward_dtype = type(0.0 + rewards.dtype.type(0))
+            self.last_episode_reward = np.zeros(len(rewards), dtype=reward_dtype)
+        self.last_episode_reward += rewards
+        rewards = np.asarray(rewards, dtype=np.float32)
+        rewards = rewards * self.cfg.reward_scale
+        rewards = np.clip(rewards, -self.cfg.reward_clip, self.cfg.reward_clip)
+
+        dones = terminated | truncated
+
+        self.traj_tensors["rewards"][buffers, step] = rewards
+        self.traj_tensors["dones"][buffers, step] = dones
+        self.traj_tensors["time_outs"][buffers, step] = truncated
+
+        # -1 policy_id does not match any valid policy on the learner, therefore this will be treated as
+        # invalid data coming from a different policy and should be ignored by the learner.
+        self.traj_tensors["policy_id"][buffers, step] = np.where(self.is_active, self.curr_policy_id, -1)
+
+        # multiply by frameskip to get the episode lenghts matching the actual number of simulated steps
+        self.last_episode_duration += self.env_info.frameskip if self.cfg.summaries_use_frameskip else 1
+
+        self.is_active[:] = [info.get("is_active", True) for info in infos]
+
+        episodic_reports = []
+        for agent_idx in np.flatnonzero(dones):
+            episodic_reports.append(self._on_episode_end(agent_idx, infos[agent_idx]))
+
+        for env_i, obs in enumerate(new_obs):
+            self._set_last_obs(env_i, obs)
+
+        # if we encountered an episode boundary, reset rnn states to their default values
+        self.last_rnn_state[dones] = 0.0
+
+        return episodic_reports
+
+    def _on_episode_end(self, agent_idx: int, info: Dict) -> Dict:
+        policy_id = int(self.curr_policy_id[agent_idx])
+        env_i, agent_i = int(self.env_indices[agent_idx]), int(self.agent_indices[agent_idx])
+
+        report = episodic_stats(
+            info,
+            float(self.last_episode_reward[agent_idx]),
+            float(self.last_episode_duration[agent_idx]),
+            policy_id,
+        )
+
+        # propagate information in the direction RL algo -> environment
+        if self.training_info[policy_id] is not None:
+            reward_shaping = self.training_info[policy_id].get("reward_shaping", None)
+            set_reward_shaping(self.envs[env_i], reward_shaping, agent_i)
+            set_training_info(self.training_info_interfaces[env_i], self.training_info[policy_id])
+
+        global_env_idx = int(self.global_env_indices[env_i])
+        new_policy_id = self.policy_mgr.get_policy_for_agent(agent_i, env_i, global_env_idx)
+        if new_policy_id != policy_id:
+            self.curr_policy_id[agent_idx] = new_policy_id
+            # rnn state is reset anyway since we're on the episode boundary
+            self._env_set_curr_policy(agent_idx)
+
+        self.last_episode_reward[agent_idx] = self.last_episode_duration[agent_idx] = 0.0
+        return report
+
+    def _finalize_trajectories(self) -> List[Dict[str, Any]]:
+        buffers = self.curr_traj_buffer_idx
+
+        # Saving obs and hidden states for the step AFTER the last step in the current rollout.
+        # We're going to need them later when we calculate next step value estimates.
+        for key, last_obs in self.last_obs.items():
+            self.traj_tensors["obs"][key][buffers, self.cfg.rollout] = last_obs
+        self.traj_tensors["rnn_states"][buffers, self.cfg.rollout] = self.last_rnn_state
+
+        traj_policy_ids = self.traj_tensors["policy_id"][buffers]
+        curr_policy_id = self.curr_policy_id[:, None]
+        single_policy = np.all(traj_policy_ids == curr_policy_id, axis=1) | np.all(traj_policy_ids == -1, axis=1)
+
+        rollouts = []
+        for agent_idx in range(len(buffers)):
+            if single_policy[agent_idx]:
+                policy_id = int(self.curr_policy_id[agent_idx])
+                rollouts.append(self._trajectory_dict(agent_idx, policy_id, int(buffers[agent_idx])))
+            else:
+                # rare case, the policy changed in the middle of the rollout
+                policy_buffers = trajectory_buffers_per_policy(
+                    traj_policy_ids[agent_idx],
+                    int(self.curr_policy_id[agent_idx]),
+                    int(buffers[agent_idx]),
+                    self.traj_tensors,
+                    self.traj_buffer_queue,
+                )
+                for policy_id, traj_buffer_idx in policy_buffers.items():
+                    rollouts.append(self._trajectory_dict(agent_idx, policy_id, traj_buffer_idx))
+
+        self.needs_buffer[:] = True
+        self.need_trajectory_buffers += len(buffers)
+        return rollouts
+
+    def _trajectory_dict(self, agent_idx: int, policy_id: PolicyID, traj_buffer_idx: int) -> Dict[str, Any]:
+        env_i, agent_i = self.env_indices[agent_idx], self.agent_indices[agent_idx]
+        num_trajectories = self.num_trajectories[agent_idx]
+        t_id = f"{policy_id}_{self.worker_idx}_{self.split_idx}_{env_i}_{agent_i}_{num_trajectories}"
+        self.num_trajectories[agent_idx] += 1
+        return dict(t_id=t_id, length=self.rollout_step, policy_id=policy_id, traj_buffer_idx=traj_buffer_idx)
+
+    def _format_policy_request(self):
+        active = np.flatnonzero(self.is_active)
+        policy_ids = self.curr_policy_id[active]
+
+        # same order of policies as we would get iterating over the agents
+        unique_policies, first_occurrence = np.unique(policy_ids, return_index=True)
+        unique_policies = unique_policies[np.argsort(first_occurrence)]
+
+        policy_request = dict()
+        for policy_id in unique_policies:
+            agents = active[policy_ids == policy_id]
+            policy_request[int(policy_id)] = list(
+                zip(
+                    self.env_indices[agents].tolist(),
+                    self.agent_indices[agents].tolist(),
+                    self.curr_traj_buffer_idx[agents].tolist(),
+                    [self.rollout_step] * len(agents),
+                )
+            )
+
+        return policy_request
+
+    def _prepare_next_step(self):
+        active = self.is_active
+        self.ready[:] = ~active
+
+        # populate policy inputs in shared memory
+        buffers = self.curr_traj_buffer_idx[active]
+        for key, last_obs in self.last_obs.items():
+            self.traj_tensors["obs"][key][buffers, self.rollout_step] = last_obs[active]
+        self.traj_tensors["rnn_states"][buffers, self.rollout_step] = self.last_rnn_state[active]
+
+    def advance_rollouts(self, policy_id: PolicyID, timing) -> Tuple[List[Dict], List[Dict]]:
+        with timing.add_time("save_policy_outputs"):
+            all_actors_ready = self._process_policy_outputs(policy_id, timing)
+            if not all_actors_ready:
+                # not all policies involved sent their actions, waiting for more
+                return [], []
+
+        complete_rollouts = []
+
+        new_obs, rewards, terminated, truncated, infos = [], [], [], [], []
+        env_actions = self._env_actions()
+        for env_i, e in enumerate(self.envs):
+            with timing.add_time("env_step"):
+                obs, rew, term, trunc, info = e.step(env_actions[env_i])
+
+            new_obs.append(obs)
+            rewards.extend(rew)
+            terminated.extend(term)
+            truncated.extend(trunc)
+            infos.extend(info)
+
+        with timing.add_time("overhead"):
+            episodic_stats_ = self._process_env_steps(
+                new_obs,
+                np.asarray(rewards),
+                np.asarray(terminated, dtype=bool),
+                np.asarray(truncated, dtype=bool),
+                infos,
+            )
+
+        self.rollout_step += 1
+        if self.rollout_step == self.cfg.rollout:
+            # finalize and serialize the trajectory if we have a complete rollout
+            complete_rollouts = self._finalize_trajectories()
+            self.rollout_step = 0
+
+        self.env_step_ready = True
+        return complete_rollouts, episodic_stats_
+
+    def update_trajectory_buffers(self, timing) -> bool:
+        while self.need_trajectory_buffers > 0:
+            with timing.add_time("wait_for_trajectories"):
+                try:
+                    buffers = self.traj_buffer_queue.get_many(
+                        block=False,
+                        max_messages_to_get=self.need_trajectory_buffers,
+                    )
+                    agents = np.flatnonzero(self.needs_buffer)[: len(buffers)]
+                    self.curr_traj_buffer_idx[agents] = buffers[: len(agents)]
+                    self.needs_buffer[agents] = False
+                    self.need_trajectory_buffers -= len(agents)
+                except Empty:
+                    return False
+
+        assert self.need_trajectory_buffers == 0
+        return True
@@ -0,0 +1,105 @@
+"""
+TensorBoard summaries written by a separate process (see --async_summaries_queue_size).
+
+The runner only puts compact (policy_id, tag, value, step) records into a bounded queue, the writer process owns
+the actual SummaryWriters and flushes them every flush_summaries_interval seconds. If the writer can't keep up
+(i.e. slow network filesystem) records are dropped instead of blocking the runner's event loop.
+"""
+
+from __future__ import annotations
+
+import signal
+import time
+from queue import Empty, Full
+from typing import Dict, Optional, Tuple
+
+from tensorboardX import SummaryWriter
+
+from sample_factory.algo.utils.multiprocessing_utils import get_mp_ctx
+from sample_factory.utils.typing import PolicyID
+from sample_factory.utils.utils import log
+
+# (policy_id, tag, value, step)
+SummaryRecord = Tuple[PolicyID, str, float, int]
+
+_CLOSE_TIMEOUT_SEC = 30.0
+
+
+def _writer_process_main(summary_dirs: Dict[PolicyID, str], flush_secs: float, queue) -> None:
+    # Ctrl+C is handled by the main process, we keep writing until the runner closes the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # large max_queue: tensorboardX should only write events to disk when we flush
+    writers = {p: SummaryWriter(d, max_queue=100_000, flush_secs=10 * flush_secs) for p, d in summary_dirs.items()}
+
+    last_flush = time.time()
+    while True:
+        try:
+            record: Optional[SummaryRecord] = queue.get(timeout=flush_secs)
+        except Empty:
+            record = ()
+
+        if record is None:
+            break
+
+        if record:
+            policy_id, tag, value, step = record
+            writers[policy_id].add_scalar(tag, value, step)
+
+        if time.time() - last_flush >= flush_secs:
+            for w in writers.values():
+                w.flush()
+            last_flush = time.time()
+
+    for w in writers.values():
+        w.close()
+
+
+class PolicySummaryWriter:
+    """Used in place of SummaryWriter of one policy, i.e. AlgoObserver.extra_summaries() receive this object."""
+
+    def __init__(self, async_writer: AsyncSummaryWriter, policy_id: PolicyID):
+        self.async_writer = async_writer
+        self.policy_id = policy_id
+
+    def add_scalar(self, tag: str, scalar_value, global_step: int) -> None:
+        self.async_writer.add_scalar(self.policy_id, tag, scalar_value, global_step)
+
+    def flush(self) -> None:
+        # flushes are batched by the writer process
+        pass
+
+
+class AsyncSummaryWriter:
+    def __init__(self, summary_dirs: Dict[PolicyID, str], flush_secs: float, queue_size: int):
+        mp_ctx = get_mp_ctx(serial=False)
+        self.queue = mp_ctx.Queue(maxsize=queue_size)
+        self.num_dropped = 0
+
+        self.process = mp_ctx.Process(
+            target=_writer_process_main, args=(summary_dirs, flush_secs, self.queue), daemon=True
+        )
+        self.process.start()
+
+        self.writers: Dict[PolicyID, PolicySummaryWriter] = {p: PolicySummaryWriter(self, p) for p in summary_dirs}
+
+    def add_scalar(self, policy_id: PolicyID, tag: str, scalar_value, global_step: int) -> None:
+        try:
+            self.queue.put_nowait((policy_id, tag, float(scalar_value), int(global_step)))
+        except Full:
+            self.num_dropped += 1
+
+    def close(self) -> None:
+        """Write all remaining records and stop the writer process."""
+        try:
+            self.queue.put(None, timeout=_CLOSE_TIMEOUT_SEC)
+        except Full:
+            pass
+
+        self.process.join(timeout=_CLOSE_TIMEOUT_SEC)
+        if self.process.is_alive():
+            log.warning(f"Summary writer process {self.process.pid} did not finish in time, terminating...")
+            self.process.terminate()
+
+        if self.num_dropped > 0:
+            log.warning(f"{self.num_dropped} summaries were dropped because the summary writer could not keep up")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import gymnasium as gym
@@ -238,9 +239,15 @@ class BatchedVecEnv(Wrapper):
 
 
 class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingInterface):
-    """Vector interface for multiple environments simulated sequentially on one worker."""
+    """
+    Vector interface for multiple environments simulated sequentially on one worker.
+
+    With num_threads > 0 the envs are stepped concurrently in a thread pool. This only helps if env.step() releases
+    the GIL for a significant portion of time (native simulators, image processing, numpy-heavy wrappers).
+    Each thread writes observations directly into its own slice of the preallocated buffers.
+    """
 
-    def __init__(self, envs: Sequence):
+    def __init__(self, envs: Sequence, num_threads: int = 0):
         Wrapper.__init__(self, envs[0])
         TrainingInfoInterface.__init__(self)
         self.single_env_agents = envs[0].num_agents
@@ -270,6 +277,12 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
             else:
                 self.reward_shaping_interfaces.append(env_rew_shaping)
 
+        self.thread_pool: Optional[ThreadPoolExecutor] = None
+        if num_threads > 0:
+            self.thread_pool = ThreadPoolExecutor(
+                max_workers=min(num_threads, len(envs)), thread_name_prefix="env_step"
+            )
+
     def reset(self, **kwargs) -> Tuple[Dict, List[Dict]]:
         infos = []
         self.obs = dict()
@@ -281,33 +294,42 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
         dict_of_lists_cat(self.obs)
         return self.obs, infos
 
-    def step(self, actions: Tensor):
-        infos = []
-        ofs = 0
-        next_ofs = self.single_env_agents
-        for i, e in enumerate(self.envs):
-            idx = slice(ofs, next_ofs)
-            env_actions = actions[idx]
-            obs, rew, terminated, truncated, info = e.step(env_actions)
+    def _env_slice(self, env_i: int) -> slice:
+        return slice(env_i * self.single_env_agents, (env_i + 1) * self.single_env_agents)
+
+    def _step_env(self, env_i: int, env_actions):
+        obs, rew, terminated, truncated, info = self.envs[env_i].step(env_actions)
 
-            # TODO: test if this works for multi-agent envs
-            for key, x in obs.items():
-                self.obs[key][idx] = x
+        # TODO: test if this works for multi-agent envs
+        idx = self._env_slice(env_i)
+        for key, x in obs.items():
+            self.obs[key][idx] = x
 
+        return rew, terminated, truncated, info
+
+    def step(self, actions: Tensor):
+        if self.thread_pool is None:
+            results = [self._step_env(i, actions[self._env_slice(i)]) for i in range(len(self.envs))]
+        else:
+            futures = [
+                self.thread_pool.submit(self._step_env, i, actions[self._env_slice(i)]) for i in range(len(self.envs))
+            ]
+            results = [f.result() for f in futures]
+
+        infos = []
+        for i, (rew, terminated, truncated, info) in enumerate(results):
             if self.rew is None:
                 self.rew = rew.repeat(len(self.envs))
                 self.terminated = terminated.repeat(len(self.envs))
                 self.truncated = truncated.repeat(len(self.envs))
 
+            idx = self._env_slice(i)
             self.rew[idx] = rew
             self.terminated[idx] = terminated
             self.truncated[idx] = truncated
 
             infos.extend(info)
 
-            ofs += self.single_env_agents
-            next_ofs += self.single_env_agents
-
         return self.obs, self.rew, self.terminated, self.truncated, infos
 
     def set_training_info(self, training_info: Dict) -> None:
@@ -331,6 +353,8 @@ class SequentialVectorizeWrapper(Wrapper, TrainingInfoInterface, RewardShapingIn
             self.reward_shaping_interfaces[env_idx].set_reward_shaping(reward_shaping, env_agent_idx)
 
     def close(self):
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=True)
         for e in self.envs:
             e.close()
 
@@ -0,0 +1,209 @@
+"""
+Exact sizes of the trajectory buffers, policy output buffers and training batches, computed from the configuration
+before anything is allocated. Tensors are "allocated" on the meta device with the same functions BufferMgr and Batcher
+use, so the plan always matches the real allocation (except for the training batches that are allocated lazily with
+--zero_copy_batches, and only if trajectories of a batch are not contiguous).
+"""
+
+from __future__ import annotations
+
+import copy
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+from sample_factory.algo.utils.env_info import EnvInfo
+from sample_factory.algo.utils.rl_utils import trajectories_per_training_iteration
+from sample_factory.algo.utils.shared_buffers import (
+    agents_per_sampling_device,
+    alloc_policy_output_tensors,
+    alloc_trajectory_tensors,
+    batches_to_accumulate,
+    policy_device,
+    trajectory_buffers_per_device,
+    zero_copy_batches_supported,
+)
+from sample_factory.algo.utils.tensor_dict import TensorDict
+from sample_factory.model.model_utils import get_rnn_size
+from sample_factory.utils.typing import Config, Device
+from sample_factory.utils.utils import log
+
+GB = 1024**3
+
+_META = torch.device("meta")
+
+
+@dataclass
+class BufferMemory:
+    """A group of tensors allocated on the same device, e.g. all trajectory buffers of a sampling device."""
+
+    device: Device
+    name: str
+    nbytes: int
+    # size of individual tensors, i.e. "obs/obs", "rnn_states"
+    tensor_nbytes: Dict[str, int]
+
+
+def _tensor_nbytes(t: Tensor | TensorDict, prefix: str = "") -> Dict[str, int]:
+    if isinstance(t, Tensor):
+        return {prefix: t.numel() * t.element_size()}
+
+    result = dict()
+    for key, value in t.items():
+        result.update(_tensor_nbytes(value, f"{prefix}/{key}" if prefix else key))
+    return result
+
+
+def _buffer_memory(device: Device, name: str, tensors: Tensor | TensorDict, count: int = 1) -> BufferMemory:
+    tensor_nbytes = {key or name: nbytes * count for key, nbytes in _tensor_nbytes(tensors).items()}
+    return BufferMemory(device, name, sum(tensor_nbytes.values()), tensor_nbytes)
+
+
+def plan_buffer_memory(cfg: Config, env_info: EnvInfo) -> List[BufferMemory]:
+    """Memory used by all trajectory buffers, policy output buffers and training batches."""
+    rnn_size = get_rnn_size(cfg)
+
+    sampling_devices = agents_per_sampling_device(cfg, env_info).keys()
+    zero_copy = cfg.zero_copy_batches and zero_copy_batches_supported(cfg, sampling_devices)
+
+    plan = []
+    for device, num_buffers in trajectory_buffers_per_device(cfg, env_info).items():
+        traj_tensors = alloc_trajectory_tensors(env_info, num_buffers, cfg.rollout, rnn_size, _META, False)
+        plan.append(_buffer_memory(device, "trajectories", traj_tensors))
+
+        policy_output_tensors, _, _ = alloc_policy_output_tensors(cfg, env_info, rnn_size, _META, False)
+        plan.append(_buffer_memory(device, "policy_outputs", policy_output_tensors))
+
+    if zero_copy:
+        # learners train on views into the trajectory buffers, training batches are only allocated lazily
+        # if the trajectories of a batch are not contiguous (see Batcher), so we can't plan for them
+        return plan
+
+    # each learner allocates its own training batches (see Batcher)
+    training_batch = alloc_trajectory_tensors(
+        env_info, trajectories_per_training_iteration(cfg), cfg.rollout, rnn_size, _META, False
+    )
+    for policy_id in range(cfg.num_policies):
+        device = str(policy_device(cfg, policy_id))
+        plan.append(
+            _buffer_memory(device, f"training_batches_p{policy_id}", training_batch, batches_to_accumulate(cfg))
+        )
+
+    return plan
+
+
+def memory_per_device(plan: List[BufferMemory]) -> Dict[Device, int]:
+    total: Dict[Device, int] = dict()
+    for buffer in plan:
+        total[buffer.device] = total.get(buffer.device, 0) + buffer.nbytes
+    return total
+
+
+def _size_str(nbytes: int) -> str:
+    return f"{nbytes / GB:.3f} GB" if nbytes >= GB / 10 else f"{nbytes / 1024**2:.3f} MB"
+
+
+def memory_plan_str(plan: List[BufferMemory]) -> str:
+    lines = []
+    for device, total in memory_per_device(plan).items():
+        lines.append(f"Device {device}: {_size_str(total)}")
+        for buffer in plan:
+            if buffer.device != device:
+                continue
+            lines.append(f"    {buffer.name}: {_size_str(buffer.nbytes)}")
+            if len(buffer.tensor_nbytes) == 1:
+                continue
+            for key, nbytes in buffer.tensor_nbytes.items():
+                lines.append(f"        {key}: {_size_str(nbytes)}")
+
+    return "\n".join(lines)
+
+
+def _fits_in_budget(cfg: Config, env_info: EnvInfo, budget: int) -> bool:
+    return max(memory_per_device(plan_buffer_memory(cfg, env_info)).values()) <= budget
+
+
+def _valid_num_envs_per_worker(cfg: Config, env_info: EnvInfo) -> bool:
+    if cfg.num_envs_per_worker % cfg.worker_num_splits != 0:
+        return False
+    if cfg.batched_sampling:
+        # BufferMgr requires that one split divides the training batch or vice versa
+        worker_traj = env_info.num_agents * cfg.num_envs_per_worker // cfg.worker_num_splits
+        traj_per_iteration = trajectories_per_training_iteration(cfg)
+        if math.gcd(traj_per_iteration, worker_traj) != min(traj_per_iteration, worker_traj):
+            return False
+    if not cfg.async_rl:
+        # sync mode requires the workers to collect exactly the experience needed for one or more training iterations
+        samples_per_iteration = cfg.num_batches_per_epoch * cfg.batch_size
+        samples_per_rollout = cfg.num_workers * cfg.num_envs_per_worker * env_info.num_agents * cfg.rollout
+        samples_per_rollout //= cfg.num_policies
+        if samples_per_iteration % samples_per_rollout != 0:
+            return False
+    return True
+
+
+def _valid_rollout(cfg: Config, env_info: EnvInfo) -> bool:
+    if cfg.batch_size % cfg.rollout != 0:
+        return False
+    if cfg.use_rnn and cfg.rollout % cfg.recurrence != 0:
+        return False
+    return _valid_num_envs_per_worker(cfg, env_info)
+
+
+def largest_feasible_num_envs_per_worker(cfg: Config, env_info: EnvInfo, budget: int) -> Optional[int]:
+    """Largest num_envs_per_worker (all other parameters unchanged) that fits into the budget."""
+    candidate_cfg = copy.copy(cfg)
+    for num_envs in range(cfg.num_envs_per_worker, 0, -1):
+        candidate_cfg.num_envs_per_worker = num_envs
+        if _valid_num_envs_per_worker(candidate_cfg, env_info) and _fits_in_budget(candidate_cfg, env_info, budget):
+            return num_envs
+    return None
+
+
+def largest_feasible_rollout(cfg: Config, env_info: EnvInfo, budget: int) -> Optional[int]:
+    """Largest rollout (all other parameters unchanged) that fits into the budget."""
+    candidate_cfg = copy.copy(cfg)
+    for rollout in range(cfg.rollout, 0, -1):
+        candidate_cfg.rollout = rollout
+        if cfg.recurrence == cfg.rollout:
+            # i.e. recurrence was set automatically to match rollout
+            candidate_cfg.recurrence = rollout
+        if _valid_rollout(candidate_cfg, env_info) and _fits_in_budget(candidate_cfg, env_info, budget):
+            return rollout
+    return None
+
+
+def check_memory_budget(cfg: Config, env_info: EnvInfo) -> bool:
+    """
+    Log the memory breakdown of all buffers and check that they fit into cfg.buffer_memory_budget_gb.
+    :return: False if the budget is exceeded on any device.
+    """
+    plan = plan_buffer_memory(cfg, env_info)
+    log.info(f"Memory used by trajectory and training buffers:\n{memory_plan_str(plan)}")
+
+    if cfg.buffer_memory_budget_gb is None:
+        return True
+
+    budget = int(cfg.buffer_memory_budget_gb * GB)
+    over_budget = {device: nbytes for device, nbytes in memory_per_device(plan).items() if nbytes > budget}
+    if not over_budget:
+        return True
+
+    for device, nbytes in over_budget.items():
+        log.error(
+            f"Buffers on device {device} require {_size_str(nbytes)}, exceeding {cfg.buffer_memory_budget_gb=} GB"
+        )
+
+    num_envs = largest_feasible_num_envs_per_worker(cfg, env_info, budget)
+    if num_envs is not None:
+        log.error(f"Largest num_envs_per_worker that fits into the budget: {num_envs} (with {cfg.rollout=})")
+    rollout = largest_feasible_rollout(cfg, env_info, budget)
+    if rollout is not None:
+        log.error(f"Largest rollout that fits into the budget: {rollout} (with {cfg.num_envs_per_worker=})")
+    if num_envs is None and rollout is None:
+        log.error("Reducing num_envs_per_worker or rollout alone is not enough, consider a smaller batch_size")
+
+    return False
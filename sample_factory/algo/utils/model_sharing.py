@@ -3,27 +3,139 @@ Utilities for sharing model parameters between components.
 """
 
 import sys
-from typing import Optional
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, List, Optional, Set
 
 import torch
 from torch import Tensor
 
 from sample_factory.algo.utils.multiprocessing_utils import get_lock, get_mp_ctx
+from sample_factory.algo.utils.torch_utils import snapshot_state
 from sample_factory.model.actor_critic import create_actor_critic
 from sample_factory.utils.timing import Timing
 from sample_factory.utils.utils import log
 
 
+class VersionedWeights:
+    """
+    Several copies (slots) of the model state_dict in shared memory, used to publish new weights to
+    the inference workers without making them wait for the learner.
+
+    The writer always fills the slot that follows the latest published one and then flips the index
+    of the latest slot. Each slot has a sequence counter which is odd while the slot is being written (seqlock).
+    Readers copy the latest slot without taking any locks and start over if the counter changed during the copy,
+    which can only happen if the writer published num_slots - 1 more versions in the meantime.
+    Readers also mark the slot they copied as taken, so the writer can skip copying the weights (which it would
+    otherwise do after every SGD step) until the latest published version is taken by at least one reader.
+    """
+
+    def __init__(self, state_dict: Dict[str, Tensor], num_slots: int, policy_version: int):
+        assert num_slots >= 2, f"Need at least two slots for versioned weights, got {num_slots}"
+        self.num_slots = num_slots
+
+        self.slots: List[Dict[str, Tensor]] = []
+        for _ in range(num_slots):
+            slot = {k: v.detach().clone() for k, v in state_dict.items()}
+            for t in slot.values():
+                if not t.is_cuda:
+                    t.share_memory_()
+            self.slots.append(slot)
+
+        # [index of the latest slot, sequence counter of each slot, policy version stored in each slot,
+        # whether each slot was taken by a reader since it was published]
+        self.control = torch.zeros(1 + 3 * num_slots, dtype=torch.int64).share_memory_()
+        self.control[1 + num_slots : 1 + 2 * num_slots] = policy_version
+        self.control[self._taken_idx(0)] = 1  # initial weights are available to readers in any case
+
+    def _seq_idx(self, slot: int) -> int:
+        return 1 + slot
+
+    def _version_idx(self, slot: int) -> int:
+        return 1 + self.num_slots + slot
+
+    def _taken_idx(self, slot: int) -> int:
+        return 1 + 2 * self.num_slots + slot
+
+    def latest_taken(self) -> bool:
+        """Whether the latest published weights were copied by at least one reader."""
+        return bool(self.control[self._taken_idx(int(self.control[0]))])
+
+    def _synchronize(self) -> None:
+        """Make sure that all copies to/from the slots are finished before we touch the sequence counters."""
+        cuda_devices: Set[torch.device] = {t.device for t in self.slots[0].values() if t.is_cuda}
+        for device in cuda_devices:
+            torch.cuda.current_stream(device).synchronize()
+
+    def publish(self, state_dict: Dict[str, Tensor], policy_version: int) -> None:
+        """Only one process (the learner) is allowed to publish."""
+        slot = (int(self.control[0]) + 1) % self.num_slots
+        seq = int(self.control[self._seq_idx(slot)])
+
+        self.control[self._seq_idx(slot)] = seq + 1  # odd counter: slot is being written
+        self.control[self._taken_idx(slot)] = 0
+        with torch.no_grad():
+            for k, t in self.slots[slot].items():
+                t.copy_(state_dict[k])
+            self._synchronize()
+
+        self.control[self._version_idx(slot)] = policy_version
+        self.control[self._seq_idx(slot)] = seq + 2
+        self.control[0] = slot
+
+    def read_into(self, state_dict: Dict[str, Tensor]) -> int:
+        """
+        Copy the latest published weights into the (local) state_dict tensors.
+        :return: policy version of the weights that were copied
+        """
+        num_attempts = 0
+        while True:
+            slot = int(self.control[0])
+            seq = int(self.control[self._seq_idx(slot)])
+            if seq % 2 == 0:
+                policy_version = int(self.control[self._version_idx(slot)])
+                with torch.no_grad():
+                    for k, t in state_dict.items():
+                        t.copy_(self.slots[slot][k])
+                    self._synchronize()
+
+                if int(self.control[self._seq_idx(slot)]) == seq:
+                    self.control[self._taken_idx(slot)] = 1
+                    return policy_version
+
+            num_attempts += 1
+            if num_attempts % 100 == 0:
+                log.warning(f"Weights were overwritten during {num_attempts} consecutive reads, consider more slots")
+
+
+def _share_memory(x: Any) -> None:
+    if isinstance(x, Tensor):
+        x.share_memory_()
+    elif isinstance(x, dict):
+        for v in x.values():
+            _share_memory(v)
+    elif isinstance(x, (list, tuple)):
+        for v in x:
+            _share_memory(v)
+
+
 class ParameterServer:
-    def __init__(self, policy_id, policy_versions: Tensor, serial_mode: bool):
+    def __init__(self, policy_id, policy_versions: Tensor, serial_mode: bool, num_weight_slots: int = 0):
         self.policy_id = policy_id
         self.actor_critic = None
         self.policy_versions = policy_versions
         self.device: Optional[torch.device] = None
+        self.serial_mode = serial_mode
+
+        # latest learner state exported for other learners, see export_state()
+        self.exported_state: Optional[Dict] = None
 
         mp_ctx = get_mp_ctx(serial_mode)
         self._policy_lock = get_lock(serial_mode, mp_ctx)
 
+        # in serial mode all components share the same model, nothing to publish
+        self.num_weight_slots = 0 if serial_mode else num_weight_slots
+        self.versioned_weights: Optional[VersionedWeights] = None
+
     @property
     def policy_lock(self):
         return self._policy_lock
@@ -32,16 +144,42 @@ class ParameterServer:
         self.actor_critic = actor_critic
         self.policy_versions[self.policy_id] = policy_version
         self.device = device
+        if self.num_weight_slots > 0:
+            self.versioned_weights = VersionedWeights(actor_critic.state_dict(), self.num_weight_slots, policy_version)
         log.debug("Initialized policy %d weights for model version %d", self.policy_id, policy_version)
 
-    def update_weights(self, policy_version):
+    def update_weights(self, policy_version, force: bool = False, state_lock: Optional[ContextManager] = None):
         """
         In async algorithms policy_versions tensor is in shared memory.
         Therefore clients can just look at the location in shared memory once in a while to see if the
         weights are updated.
+        With versioned weights we first publish a snapshot of the current weights, clients then copy it without
+        taking the policy lock. Copying the weights is skipped if the previously published version was not taken
+        by any client yet (unless force=True), clients will then pick up a newer version a bit later.
+        :param state_lock: lock to hold while we take the snapshot, only needed if other threads of the learner
+            process can modify the model state concurrently (i.e. normalizer statistics updated by batch prefetching)
         """
+        if self.versioned_weights is not None:
+            if not force and not self.versioned_weights.latest_taken():
+                return
+
+            with state_lock if state_lock is not None else nullcontext():
+                self.versioned_weights.publish(self.actor_critic.state_dict(), policy_version)
+
         self.policy_versions[self.policy_id] = policy_version
 
+    def export_state(self, state: Dict) -> Dict:
+        """
+        Copy the learner state (weights, optimizer state, etc.) to CPU shared memory, so that the learner of another
+        policy can load it directly instead of going through a checkpoint on disk (i.e. PBT policy replacement).
+        We keep a reference to the latest export so the shared memory stays alive until the other learner loads it.
+        """
+        exported = snapshot_state(state)
+        if not self.serial_mode:
+            _share_memory(exported)
+        self.exported_state = exported
+        return exported
+
 
 class ParameterClient:
     def __init__(self, param_server: ParameterServer, cfg, env_info, timing: Timing):
@@ -98,6 +236,8 @@ class ParameterClientAsync(ParameterClient):
     def __init__(self, param_server: ParameterServer, cfg, env_info, timing: Timing):
         super().__init__(param_server, cfg, env_info, timing)
         self._shared_model_weights = None
+        self._versioned_weights: Optional[VersionedWeights] = None
+        self._local_state_dict: Optional[Dict[str, Tensor]] = None
         self.num_policy_updates = 0
 
     @property
@@ -118,6 +258,12 @@ class ParameterClientAsync(ParameterClient):
 
         self._init_local_copy(device, self.cfg, self.env_info.obs_space, self.env_info.action_space)
 
+        if isinstance(state_dict, VersionedWeights):
+            self._versioned_weights = state_dict
+            self._local_state_dict = self._actor_critic.state_dict()
+            self.latest_policy_version = self._versioned_weights.read_into(self._local_state_dict)
+            return
+
         with self._policy_lock:
             if state_dict is None:
                 log.warning(f"Parameter client {self.policy_id} received empty state dict, using random weights...")
@@ -125,14 +271,22 @@ class ParameterClientAsync(ParameterClient):
                 self._actor_critic.load_state_dict(state_dict)
                 self._shared_model_weights = state_dict
 
-    def ensure_weights_updated(self):
-        server_policy_version = self._get_server_policy_version()
-        if self.latest_policy_version < server_policy_version and self._shared_model_weights is not None:
+    def _load_latest_weights(self, server_policy_version: int) -> None:
+        if self._versioned_weights is not None:
+            # the version of the slot we copied is at least as recent as the one we were notified about
+            with self.timing.time_avg("weight_update"):
+                self.latest_policy_version = self._versioned_weights.read_into(self._local_state_dict)
+        else:
             with self.timing.time_avg("weight_update"), self._policy_lock:
                 self._actor_critic.load_state_dict(self._shared_model_weights)
-
             self.latest_policy_version = server_policy_version
 
+    def ensure_weights_updated(self):
+        server_policy_version = self._get_server_policy_version()
+        has_weights = self._shared_model_weights is not None or self._versioned_weights is not None
+        if self.latest_policy_version < server_policy_version and has_weights:
+            self._load_latest_weights(server_policy_version)
+
             self.num_policy_updates += 1
             if self.num_policy_updates % 10 == 0:
                 log.info(
@@ -147,6 +301,8 @@ class ParameterClientAsync(ParameterClient):
         weights = self._shared_model_weights
         del self._actor_critic
         del self._shared_model_weights
+        del self._versioned_weights
+        del self._local_state_dict
         del self.policy_versions
 
         if weights is not None:
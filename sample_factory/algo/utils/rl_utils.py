@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Dict, Optional, Sequence, Union
+from typing import ContextManager, Dict, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -33,10 +33,16 @@ def num_agents_per_worker(cfg: Config, env_info: EnvInfo) -> int:
     return cfg.num_envs_per_worker * env_info.num_agents
 
 
-def prepare_and_normalize_obs(model: Module, obs: TensorDict | Dict[str, Tensor]) -> TensorDict | Dict[str, Tensor]:
+def prepare_and_normalize_obs(
+    model: Module,
+    obs: TensorDict | Dict[str, Tensor],
+    out: Optional[Dict[str, Tensor]] = None,
+    stats_lock: Optional[ContextManager] = None,
+) -> TensorDict | Dict[str, Tensor]:
+    """See ObservationNormalizer.forward() for the description of out and stats_lock."""
     for key, x in obs.items():
         obs[key] = ensure_torch_tensor(x).to(model.device_for_input_tensor(key))
-    normalized_obs = model.normalize_obs(obs)
+    normalized_obs = model.normalize_obs(obs, out, stats_lock)
     for key, x in normalized_obs.items():
         normalized_obs[key] = x.type(model.type_for_input_tensor(key))
     return normalized_obs
@@ -73,9 +79,70 @@ def calculate_discounted_sum_torch(
     return discounted_sum
 
 
+@torch.jit.script
+def calculate_discounted_sum_blocked(
+    x: Tensor, dones: Tensor, valids: Tensor, discount: float, block_size: int, x_last: Optional[Tensor] = None
+) -> Tensor:
+    """
+    Same as calculate_discounted_sum_torch(), but evaluated as a blocked scan: the trajectory is split into blocks
+    of block_size steps, discounted sums within all blocks are calculated at once by multiplying by a discount
+    matrix, and only the cumulative sum carried between the blocks is propagated sequentially.
+    This requires T / block_size sequential steps instead of T.
+
+    Within a block, y[i] = sum_{j >= i} prod_{k=i}^{j-1} (discount_valid[k] * (1 - dones[k])) * x[j].
+    The product is discount^(number of valid steps in [i, j)) if there are no episode boundaries in [i, j) and
+    zero otherwise, so the discount matrix can be built from prefix sums of valids and dones.
+    x, dones and valids are [T, E] tensors (time first).
+    """
+    if x_last is None:
+        x_last = x[-1].clone().fill_(0.0)
+
+    num_steps, num_envs = x.shape[0], x.shape[1]
+    num_blocks = (num_steps + block_size - 1) // block_size
+
+    # pad at the beginning so that the trajectory is split into whole blocks, padded outputs are discarded
+    padding = torch.zeros(num_blocks * block_size - num_steps, num_envs, dtype=x.dtype, device=x.device)
+    block_shape = [num_blocks, block_size, num_envs]
+    x = torch.cat([padding, x]).view(block_shape)
+    valids = torch.cat([padding, valids.to(x.dtype)]).view(block_shape)
+    dones = torch.cat([padding, dones.to(x.dtype)]).view(block_shape)
+
+    # number of valid steps and episode boundaries before each step of the block, [num_blocks, block_size + 1, E]
+    zeros = torch.zeros(num_blocks, 1, num_envs, dtype=x.dtype, device=x.device)
+    valid_count = torch.cat([zeros, torch.cumsum(valids, dim=1)], dim=1)
+    done_count = torch.cat([zeros, torch.cumsum(dones, dim=1)], dim=1)
+
+    # [num_blocks, i, j, E] discount matrices, column j == block_size applies to the sum carried from the next block
+    # below the diagonal the exponents are negative, zero them out: discount^-n is inf for a zero discount
+    # (i.e. gae_lambda=0) and inf * 0 would turn the masked out elements into NaNs
+    num_discounts = (valid_count.unsqueeze(1) - valid_count.unsqueeze(2)).clamp(min=0.0)
+    same_episode = done_count.unsqueeze(1) == done_count.unsqueeze(2)
+    triangular = torch.ones(block_size + 1, block_size + 1, dtype=x.dtype, device=x.device).triu_().unsqueeze(-1)
+    discount_matrix = torch.pow(discount, num_discounts) * same_episode * triangular
+    discount_matrix = discount_matrix[:, :block_size]
+
+    block_sums = (discount_matrix[:, :, :block_size] * x.unsqueeze(1)).sum(dim=2)
+    carry_discounts = discount_matrix[:, :, block_size]
+
+    cumulative = x_last
+    i = num_blocks - 1
+    while i >= 0:
+        block_sums[i] += carry_discounts[i] * cumulative
+        cumulative = block_sums[i, 0]
+        i -= 1
+
+    return block_sums.view(num_blocks * block_size, num_envs)[-num_steps:]
+
+
 # noinspection NonAsciiCharacters
 @torch.jit.script
-def gae_advantages(rewards: Tensor, dones: Tensor, values: Tensor, valids: Tensor, γ: float, λ: float) -> Tensor:
+def gae_advantages(
+    rewards: Tensor, dones: Tensor, values: Tensor, valids: Tensor, γ: float, λ: float, block_size: int = 0
+) -> Tensor:
+    """
+    :param block_size: if > 0, the discounted sum of deltas is calculated with a blocked scan
+        (see calculate_discounted_sum_blocked()), otherwise one step at a time.
+    """
     rewards = rewards.transpose(0, 1)  # [E, T] -> [T, E]
     dones = dones.transpose(0, 1).float()  # [E, T] -> [T, E]
     values = values.transpose(0, 1)  # [E, T+1] -> [T+1, E]
@@ -87,13 +154,53 @@ def gae_advantages(rewards: Tensor, dones: Tensor, values: Tensor, valids: Tenso
     # section 3 in GAE paper: calculating advantages
     deltas = (rewards - values[:-1]) * valids[:-1] + (1 - dones) * (γ * values[1:] * valids[1:])
 
-    advantages = calculate_discounted_sum_torch(deltas, dones, valids[:-1], γ * λ)
+    if block_size > 0:
+        advantages = calculate_discounted_sum_blocked(deltas, dones, valids[:-1], γ * λ, block_size)
+    else:
+        advantages = calculate_discounted_sum_torch(deltas, dones, valids[:-1], γ * λ)
 
     # transpose advantages back to [E, T] before creating a single experience buffer
     advantages.transpose_(0, 1)
     return advantages
 
 
+@torch.jit.script
+def vtrace(
+    ratios: Tensor, values: Tensor, rewards: Tensor, dones: Tensor, rho_hat: float, c_hat: float, gamma: float
+) -> Tuple[Tensor, Tensor]:
+    """
+    V-trace value targets and advantages (https://arxiv.org/abs/1802.01561) calculated as a single reverse scan
+    over the time dimension. All inputs are [N, T] tensors (N trajectories of length T) on the same device.
+    Returns a tuple (vs, advantages) of [N, T] tensors.
+    """
+    ratios = ratios.transpose(0, 1)  # [N, T] -> [T, N]
+    values = values.transpose(0, 1)
+    rewards = rewards.transpose(0, 1)
+    not_done_gamma = (1.0 - dones.transpose(0, 1).float()) * gamma
+
+    vtrace_rho = torch.clamp(ratios, max=rho_hat)
+    vtrace_c = torch.clamp(ratios, max=c_hat)
+
+    # we don't have the value estimate for the step after the end of the trajectory, so we approximate it
+    next_values = (values[-1] - rewards[-1]) / gamma
+    next_vs = next_values
+
+    vs = torch.empty_like(values)
+    advantages = torch.empty_like(values)
+    i = len(values) - 1
+    while i >= 0:
+        curr_values = values[i]
+        delta_s = vtrace_rho[i] * (rewards[i] + not_done_gamma[i] * next_values - curr_values)
+        advantages[i] = vtrace_rho[i] * (rewards[i] + not_done_gamma[i] * next_vs - curr_values)
+        next_vs = curr_values + delta_s + not_done_gamma[i] * vtrace_c[i] * (next_vs - next_values)
+        vs[i] = next_vs
+        next_values = curr_values
+        i -= 1
+
+    # transpose back to [N, T]
+    return vs.transpose(0, 1), advantages.transpose(0, 1)
+
+
 DonesType = Union[bool, np.ndarray, Tensor, Sequence[bool]]
 
 
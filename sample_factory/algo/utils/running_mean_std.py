@@ -4,7 +4,7 @@ All credit goes to https://github.com/Denys88/rl_games (only slightly changed he
 Thanks a lot, great module!
 """
 
-from typing import Dict, Final, List, Optional, Union
+from typing import Dict, Final, List, Optional, Tuple, Union
 
 import gymnasium as gym
 import torch
@@ -42,6 +42,12 @@ class RunningMeanStdInPlace(nn.Module):
             self.axis = [0]
             shape = input_shape
 
+        # number of elements of a single sample that contribute to each statistic (i.e. pixels of a channel)
+        elements_per_sample = 1
+        for dim in self.axis[1:]:
+            elements_per_sample *= self.input_shape[dim - 1]
+        self.elements_per_sample: Final[int] = elements_per_sample
+
         self.register_buffer("running_mean", torch.zeros(shape, dtype=torch.float64))
         self.register_buffer("running_var", torch.ones(shape, dtype=torch.float64))
         self.register_buffer("count", torch.ones([1], dtype=torch.float64))
@@ -61,37 +67,74 @@ class RunningMeanStdInPlace(nn.Module):
         new_var = M2 / tot_count
         return new_mean, new_var, tot_count
 
-    def forward(self, x: Tensor, denormalize: bool = False) -> None:
-        """Normalizes in-place! This function modifies the input tensor and returns nothing."""
+    def batch_moments(self, x: Tensor) -> Tuple[int, Tensor, Tensor]:
+        """
+        Sufficient statistics of the batch: number of samples, sum and sum of squares (float64) along the
+        normalization axis. Does not touch the running statistics, so it does not need to be synchronized with other
+        users of this module, see update_from_moments().
+        """
+        # check if the shape exactly matches or it's a scalar for which we use shape (1, )
+        assert x.shape[1:] == self.input_shape or (
+            x.shape[1:] == () and self.input_shape == (1,)
+        ), f"RMS expected input shape {self.input_shape}, got {x.shape[1:]}"
+
+        batch_count = x.size()[0]
+        n = batch_count * self.elements_per_sample
+        σ2, μ = torch.var_mean(x, self.axis)  # along channel axis, single pass over the data
+        μ, σ2 = μ.double(), σ2.double()
+        return batch_count, μ * n, σ2 * (n - 1) + μ * μ * n
+
+    def update_from_moments(self, batch_count: int, batch_sum: Tensor, batch_sumsq: Tensor) -> None:
+        """Merge the statistics of a batch (see batch_moments()) into the running statistics."""
+        n = batch_count * self.elements_per_sample
+        μ = batch_sum / n
+        σ2 = (batch_sumsq - batch_sum * μ) / (n - 1)  # unbiased, same as Tensor.var()
+        self.running_mean[:], self.running_var[:], self.count[:] = self._update_mean_var_count_from_moments(
+            self.running_mean, self.running_var, self.count, μ, σ2, batch_count
+        )
+
+    def forward(self, x: Tensor, denormalize: bool = False, valids: Optional[Tensor] = None) -> None:
+        """
+        Normalizes in-place! This function modifies the input tensor and returns nothing.
+        :param valids: boolean mask of the samples that contribute to the statistics, all samples are normalized
+        """
         if self.training and not denormalize:
-            # check if the shape exactly matches or it's a scalar for which we use shape (1, )
-            assert x.shape[1:] == self.input_shape or (
-                x.shape[1:] == () and self.input_shape == (1,)
-            ), f"RMS expected input shape {self.input_shape}, got {x.shape[1:]}"
-
-            batch_count = x.size()[0]
-            μ = x.mean(self.axis)  # along channel axis
-            σ2 = x.var(self.axis)
-            self.running_mean[:], self.running_var[:], self.count[:] = self._update_mean_var_count_from_moments(
-                self.running_mean, self.running_var, self.count, μ, σ2, batch_count
-            )
+            samples = x if valids is None else x[valids]
+            if samples.size(0) > 1:
+                batch_count, batch_sum, batch_sumsq = self.batch_moments(samples)
+                self.update_from_moments(batch_count, batch_sum, batch_sumsq)
+
+        self.normalize(x, denormalize)
+
+    def snapshot(self) -> Tuple[Tensor, Tensor]:
+        """Copy of the running mean and variance, i.e. to normalize with consistent statistics without a lock."""
+        return self.running_mean.clone(), self.running_var.clone()
+
+    def normalize(self, x: Tensor, denormalize: bool = False, stats: Optional[Tuple[Tensor, Tensor]] = None) -> None:
+        """
+        Normalizes in-place using the current running statistics, without updating them.
+        :param stats: (mean, var) to use instead of the running statistics, see snapshot()
+        """
+        running_mean, running_var = self.running_mean, self.running_var
+        if stats is not None:
+            running_mean, running_var = stats[0], stats[1]
 
         # change shape
         if self.per_channel:
             if len(self.input_shape) == 3:
-                current_mean = self.running_mean.view([1, self.input_shape[0], 1, 1]).expand_as(x)
-                current_var = self.running_var.view([1, self.input_shape[0], 1, 1]).expand_as(x)
+                current_mean = running_mean.view([1, self.input_shape[0], 1, 1]).expand_as(x)
+                current_var = running_var.view([1, self.input_shape[0], 1, 1]).expand_as(x)
             elif len(self.input_shape) == 2:
-                current_mean = self.running_mean.view([1, self.input_shape[0], 1]).expand_as(x)
-                current_var = self.running_var.view([1, self.input_shape[0], 1]).expand_as(x)
+                current_mean = running_mean.view([1, self.input_shape[0], 1]).expand_as(x)
+                current_var = running_var.view([1, self.input_shape[0], 1]).expand_as(x)
             elif len(self.input_shape) == 1:
-                current_mean = self.running_mean.view([1, self.input_shape[0]]).expand_as(x)
-                current_var = self.running_var.view([1, self.input_shape[0]]).expand_as(x)
+                current_mean = running_mean.view([1, self.input_shape[0]]).expand_as(x)
+                current_var = running_var.view([1, self.input_shape[0]]).expand_as(x)
             else:
                 raise RuntimeError(f"RunningMeanStd input shape {self.input_shape} not supported")
         else:
-            current_mean = self.running_mean
-            current_var = self.running_var
+            current_mean = running_mean
+            current_var = running_var
 
         μ = current_mean.float()
         σ2 = current_var.float()
@@ -135,6 +178,24 @@ class RunningMeanStdDictInPlace(nn.Module):
         for k, module in self.running_mean_std.items():
             module(x[k])
 
+    def batch_moments(self, x: Dict[str, Tensor]) -> Dict[str, Tuple[int, Tensor, Tensor]]:
+        return {k: module.batch_moments(x[k]) for k, module in self.running_mean_std.items()}
+
+    def update_from_moments(self, moments: Dict[str, Tuple[int, Tensor, Tensor]]) -> None:
+        for k, module in self.running_mean_std.items():
+            module.update_from_moments(*moments[k])
+
+    def snapshot(self) -> Dict[str, Tuple[Tensor, Tensor]]:
+        return {k: module.snapshot() for k, module in self.running_mean_std.items()}
+
+    def normalize(self, x: Dict[str, Tensor], stats: Optional[Dict[str, Tuple[Tensor, Tensor]]] = None) -> None:
+        """
+        Normalize in-place without updating the statistics.
+        :param stats: statistics to use instead of the running statistics, see snapshot()
+        """
+        for k, module in self.running_mean_std.items():
+            module.normalize(x[k], stats=None if stats is None else stats[k])
+
 
 def running_mean_std_summaries(running_mean_std_module: Union[nn.Module, ScriptModule, RecursiveScriptModule]):
     m = running_mean_std_module
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import math
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import torch
 from gymnasium import spaces
@@ -19,7 +19,7 @@ from sample_factory.cfg.configurable import Configurable
 from sample_factory.model.model_utils import get_rnn_size
 from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.gpu_utils import gpus_for_process
-from sample_factory.utils.typing import Device, MpQueue, PolicyID
+from sample_factory.utils.typing import Config, Device, MpQueue, PolicyID
 from sample_factory.utils.utils import log
 
 
@@ -40,6 +40,10 @@ def init_tensor(leading_dimensions: List, tensor_type, tensor_shape, device: tor
     tensor_shape = [x for x in tensor_shape if x]
 
     final_shape = leading_dimensions + list(tensor_shape)
+    if torch.device(device).type == "meta":
+        # meta tensors have shapes and dtypes but no data, we use them to plan memory usage before allocation
+        return torch.empty(final_shape, dtype=tensor_type, device=device)
+
     t = torch.zeros(final_shape, dtype=tensor_type)
 
     # fill with magic values to make it easy to spot if we ever use unintialized data
@@ -149,22 +153,63 @@ def alloc_policy_output_tensors(cfg, env_info: EnvInfo, rnn_size, device, share)
     return policy_output_tensors, output_names, output_sizes
 
 
+def agents_per_sampling_device(cfg: Config, env_info: EnvInfo) -> Dict[Device, int]:
+    """Total number of agents simulated by all rollout workers on each sampling device."""
+    num_agents: Dict[Device, int] = dict()
+    for i in range(cfg.num_workers):
+        # TODO: this should take into account whether we just need a GPU for sampling, or we actually receive observations on the GPU
+        # otherwise it will not work for things like Megaverse or GPU-rendered DMLab
+        sampling_device = str(rollout_worker_device(i, cfg, env_info))
+        num_agents[sampling_device] = num_agents.get(sampling_device, 0) + env_info.num_agents * cfg.num_envs_per_worker
+
+    return num_agents
+
+
+def batches_to_accumulate(cfg: Config) -> int:
+    """Number of training batches we're allowed to accumulate before experience collection is halted."""
+    # in synchronous mode we only accumulate one batch
+    return cfg.num_batches_to_accumulate if cfg.async_rl else 1
+
+
+def zero_copy_batches_supported(cfg: Config, sampling_devices: Iterable[Device]) -> bool:
+    """We can train directly on the shared trajectory buffers only if they are on the learner device."""
+    learner_devices = {str(policy_device(cfg, policy_id)) for policy_id in range(cfg.num_policies)}
+    return len(learner_devices) == 1 and set(sampling_devices) == learner_devices
+
+
+def trajectory_buffers_per_device(cfg: Config, env_info: EnvInfo) -> Dict[Device, int]:
+    """Number of trajectory buffers (each holding a single rollout of a single agent) to allocate on each device."""
+    trajectories_in_batches = batches_to_accumulate(cfg) * trajectories_per_training_iteration(cfg) * cfg.num_policies
+
+    buffers_per_device: Dict[Device, int] = dict()
+    for device, num_buffers in agents_per_sampling_device(cfg, env_info).items():
+        if cfg.async_rl or cfg.num_policies > 1:
+            # One set of buffers to sample, one to learn from. Coefficient 2 seems appropriate here.
+            # Also: multi-policy training may require more buffers since some trajectories need to be sent
+            # to multiple workers.
+            num_buffers *= 2
+        else:
+            # in synchronous mode we only allocate a single set of trajectories
+            # and they are not released until the learner finishes learning from them
+            pass
+
+        # make sure that at the very least we have enough buffers to feed the learner
+        # with zero-copy batches trajectories are held until the learner is done with them (even in async mode),
+        # we don't allocate extra buffers for this: sampling just has fewer free buffers while the learner is busy
+        num_buffers = max(num_buffers, trajectories_in_batches)
+
+        buffers_per_device[device] = num_buffers
+
+    return buffers_per_device
+
+
 class BufferMgr(Configurable):
     def __init__(self, cfg, env_info: EnvInfo):
         super().__init__(cfg)
         self.env_info = env_info
 
-        self.buffers_per_device: Dict[Device, int] = dict()
-
-        for i in range(cfg.num_workers):
-            # TODO: this should take into account whether we just need a GPU for sampling, or we actually receive observations on the GPU
-            # otherwise it will not work for things like Megaverse or GPU-rendered DMLab
-            sampling_device = str(rollout_worker_device(i, cfg, self.env_info))
-            log.debug(f"Rollout worker {i} uses device {sampling_device}")
-
-            num_buffers = env_info.num_agents * cfg.num_envs_per_worker
-            buffers_for_device = self.buffers_per_device.get(sampling_device, 0) + num_buffers
-            self.buffers_per_device[sampling_device] = buffers_for_device
+        sampling_devices = list(agents_per_sampling_device(cfg, env_info).keys())
+        log.debug(f"Rollout workers use devices {sampling_devices}")
 
         rnn_size = get_rnn_size(cfg)  # in case we have RNNs
 
@@ -181,22 +226,24 @@ class BufferMgr(Configurable):
 
         share = not cfg.serial_mode
 
-        if cfg.async_rl or cfg.num_policies > 1:
-            # One set of buffers to sample, one to learn from. Coefficient 2 seems appropriate here.
-            # Also: multi-policy training may require more buffers since some trajectories need to be sent
-            # to multiple workers.
-            for device in self.buffers_per_device:
-                self.buffers_per_device[device] *= 2
-        else:
-            # in synchronous mode we only allocate a single set of trajectories
-            # and they are not released until the learner finishes learning from them
-            pass
-
         # determine the number of minibatches we're allowed to accumulate before experience collection is halted
-        self.max_batches_to_accumulate = cfg.num_batches_to_accumulate
+        self.max_batches_to_accumulate = batches_to_accumulate(cfg)
         if not cfg.async_rl:
             log.debug("In synchronous mode, we only accumulate one batch. Setting num_batches_to_accumulate to 1")
-            self.max_batches_to_accumulate = 1
+
+        # train directly on the shared trajectory buffers (only possible if they are on the learner device)
+        self.zero_copy_batches = False
+        if cfg.zero_copy_batches:
+            if zero_copy_batches_supported(cfg, sampling_devices):
+                self.zero_copy_batches = True
+            else:
+                learner_devices = {str(policy_device(cfg, policy_id)) for policy_id in range(cfg.num_policies)}
+                log.warning(
+                    f"Zero-copy batches require trajectories on the learner device ({learner_devices=}, "
+                    f"{sampling_devices=}), copying trajectories instead"
+                )
+
+        self.buffers_per_device = trajectory_buffers_per_device(cfg, env_info)
 
         # allocate trajectory buffers for sampling
         self.traj_buffer_queues: Dict[Device, MpQueue] = dict()
@@ -204,12 +251,6 @@ class BufferMgr(Configurable):
         self.policy_output_tensors_torch = dict()
 
         for device, num_buffers in self.buffers_per_device.items():
-            # make sure that at the very least we have enough buffers to feed the learner
-            num_buffers = max(
-                num_buffers,
-                self.max_batches_to_accumulate * self.trajectories_per_training_iteration * cfg.num_policies,
-            )
-
             self.traj_buffer_queues[device] = get_queue(cfg.serial_mode)
 
             self.traj_tensors_torch[device] = alloc_trajectory_tensors(
@@ -237,3 +278,11 @@ class BufferMgr(Configurable):
         self.policy_versions = torch.zeros([cfg.num_policies], dtype=torch.int32)
         if share:
             self.policy_versions.share_memory_()
+
+    def num_free_trajectories(self, device: Device) -> int:
+        """Approximate, because rollout workers and batchers take and return buffers concurrently."""
+        num_free = self.traj_buffer_queues[device].qsize()
+        if self.cfg.batched_sampling:
+            # queue entries are slices of sampling_trajectories_per_iteration trajectories
+            num_free *= self.sampling_trajectories_per_iteration
+        return num_free
@@ -0,0 +1,354 @@
+"""
+Vector env that steps environments in child processes, so that a single rollout worker (with one event loop and one
+set of trajectory buffers) can drive many slow environments in parallel.
+
+Observations, rewards and dones are written by the child processes directly into shared memory tensors, laid out in
+the same dict-of-tensors format as BatchedVecEnv, and actions are read by the children from a shared buffer.
+Steps are coordinated with semaphores. Pipes are only used for rare messages: reset(), training info, reward shaping,
+errors, and the non-empty infos dicts (i.e. at the end of episodes).
+"""
+
+from __future__ import annotations
+
+import signal
+import time
+import traceback
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context, sf_global_context
+from sample_factory.algo.utils.env_info import EnvInfo, check_env_info
+from sample_factory.algo.utils.make_env import SequentialVectorizeWrapper, make_env_func_batched
+from sample_factory.algo.utils.multiprocessing_utils import get_mp_ctx
+from sample_factory.envs.env_utils import (
+    RewardShapingInterface,
+    TrainingInfoInterface,
+    find_training_info_interface,
+    get_default_reward_shaping,
+    set_reward_shaping,
+    set_training_info,
+)
+from sample_factory.utils.typing import Config
+from sample_factory.utils.utils import log
+
+# commands sent to the child processes
+_STEP, _CALL, _CLOSE = 0, 1, 2
+# status of the child process after the step
+_OK, _HAS_INFOS, _ERROR = 0, 1, 2
+
+# how often we check that child processes are still alive while waiting for them
+_LIVENESS_CHECK_SEC = 1.0
+# processes that take longer than this to shut down are terminated
+_CLOSE_TIMEOUT_SEC = 30.0
+
+
+def _share(x: Tensor | np.ndarray) -> Tensor:
+    return torch.as_tensor(x).clone().share_memory_()
+
+
+def _to_numpy_or_tensor(t: Tensor, as_numpy: bool) -> Tensor | np.ndarray:
+    return t.numpy() if as_numpy else t
+
+
+class _EnvProcess:
+    """Runs in the child process: a group of envs stepped one after another."""
+
+    def __init__(self, cfg: Config, env_info: EnvInfo, env_configs: List, pipe: Connection):
+        self.pipe = pipe
+
+        envs = []
+        for env_config in env_configs:
+            env = make_env_func_batched(cfg, env_config)
+            check_env_info(env, env_info, cfg)
+            env.seed(env_config.env_id)  # since Gym 0.26 seeding is done in reset(), we do it in BatchedVecEnv class
+            envs.append(env)
+
+        self.vec_env = envs[0] if len(envs) == 1 else SequentialVectorizeWrapper(envs)
+
+        # slices of the shared buffers that belong to this process (set by the parent after the first reset)
+        self.obs: Optional[Dict[str, Tensor]] = None
+        self.rew = self.terminated = self.truncated = None
+        self.actions: Any = None
+
+    # methods called by the parent through the pipe
+
+    def num_agents(self) -> int:
+        return self.vec_env.num_agents
+
+    def reset(self, kwargs: Dict) -> Tuple[Dict[str, Tensor], List[Dict]]:
+        return self.vec_env.reset(**kwargs)
+
+    def set_buffers(self, obs: Dict[str, Tensor], rew: Tensor, terminated: Tensor, truncated: Tensor) -> None:
+        self.obs, self.rew, self.terminated, self.truncated = obs, rew, terminated, truncated
+
+    def set_actions(self, actions: Tensor | List[Tensor], as_numpy: bool) -> None:
+        if isinstance(actions, (list, tuple)):
+            self.actions = [_to_numpy_or_tensor(a, as_numpy) for a in actions]
+        else:
+            self.actions = _to_numpy_or_tensor(actions, as_numpy)
+
+    def set_training_info(self, training_info: Dict) -> None:
+        set_training_info(find_training_info_interface(self.vec_env), training_info)
+
+    def get_default_reward_shaping(self) -> Optional[Dict[str, Any]]:
+        return get_default_reward_shaping(self.vec_env)
+
+    def set_reward_shaping(self, reward_shaping: Dict[str, Any], agent_indices: slice) -> None:
+        set_reward_shaping(self.vec_env, reward_shaping, agent_indices)
+
+    def step(self) -> List[Dict]:
+        obs, rew, terminated, truncated, infos = self.vec_env.step(self.actions)
+        for key, x in obs.items():
+            self.obs[key].copy_(torch.as_tensor(x))
+        self.rew.copy_(torch.as_tensor(rew))
+        self.terminated.copy_(torch.as_tensor(terminated))
+        self.truncated.copy_(torch.as_tensor(truncated))
+        return infos
+
+    def run(self, idx: int, step_sem, done_sem, commands, statuses) -> None:
+        while True:
+            step_sem.acquire()
+            command = commands[idx]
+
+            if command == _STEP:
+                try:
+                    infos = self.step()
+                except Exception:
+                    statuses[idx] = _ERROR
+                    done_sem.release()
+                    self.pipe.send(traceback.format_exc())
+                    continue
+
+                has_infos = any(infos)
+                statuses[idx] = _HAS_INFOS if has_infos else _OK
+                # release before sending: the parent only reads the pipes once all processes are done with the step
+                done_sem.release()
+                if has_infos:
+                    self.pipe.send(infos)
+            elif command == _CALL:
+                method, args = self.pipe.recv()
+                try:
+                    self.pipe.send((True, getattr(self, method)(*args)))
+                except Exception:
+                    self.pipe.send((False, traceback.format_exc()))
+            elif command == _CLOSE:
+                self.vec_env.close()
+                break
+
+
+def _env_process_main(
+    sf_context: SampleFactoryContext,
+    cfg: Config,
+    env_info: EnvInfo,
+    env_configs: List,
+    idx: int,
+    pipe: Connection,
+    step_sem,
+    done_sem,
+    commands,
+    statuses,
+) -> None:
+    set_global_context(sf_context)
+    # Ctrl+C is handled by the main process which stops the rollout worker, which then closes the env processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(1)
+
+    try:
+        env_process = _EnvProcess(cfg, env_info, env_configs, pipe)
+    except Exception:
+        pipe.send((False, traceback.format_exc()))
+        return
+
+    pipe.send((True, None))
+    env_process.run(idx, step_sem, done_sem, commands, statuses)
+
+
+class SubprocessVectorizeWrapper(TrainingInfoInterface, RewardShapingInterface):
+    """
+    Same interface as SequentialVectorizeWrapper, but envs are split between num_processes child processes
+    which step their envs concurrently. Only supports envs with observations and actions on CPU.
+    """
+
+    def __init__(self, cfg: Config, env_info: EnvInfo, env_configs: Sequence, num_processes: int):
+        TrainingInfoInterface.__init__(self)
+        self.env_info = env_info
+        self.observation_space = env_info.obs_space
+        self.action_space = env_info.action_space
+        self.is_multiagent = True
+
+        num_processes = min(num_processes, len(env_configs))
+        # contiguous groups of envs so that every process owns a contiguous range of agents in the shared buffers
+        env_groups = [list(group) for group in np.array_split(np.arange(len(env_configs)), num_processes)]
+
+        mp_ctx = get_mp_ctx(serial=False)
+        self.pipes: List[Connection] = []
+        self.step_sems = []
+        self.done_sem = mp_ctx.Semaphore(0)
+        self.commands = mp_ctx.RawArray("b", num_processes)
+        self.statuses = mp_ctx.RawArray("b", num_processes)
+        self.processes = []
+
+        for idx, group in enumerate(env_groups):
+            parent_pipe, child_pipe = mp_ctx.Pipe()
+            step_sem = mp_ctx.Semaphore(0)
+            process = mp_ctx.Process(
+                target=_env_process_main,
+                args=(
+                    sf_global_context(),
+                    cfg,
+                    env_info,
+                    [env_configs[i] for i in group],
+                    idx,
+                    child_pipe,
+                    step_sem,
+                    self.done_sem,
+                    self.commands,
+                    self.statuses,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.pipes.append(parent_pipe)
+            self.step_sems.append(step_sem)
+            self.processes.append(process)
+
+        for idx, pipe in enumerate(self.pipes):
+            self._check_reply(idx, pipe.recv())
+
+        agents_per_process = self._call_all("num_agents")
+        self.agent_slices: List[slice] = []
+        for num_agents in agents_per_process:
+            start = self.agent_slices[-1].stop if self.agent_slices else 0
+            self.agent_slices.append(slice(start, start + num_agents))
+        self.num_agents = sum(agents_per_process)
+
+        self.obs: Optional[Dict[str, Tensor]] = None
+        self.rew = torch.zeros(self.num_agents, dtype=torch.float32).share_memory_()
+        self.terminated = torch.zeros(self.num_agents, dtype=torch.bool).share_memory_()
+        self.truncated = torch.zeros(self.num_agents, dtype=torch.bool).share_memory_()
+        self.actions: Optional[Tensor | List[Tensor]] = None
+
+    @property
+    def unwrapped(self):
+        return self
+
+    @staticmethod
+    def _check_reply(idx: int, reply: Tuple[bool, Any]) -> Any:
+        success, result = reply
+        if not success:
+            raise RuntimeError(f"Env process {idx} failed:\n{result}")
+        return result
+
+    def _call(self, idx: int, method: str, *args) -> Any:
+        self.commands[idx] = _CALL
+        self.pipes[idx].send((method, args))
+        self.step_sems[idx].release()
+        return self._check_reply(idx, self.pipes[idx].recv())
+
+    def _call_all(self, method: str, *args) -> List[Any]:
+        return [self._call(idx, method, *args) for idx in range(len(self.processes))]
+
+    def _wait_for_step(self) -> None:
+        for _ in range(len(self.processes)):
+            while not self.done_sem.acquire(timeout=_LIVENESS_CHECK_SEC):
+                for idx, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        raise RuntimeError(f"Env process {idx} died with exit code {process.exitcode}")
+
+    def reset(self, **kwargs) -> Tuple[Dict[str, Tensor], List[Dict]]:
+        results = self._call_all("reset", kwargs)
+
+        if self.obs is None:
+            # now we know what the observations look like, allocate shared buffers for all agents of all processes
+            self.obs = dict()
+            for key, x in results[0][0].items():
+                x = torch.as_tensor(x)
+                assert x.device.type == "cpu", "Subprocess envs only support observations on CPU"
+                self.obs[key] = torch.empty((self.num_agents,) + x.shape[1:], dtype=x.dtype).share_memory_()
+
+            for idx, agents in enumerate(self.agent_slices):
+                buffers = (self.rew[agents], self.terminated[agents], self.truncated[agents])
+                self._call(idx, "set_buffers", {key: x[agents] for key, x in self.obs.items()}, *buffers)
+
+        infos = []
+        for agents, (obs, info) in zip(self.agent_slices, results):
+            for key, x in obs.items():
+                self.obs[key][agents] = torch.as_tensor(x)
+            infos.extend(info)
+
+        return self.obs, infos
+
+    def _init_actions(self, actions: Tensor | np.ndarray | List) -> None:
+        if isinstance(actions, (list, tuple)):
+            # i.e. tuple action spaces
+            self.actions = [_share(a) for a in actions]
+            as_numpy = isinstance(actions[0], np.ndarray)
+            for idx, agents in enumerate(self.agent_slices):
+                self._call(idx, "set_actions", [a[agents] for a in self.actions], as_numpy)
+        else:
+            self.actions = _share(actions)
+            as_numpy = isinstance(actions, np.ndarray)
+            for idx, agents in enumerate(self.agent_slices):
+                self._call(idx, "set_actions", self.actions[agents], as_numpy)
+
+    def _copy_actions(self, actions: Tensor | np.ndarray | List) -> None:
+        if isinstance(actions, (list, tuple)):
+            for dst, src in zip(self.actions, actions):
+                dst.copy_(torch.as_tensor(src))
+        else:
+            self.actions.copy_(torch.as_tensor(actions))
+
+    def step(self, actions: Tensor | np.ndarray | List) -> Tuple[Dict[str, Tensor], Tensor, Tensor, Tensor, List]:
+        if self.actions is None:
+            self._init_actions(actions)
+        else:
+            self._copy_actions(actions)
+
+        for idx, step_sem in enumerate(self.step_sems):
+            self.commands[idx] = _STEP
+            step_sem.release()
+
+        self._wait_for_step()
+
+        infos = []
+        for idx, agents in enumerate(self.agent_slices):
+            status = self.statuses[idx]
+            if status == _HAS_INFOS:
+                infos.extend(self.pipes[idx].recv())
+            elif status == _ERROR:
+                raise RuntimeError(f"Env process {idx} failed:\n{self.pipes[idx].recv()}")
+            else:
+                infos.extend({} for _ in range(agents.stop - agents.start))
+
+        return self.obs, self.rew, self.terminated, self.truncated, infos
+
+    def set_training_info(self, training_info: Dict) -> None:
+        self._call_all("set_training_info", training_info)
+
+    def get_default_reward_shaping(self) -> Optional[Dict[str, Any]]:
+        return self._call(0, "get_default_reward_shaping")
+
+    def set_reward_shaping(self, reward_shaping: Dict[str, Any], agent_indices: int | slice) -> None:
+        assert isinstance(agent_indices, slice)
+        for idx, agents in enumerate(self.agent_slices):
+            start, stop = max(agents.start, agent_indices.start), min(agents.stop, agent_indices.stop)
+            if start < stop:
+                # agent indices local to the process
+                self._call(idx, "set_reward_shaping", reward_shaping, slice(start - agents.start, stop - agents.start))
+
+    def close(self) -> None:
+        for idx, process in enumerate(self.processes):
+            if process.is_alive():
+                self.commands[idx] = _CLOSE
+                self.step_sems[idx].release()
+
+        deadline = time.time() + _CLOSE_TIMEOUT_SEC
+        for process in self.processes:
+            process.join(timeout=max(0.0, deadline - time.time()))
+            if process.is_alive():
+                log.warning(f"Env process {process.pid} did not finish in time, terminating...")
+                process.terminate()
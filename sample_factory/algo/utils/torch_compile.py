@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Tuple, Type
+
+import torch
+from torch import nn
+
+from sample_factory.utils.timing import Timing
+from sample_factory.utils.utils import log
+
+# parts of the ActorCritic forward pass that are compiled as separate units
+ACTOR_CRITIC_UNITS = ("forward_head", "forward_core", "forward_tail")
+
+
+def _compile_errors() -> Tuple[Tuple[Type[Exception], ...], Tuple[Type[Exception], ...]]:
+    try:
+        from torch._dynamo.exc import BackendCompilerFailed, InternalTorchDynamoError, TorchRuntimeError, Unsupported
+    except ImportError:
+        # old PyTorch versions without torch.compile(), CompiledFunc is never created there
+        return tuple(), tuple()
+
+    # dynamo cannot trace the function, or the backend (i.e. inductor) fails to compile the traced graph
+    compile_errors = (BackendCompilerFailed, InternalTorchDynamoError, Unsupported)
+    # errors in the function itself that are only detected while tracing it, i.e. shape mismatch
+    function_errors = (TorchRuntimeError,)
+    return compile_errors, function_errors
+
+
+COMPILE_ERRORS, FUNCTION_ERRORS = _compile_errors()
+
+# number of (re)compilations started by each thread and the error that the last one failed with, if any
+_compiles = threading.local()
+_compile_callbacks_lock = threading.Lock()
+_compile_callbacks_registered = False
+
+
+def _on_compile_start(*_args) -> None:
+    _compiles.num = _num_compiles() + 1
+
+
+def _on_compile_end(*_args) -> None:
+    # dynamo runs end callbacks in a finally block, so here we still see the exception the compilation failed with
+    _compiles.error = sys.exc_info()[1]
+
+
+def _register_compile_callbacks() -> None:
+    """Dynamo compiles under a global lock and runs the callbacks in the thread that triggered the compilation."""
+    global _compile_callbacks_registered
+    with _compile_callbacks_lock:
+        if not _compile_callbacks_registered:
+            callback = getattr(torch._dynamo, "callback", None)
+            if hasattr(callback, "on_compile_start"):
+                callback.on_compile_start(_on_compile_start)
+                callback.on_compile_end(_on_compile_end)
+            else:
+                log.debug("Compilation callbacks are not supported by this PyTorch version, not timing compilation")
+            _compile_callbacks_registered = True
+
+
+def _num_compiles() -> int:
+    """Number of times dynamo (re)compiled a frame in the current thread."""
+    return getattr(_compiles, "num", 0)
+
+
+@contextmanager
+def compile_timing(timing: Timing) -> Iterator[None]:
+    """
+    Report compilation triggered by the current thread to this timing instead of the one of the compiled unit,
+    i.e. in a helper thread that calls the model owned by another thread (Timing is not thread-safe).
+    """
+    prev_timing = getattr(_compiles, "timing", None)
+    _compiles.timing = timing
+    try:
+        yield
+    finally:
+        _compiles.timing = prev_timing
+
+
+def _is_compile_error(exc: Exception) -> bool:
+    if isinstance(exc, FUNCTION_ERRORS):
+        return False
+    # dynamo does not wrap all of its internal errors (i.e. failed assertions), so we also check where it came from
+    return isinstance(exc, COMPILE_ERRORS) or exc is getattr(_compiles, "error", None)
+
+
+class CompiledFunc:
+    """
+    torch.compile()-d version of a function that falls back to the original (eager) function if compilation fails,
+    e.g. if the model uses ops or Python constructs that the compiler does not support.
+    Any other error (i.e. CUDA OOM or a shape mismatch) is raised as usual.
+    Calls that (re)compile the function are reported in timing as "torch_compile", separately from regular calls.
+    """
+
+    def __init__(self, func: Callable, name: str, timing: Timing, dynamic: Optional[bool], mode: Optional[str]):
+        self.func = func
+        self.name = name
+        self.timing = timing
+        self.compiled = torch.compile(func, dynamic=dynamic, mode=mode)
+        self.failed = False
+        _register_compile_callbacks()
+
+    def __call__(self, *args, **kwargs):
+        if self.failed:
+            return self.func(*args, **kwargs)
+
+        num_compiles = _num_compiles()
+        _compiles.error = None
+        start = time.time()
+        try:
+            result = self.compiled(*args, **kwargs)
+        except Exception as exc:
+            if not _is_compile_error(exc):
+                raise
+
+            # raised while tracing/compiling, before the compiled graph runs (unless the function has graph breaks)
+            log.warning(f"torch.compile() failed for {self.name}, falling back to eager mode: {exc!r}")
+            self.failed = True
+            return self.func(*args, **kwargs)
+
+        if _num_compiles() != num_compiles:
+            timing = getattr(_compiles, "timing", None)
+            (self.timing if timing is None else timing).add_value("torch_compile", time.time() - start)
+
+        return result
+
+
+def maybe_compile(func: Callable, name: str, timing: Timing, dynamic: Optional[bool], mode: Optional[str]) -> Callable:
+    """:return: compiled version of func, or func itself if torch.compile() is not available."""
+    try:
+        return CompiledFunc(func, name, timing, dynamic, mode)
+    except Exception as exc:
+        # e.g. old PyTorch version, or torch.compile() is not supported on this platform/Python version
+        log.warning(f"Could not compile {name}, using eager mode: {exc!r}")
+        return func
+
+
+def disable_compile(func: Callable) -> Callable:
+    """Exclude func from torch.compile() graphs (i.e. code that only does Python bookkeeping)."""
+    compiler = getattr(torch, "compiler", None)
+    return compiler.disable(func) if hasattr(compiler, "disable") else func
+
+
+def compile_actor_critic(actor_critic: nn.Module, timing: Timing, dynamic: Optional[bool], mode: str) -> None:
+    """
+    Replace forward_head(), forward_core() and forward_tail() of the model with their compiled versions.
+    forward() calls these methods, so it uses compiled units as well.
+    :param dynamic: True to compile for variable batch sizes right away (i.e. for inference), None to let
+        torch.compile() decide (start with static shapes and recompile with dynamic shapes if they change).
+    """
+    for unit in ACTOR_CRITIC_UNITS:
+        func = getattr(actor_critic, unit)
+        if isinstance(func, CompiledFunc):
+            # already compiled, i.e. the model is shared between the learner and the inference worker in serial mode
+            continue
+
+        compiled = maybe_compile(func, f"{type(actor_critic).__name__}.{unit}", timing, dynamic, mode)
+        # instance attribute shadows the method
+        object.__setattr__(actor_critic, unit, compiled)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 import numpy as np
 import torch
@@ -26,6 +26,15 @@ def inference_context(is_serial):
         return torch.inference_mode()
 
 
+def autocast_context(enabled: bool, device: torch.device | str):
+    """
+    Mixed-precision context for forward passes of the model: matmuls and convolutions run in bfloat16,
+    precision-sensitive ops stay in float32 (see torch.autocast). Parameters are not affected, so optimizer
+    updates still happen on float32 weights. No-op if not enabled.
+    """
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16, enabled=enabled)
+
+
 def to_torch_dtype(numpy_dtype):
     """from_numpy automatically infers type, so we leverage that."""
     x = np.zeros([1], dtype=numpy_dtype)
@@ -55,6 +64,61 @@ def masked_select(x: torch.Tensor, mask: torch.Tensor, num_non_mask: int) -> tor
         return torch.masked_select(x, mask)
 
 
+def stack_to_scalars(values: List[torch.Tensor]) -> List[float]:
+    """Read back a list of single-element tensors with one device-to-host transfer (per device)."""
+    scalars: List[float] = [0.0] * len(values)
+    by_device: Dict[torch.device, List[int]] = dict()
+    for i, v in enumerate(values):
+        by_device.setdefault(v.device, []).append(i)
+
+    for device, indices in by_device.items():
+        stacked = torch.stack([values[i].detach().reshape(()).float() for i in indices])
+        for i, scalar in zip(indices, stacked.tolist()):
+            scalars[i] = scalar
+
+    return scalars
+
+
+class DeferredReadback:
+    """
+    Non-blocking device-to-host copy of a tensor.
+    On CUDA devices the copy is enqueued after all previously scheduled work, and we can poll whether the value
+    has arrived without stalling the device queue. On CPU the value is available immediately.
+    """
+
+    def __init__(self, x: torch.Tensor):
+        self.event = None
+        if x.is_cuda:
+            self.host = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+            self.host.copy_(x, non_blocking=True)
+            self.event = torch.cuda.Event()
+            self.event.record()
+        else:
+            self.host = x.detach().clone()
+
+    def ready(self) -> bool:
+        return self.event is None or self.event.query()
+
+    def get(self) -> torch.Tensor:
+        if self.event is not None:
+            self.event.synchronize()
+        return self.host
+
+
+def snapshot_state(x: Any) -> Any:
+    """
+    Recursively copy all tensors in a (nested) state dict to CPU memory, so that training can continue
+    modifying the parameters while the snapshot is being serialized.
+    """
+    if isinstance(x, torch.Tensor):
+        return x.detach().to("cpu", copy=True)
+    elif isinstance(x, dict):
+        return type(x)((k, snapshot_state(v)) for k, v in x.items())
+    elif isinstance(x, (list, tuple)):
+        return type(x)(snapshot_state(v) for v in x)
+    return x
+
+
 def synchronize(cfg: Config, device: torch.device | str) -> None:
     if cfg.serial_mode:
         return
@@ -0,0 +1,140 @@
+"""
+Synthetic environments for throughput benchmarks. They are cheap to simulate and fully deterministic
+(observations and rewards only depend on the env id and the step number) so that benchmark results are
+comparable between runs and only reflect the performance of the framework itself.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional
+
+import gymnasium as gym
+import numpy as np
+
+from sample_factory.envs.env_utils import register_env
+from sample_factory.utils.typing import Config
+
+# number of precomputed observations, envs cycle through them
+_OBS_TABLE_SIZE = 64
+
+
+class BenchmarkEnv(gym.Env):
+    """Single-agent env that cycles through a table of observations generated from a fixed seed."""
+
+    def __init__(
+        self,
+        obs_shape,
+        obs_dtype,
+        episode_len: int,
+        env_id: int = 0,
+        reset_delay_sec: float = 0.0,
+        render_mode: Optional[str] = None,
+    ):
+        high = 255 if obs_dtype == np.uint8 else 1.0
+        self.observation_space = gym.spaces.Box(0, high, obs_shape, dtype=obs_dtype)
+        self.action_space = gym.spaces.Discrete(4)
+
+        rng = np.random.default_rng(env_id)
+        if obs_dtype == np.uint8:
+            self.obs_table = rng.integers(0, 256, (_OBS_TABLE_SIZE,) + tuple(obs_shape), dtype=np.uint8)
+        else:
+            self.obs_table = rng.random((_OBS_TABLE_SIZE,) + tuple(obs_shape), dtype=np.float32)
+        self.target_actions = rng.integers(0, self.action_space.n, _OBS_TABLE_SIZE)
+
+        self.episode_len = episode_len
+        self.reset_delay_sec = reset_delay_sec
+        self.curr_step = 0
+        self.render_mode = render_mode
+
+    def _obs(self):
+        return self.obs_table[self.curr_step % _OBS_TABLE_SIZE]
+
+    def reset(self, **kwargs):
+        if self.reset_delay_sec > 0:
+            # i.e. simulators that load a level on every reset
+            time.sleep(self.reset_delay_sec)
+        self.curr_step = 0
+        return self._obs(), {}
+
+    def step(self, action):
+        reward = float(action == self.target_actions[self.curr_step % _OBS_TABLE_SIZE])
+        self.curr_step += 1
+        terminated = False
+        truncated = self.curr_step >= self.episode_len
+        return self._obs(), reward, terminated, truncated, dict()
+
+    def render(self):
+        pass
+
+
+class MultiAgentBenchmarkEnv(gym.Env):
+    """A group of BenchmarkEnvs stepped in lockstep as a single multi-agent env (with auto-reset)."""
+
+    def __init__(
+        self, num_agents: int, obs_shape, episode_len: int, env_id: int = 0, render_mode: Optional[str] = None
+    ):
+        self.envs = [
+            BenchmarkEnv(obs_shape, np.float32, episode_len, env_id * num_agents + i) for i in range(num_agents)
+        ]
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.num_agents = num_agents
+        self.is_multiagent = True
+        self.render_mode = render_mode
+
+    def reset(self, **kwargs):
+        obs, infos = zip(*[env.reset() for env in self.envs])
+        return list(obs), list(infos)
+
+    def step(self, actions):
+        obs: List = []
+        rewards, terminated, truncated, infos = [], [], [], []
+        for env, action in zip(self.envs, actions):
+            o, r, term, trunc, info = env.step(action)
+            if term or trunc:
+                # multi-agent environments should auto-reset!
+                o, info = env.reset()
+            obs.append(o)
+            rewards.append(r)
+            terminated.append(term)
+            truncated.append(trunc)
+            infos.append(info)
+
+        return obs, rewards, terminated, truncated, infos
+
+    def render(self):
+        pass
+
+
+def _env_id(env_config) -> int:
+    return 0 if env_config is None else env_config.env_id
+
+
+def make_vector_env(_full_env_name, _cfg: Config = None, env_config=None, render_mode: Optional[str] = None):
+    return BenchmarkEnv((64,), np.float32, 256, _env_id(env_config), render_mode=render_mode)
+
+
+def make_pixel_env(_full_env_name, _cfg: Config = None, env_config=None, render_mode: Optional[str] = None):
+    return BenchmarkEnv((3, 64, 64), np.uint8, 256, _env_id(env_config), render_mode=render_mode)
+
+
+def make_multi_agent_env(_full_env_name, _cfg: Config = None, env_config=None, render_mode: Optional[str] = None):
+    return MultiAgentBenchmarkEnv(4, (64,), 128, _env_id(env_config), render_mode=render_mode)
+
+
+def make_slow_reset_env(_full_env_name, _cfg: Config = None, env_config=None, render_mode: Optional[str] = None):
+    return BenchmarkEnv((64,), np.float32, 32, _env_id(env_config), reset_delay_sec=0.01, render_mode=render_mode)
+
+
+BENCHMARK_ENVS: Dict[str, callable] = dict(
+    benchmark_vector=make_vector_env,
+    benchmark_pixels=make_pixel_env,
+    benchmark_multi_agent=make_multi_agent_env,
+    benchmark_slow_reset=make_slow_reset_env,
+)
+
+
+def register_benchmark_envs() -> None:
+    for env_name, make_env_func in BENCHMARK_ENVS.items():
+        register_env(env_name, make_env_func)
@@ -0,0 +1,99 @@
+"""
+Compare benchmark results (see run_benchmark.py) against a stored baseline:
+
+python -m sample_factory.benchmarking.compare_benchmarks baseline.json benchmark.json --tolerance=0.1
+
+Exits with a non-zero code if any metric regressed by more than the tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from typing import Dict, List
+
+from sample_factory.utils.utils import log
+
+
+@dataclass
+class MetricDiff:
+    scenario: str
+    metric: str
+    baseline: float
+    current: float
+    # relative change, positive is an improvement
+    improvement: float
+
+    def regressed(self, tolerance: float) -> bool:
+        return self.improvement < -tolerance
+
+
+def lower_is_better(metric: str) -> bool:
+    # latencies, everything else is throughput
+    return metric.endswith("_ms")
+
+
+def compare(baseline: Dict, current: Dict) -> List[MetricDiff]:
+    diffs = []
+    for scenario, current_results in current["scenarios"].items():
+        if scenario not in baseline["scenarios"]:
+            log.warning(f"Scenario {scenario} is not in the baseline, skipping")
+            continue
+
+        baseline_metrics = baseline["scenarios"][scenario]["metrics"]
+        for metric, value in current_results["metrics"].items():
+            if metric not in baseline_metrics or baseline_metrics[metric] <= 0:
+                continue
+
+            base_value = baseline_metrics[metric]
+            change = (value - base_value) / base_value
+            if lower_is_better(metric):
+                change = -change
+            diffs.append(MetricDiff(scenario, metric, base_value, value, change))
+
+    return diffs
+
+
+def diff_table(diffs: List[MetricDiff], tolerance: float) -> str:
+    lines = [f"{'scenario':<32} {'metric':<28} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for d in diffs:
+        mark = "  REGRESSION" if d.regressed(tolerance) else ""
+        lines.append(
+            f"{d.scenario:<32} {d.metric:<28} {d.baseline:>12.2f} {d.current:>12.2f} {d.improvement * 100:>+7.1f}%{mark}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag performance regressions against a stored benchmark baseline")
+    parser.add_argument("baseline", type=str, help="Baseline results (JSON)")
+    parser.add_argument("current", type=str, help="Results to check (JSON)")
+    parser.add_argument(
+        "--tolerance",
+        default=0.1,
+        type=float,
+        help="Relative change that is still considered noise, i.e. 0.1 allows 10%% lower throughput",
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    diffs = compare(baseline, current)
+    log.info(f"Benchmark comparison:\n{diff_table(diffs, args.tolerance)}")
+
+    regressions = [d for d in diffs if d.regressed(args.tolerance)]
+    if regressions:
+        log.error(f"{len(regressions)} metric(s) regressed by more than {args.tolerance * 100:.0f}%")
+        return 1
+
+    log.info("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
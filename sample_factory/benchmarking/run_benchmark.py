@@ -0,0 +1,230 @@
+"""
+CPU-only throughput benchmark on synthetic environments. From the root of Sample Factory repo:
+
+python -m sample_factory.benchmarking.run_benchmark --out=benchmark.json
+python -m sample_factory.benchmarking.compare_benchmarks baseline.json benchmark.json
+
+Every scenario (environment x serial/parallel mode) trains for a fixed number of env steps with the same sampling
+configuration. Besides the overall FPS we report the throughput of individual components derived from their
+Timing profiles. Inference latency is measured from the trace events (see --trace_events) in a separate run of the
+scenario, so that tracing overhead does not affect the throughput numbers. FPS of the traced run is reported as
+traced_fps, which shows the overhead of tracing.
+
+Scenarios always use the default model components, regardless of what is registered in the global context.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+from sample_factory.algo.utils.context import SampleFactoryContext, set_global_context, sf_global_context
+from sample_factory.algo.utils.misc import ExperimentStatus
+from sample_factory.benchmarking.benchmark_envs import BENCHMARK_ENVS, register_benchmark_envs
+from sample_factory.cfg.arguments import parse_full_cfg, parse_sf_args
+from sample_factory.train import make_runner
+from sample_factory.utils.timing import AvgTime, Timing
+from sample_factory.utils.tracing import trace_file
+from sample_factory.utils.typing import Config
+from sample_factory.utils.utils import log, str2bool
+
+MODES = ("serial", "parallel")
+DEFAULT_SCENARIOS = [f"{env}_{mode}" for env in BENCHMARK_ENVS for mode in MODES]
+
+
+def scenario_cfg(
+    scenario: str, env_steps: int, train_dir: str, extra_args: Optional[List[str]] = None, trace: bool = False
+) -> Config:
+    env, mode = scenario.rsplit("_", 1)
+    assert env in BENCHMARK_ENVS and mode in MODES, f"Unknown benchmark scenario {scenario}"
+
+    argv = [
+        f"--env={env}",
+        f"--experiment={scenario}",
+        f"--train_dir={train_dir}",
+        f"--train_for_env_steps={env_steps}",
+        f"--serial_mode={mode == 'serial'}",
+        "--device=cpu",
+        "--benchmark=True",
+        f"--trace_events={trace}",
+        "--restart_behavior=overwrite",
+        "--num_workers=2",
+        "--num_envs_per_worker=4",
+        "--rollout=32",
+        "--batch_size=512",
+        "--seed=0",
+        "--save_every_sec=100000",
+        "--save_best_every_sec=100000",
+    ]
+    argv += extra_args or []
+
+    parser, _ = parse_sf_args(argv=argv)
+    return parse_full_cfg(parser, argv=argv)
+
+
+def flat_timing(timing: Timing) -> Dict[str, float]:
+    flat = dict()
+    for key, value in timing.items():
+        if key.startswith("_"):
+            # data members of Timing
+            continue
+        if isinstance(value, AvgTime):
+            value = sum(value.values) / max(1, len(value.values))
+        flat[key] = float(value)
+    return flat
+
+
+def _event_durations_ms(cfg: Config, event_name: str) -> List[float]:
+    if not os.path.isfile(trace_file(cfg)):
+        return []
+    with open(trace_file(cfg)) as f:
+        events = json.load(f)["traceEvents"]
+    return [e["dur"] / 1000 for e in events if e["ph"] == "X" and e["name"] == event_name]
+
+
+def _throughput(num_samples: float, busy_sec: List[float]) -> Optional[float]:
+    busy_sec = [t for t in busy_sec if t > 0]
+    if not busy_sec:
+        return None
+    return num_samples / sum(busy_sec)
+
+
+def scenario_metrics(cfg: Config, env_steps: int, main_loop_sec: float, components: Dict[str, Dict[str, float]]):
+    """Throughput is in samples per second of time a component spent on the work, excluding waiting."""
+    rollout_timings = [t for name, t in components.items() if name.startswith("RolloutWorker")]
+    inference_timings = [t for name, t in components.items() if name.startswith("InferenceWorker")]
+    learner_timings = [t for name, t in components.items() if name.startswith("LearnerWorker")]
+
+    # only the first and the last rollout workers report their profiles, we assume the load is balanced
+    env_step_sec = [t.get("env_step", 0.0) for t in rollout_timings]
+    env_steps_per_worker = env_steps / cfg.num_workers
+    rollout_fps = None
+    if env_step_sec:
+        rollout_fps = _throughput(env_steps_per_worker * len(env_step_sec), env_step_sec)
+
+    metrics = dict(
+        fps=env_steps / max(main_loop_sec, 1e-9),
+        rollout_env_steps_per_sec=rollout_fps,
+        inference_samples_per_sec=_throughput(env_steps, [t.get("handle_policy_step", 0.0) for t in inference_timings]),
+        learner_samples_per_sec=_throughput(env_steps * cfg.num_epochs, [t.get("train", 0.0) for t in learner_timings]),
+    )
+    return {key: value for key, value in metrics.items() if value is not None}
+
+
+def latency_metrics(cfg: Config) -> Dict[str, float]:
+    latencies = _event_durations_ms(cfg, "handle_policy_step")
+    if not latencies:
+        return dict()
+    return dict(
+        inference_latency_mean_ms=float(np.mean(latencies)),
+        inference_latency_p95_ms=float(np.percentile(latencies, 95)),
+    )
+
+
+def _train(scenario: str, env_steps: int, train_dir: str, extra_args: Optional[List[str]], trace: bool):
+    cfg = scenario_cfg(scenario, env_steps, train_dir, extra_args, trace)
+    cfg, runner = make_runner(cfg)
+    status = runner.init()
+    if status == ExperimentStatus.SUCCESS:
+        status = runner.run()
+    if status != ExperimentStatus.SUCCESS:
+        raise RuntimeError(f"Benchmark scenario {scenario} failed with status {status}")
+    return cfg, runner
+
+
+def run_scenario(
+    scenario: str,
+    env_steps: int,
+    train_dir: str,
+    extra_args: Optional[List[str]] = None,
+    measure_latency: bool = True,
+) -> Dict:
+    log.info(f"Running benchmark scenario {scenario} for {env_steps} env steps...")
+    cfg, runner = _train(scenario, env_steps, train_dir, extra_args, trace=False)
+
+    # after the runner stops, profiles of all components are a list of (name, Timing) pairs
+    components = {name: flat_timing(timing) for name, timing in runner.component_profiles}
+    components["runner"] = flat_timing(runner.timing)
+
+    collected_steps = runner.total_env_steps_since_resume
+    metrics = scenario_metrics(cfg, collected_steps, runner.timing.main_loop, components)
+
+    if measure_latency:
+        # tracing adds overhead to every Timing measurement, so latency is measured in a separate run
+        log.info(f"Measuring inference latency of scenario {scenario}...")
+        cfg, runner = _train(scenario, env_steps, train_dir, extra_args, trace=True)
+        metrics.update(latency_metrics(cfg))
+        metrics["traced_fps"] = runner.total_env_steps_since_resume / max(runner.timing.main_loop, 1e-9)
+
+    log.info(f"Scenario {scenario}: {json.dumps(metrics)}")
+    return dict(env_steps=collected_steps, metrics=metrics, components=components)
+
+
+def system_info() -> Dict[str, str]:
+    return dict(
+        platform=platform.platform(),
+        processor=platform.processor(),
+        cpu_count=str(os.cpu_count()),
+        python=platform.python_version(),
+        torch=torch.__version__,
+    )
+
+
+def run_benchmarks(
+    scenarios: List[str], env_steps: int, extra_args: Optional[List[str]] = None, measure_latency: bool = True
+) -> Dict:
+    # benchmark the default model components, whatever the caller might have registered in the global context
+    caller_context = sf_global_context()
+    set_global_context(SampleFactoryContext())
+    register_benchmark_envs()
+
+    results = dict(env_steps=env_steps, system=system_info(), scenarios=dict())
+    try:
+        with tempfile.TemporaryDirectory(prefix="sf_benchmark_") as train_dir:
+            for scenario in scenarios:
+                results["scenarios"][scenario] = run_scenario(
+                    scenario, env_steps, train_dir, extra_args, measure_latency
+                )
+    finally:
+        set_global_context(caller_context)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample Factory CPU throughput benchmark")
+    parser.add_argument("--out", default="benchmark.json", type=str, help="Where to save the results (JSON)")
+    parser.add_argument("--env_steps", default=100_000, type=int, help="Number of env steps for every scenario")
+    parser.add_argument(
+        "--scenarios",
+        default=DEFAULT_SCENARIOS,
+        nargs="+",
+        choices=DEFAULT_SCENARIOS,
+        help="Benchmark scenarios to run (default: all)",
+    )
+    parser.add_argument(
+        "--measure_latency",
+        default=True,
+        type=str2bool,
+        help="Run every scenario a second time with --trace_events to measure inference latency",
+    )
+    args, extra_args = parser.parse_known_args()
+    # any other arguments are passed to Sample Factory as is, i.e. --num_workers=8
+
+    results = run_benchmarks(args.scenarios, args.env_steps, extra_args, args.measure_latency)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    log.info(f"Saved benchmark results to {os.path.abspath(args.out)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
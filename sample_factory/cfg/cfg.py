@@ -79,6 +79,15 @@ def add_rl_args(p: ArgumentParser):
         "If you need some complex info dictionary handling and your environment might return dicts with different keys, "
         "on different rollout steps, you probably need non-batched mode.",
     )
+    p.add_argument(
+        "--vectorized_actor_states",
+        default=False,
+        type=str2bool,
+        help="Non-batched sampling only. Keep the state of all agents on a rollout worker in contiguous arrays and "
+        "write policy outputs, rewards, and observations into trajectory buffers with a single indexed assignment "
+        "instead of looping over per-agent objects. Reduces the per-agent Python overhead on rollout workers with "
+        "many envs/agents. Requires CPU sampling (observations on CPU).",
+    )
     p.add_argument(
         "--num_batches_to_accumulate",
         default=2,
@@ -90,6 +99,26 @@ def add_rl_args(p: ArgumentParser):
         "are processed. Set this parameter to 1 to further reduce policy-lag. "
         "If the experience collection is very non-uniform, increasing this parameter can increase overall throughput, at the cost of increased policy-lag.",
     )
+    p.add_argument(
+        "--zero_copy_batches",
+        default=False,
+        type=str2bool,
+        help="Train directly on the shared trajectory buffers instead of copying trajectories into separate training batches, "
+        "whenever the trajectories of a batch are contiguous in the trajectory buffers (otherwise they are still copied). "
+        "Training batches are only allocated if this happens, which saves memory and memory bandwidth for large (i.e. pixel) observations. "
+        "Tradeoff: trajectory buffers are held until the learner is done with them even in async mode (no extra buffers are allocated "
+        "to account for this), so fewer buffers are available for sampling while the learner trains. Only applies when trajectories are "
+        "collected on the learner device (i.e. CPU-only training or GPU-side observations), otherwise it is ignored.",
+    )
+    p.add_argument(
+        "--buffer_memory_budget_gb",
+        default=None,
+        type=float,
+        help="Maximum memory (in GB) that trajectory buffers, policy output buffers and training batches are allowed to "
+        "occupy on any single device (RAM or GPU memory). Buffer sizes are computed before allocation and the experiment "
+        "does not start if the budget is exceeded, suggesting the largest num_envs_per_worker and rollout that fit. "
+        "The breakdown is logged at startup regardless. Default (None) means no limit.",
+    )
     p.add_argument(
         "--worker_num_splits",
         default=2,
@@ -103,6 +132,17 @@ def add_rl_args(p: ArgumentParser):
         type=int,
         help="Number of policy workers that compute forward pass (per policy)",
     )
+    p.add_argument(
+        "--inference_p99_latency_ms",
+        default=0.0,
+        type=float,
+        help="Target p99 latency of inference requests (from the moment a rollout worker enqueues a request "
+        "until the actions are sent back). If positive, policy workers continuously tune how many requests to wait for "
+        "and for how long, based on the measured forward pass cost and the request arrival rate, "
+        "and report the chosen operating point in the summaries. "
+        "0 (default) means a fixed heuristic: wait up to 25ms for at least 1/3 of the rollout workers. "
+        "Ignored in serial mode.",
+    )
     p.add_argument(
         "--max_policy_lag",
         default=1000,
@@ -125,6 +165,23 @@ def add_rl_args(p: ArgumentParser):
         help="Number of envs on a single CPU actor, in high-throughput configurations this should be in 10-30 range for Atari/VizDoom"
         "Must be even for double-buffered sampling!",
     )
+    p.add_argument(
+        "--env_step_threads",
+        default=0,
+        type=int,
+        help="Batched sampling only. If > 0, envs on a rollout worker are stepped concurrently in a pool of this many threads "
+        "instead of one after another. Only useful for envs that release the GIL in step() (native simulators, "
+        "image processing, etc.), otherwise threads just add overhead. 0 means sequential stepping.",
+    )
+    p.add_argument(
+        "--env_subprocesses",
+        default=0,
+        type=int,
+        help="Batched sampling only. If > 0, envs on a rollout worker are split between this many child processes "
+        "that step them in parallel and write observations directly into shared memory. Useful for slow pure-Python "
+        "envs that hold the GIL, when increasing num_workers is not an option. Takes precedence over --env_step_threads. "
+        "Observations and actions must be on CPU.",
+    )
     p.add_argument("--batch_size", default=1024, type=int, help="Minibatch size for SGD")
     p.add_argument(
         "--num_batches_per_epoch",
@@ -169,6 +226,72 @@ def add_rl_args(p: ArgumentParser):
         type=str2bool,
         help="Whether to randomize and shuffle minibatches between iterations (this is a slow operation when batches are large, disabling this increases learner throughput when training with multiple epochs/minibatches per epoch)",
     )
+    p.add_argument(
+        "--fused_minibatches",
+        default=False,
+        type=str2bool,
+        help="Only with --shuffle_minibatches. Generate minibatch permutations on the learner device and gather "
+        "all fields of the minibatch using a single index tensor. Fields with the same dtype are fused into one "
+        "contiguous buffer once per training batch, so every minibatch takes one gather kernel per dtype "
+        "instead of one per field",
+    )
+    p.add_argument(
+        "--bf16_autocast",
+        default=False,
+        type=str2bool,
+        help="Run model forward passes on the learner (loss calculation) and in inference workers under bfloat16 "
+        "autocast. Substantially faster on CPUs with AVX512-BF16/AMX and on recent GPUs. Weights, optimizer state, "
+        "observation/returns normalization statistics, action distributions and losses stay in float32",
+    )
+    p.add_argument(
+        "--torch_compile",
+        default=False,
+        type=str2bool,
+        help="Compile forward_head(), forward_core() and forward_tail() of the model and the learner's loss "
+        "calculation with torch.compile(). Inference workers compile for dynamic batch sizes. Falls back to eager "
+        "mode if compilation fails. Compilation time is reported as torch_compile in the learner/inference profiles",
+    )
+    p.add_argument(
+        "--torch_compile_mode",
+        default="default",
+        choices=["default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs"],
+        type=str,
+        help="torch.compile() mode, see PyTorch documentation",
+    )
+    p.add_argument(
+        "--quantized_inference",
+        default=False,
+        type=str2bool,
+        help="Inference workers on CPU act with an int8 dynamically quantized copy of the policy (linear and "
+        "GRU/LSTM layers), refreshed when new weights are received (see --quantized_refresh_interval_sec). "
+        "The learner still trains the float32 model. "
+        "KL divergence between the action distributions of the full-precision and quantized policies is reported "
+        "as quantized_kl_p<policy_id>. Ignored for inference on GPU",
+    )
+    p.add_argument(
+        "--quantize_conv_layers",
+        default=False,
+        type=str2bool,
+        help="Only with --quantized_inference. Also round weights of conv layers to int8 (per output channel). "
+        "PyTorch has no dynamically quantized conv layers, so this only simulates the precision loss and does not "
+        "make conv layers faster",
+    )
+    p.add_argument(
+        "--quantized_refresh_interval_sec",
+        default=1.0,
+        type=float,
+        help="Only with --quantized_inference. Minimum time between re-quantizations of the policy. New weights can be "
+        "published after every minibatch, and re-quantizing that often can cost more than int8 inference saves. "
+        "Experience collected with the quantized policy is tagged with the policy version it was quantized from. "
+        "Average re-quantization time is reported as quantize_time_ms_p<policy_id>",
+    )
+    p.add_argument(
+        "--quantized_kl_interval",
+        default=50,
+        type=int,
+        help="Only with --quantized_inference. Every N inference steps also run the full-precision policy on the same "
+        "batch to measure the KL divergence between the action distributions",
+    )
 
     # basic RL parameters
     p.add_argument("--gamma", default=0.99, type=float, help="Discount factor")
@@ -245,6 +368,16 @@ def add_rl_args(p: ArgumentParser):
         type=float,
         help="Generalized Advantage Estimation discounting (only used when V-trace is False)",
     )
+    p.add_argument(
+        "--gae_block_size",
+        default=0,
+        type=int,
+        help="If > 0, GAE advantages are calculated with a blocked scan: blocks of this many timesteps are processed "
+        "with a single matrix multiplication by a discount matrix, instead of one timestep at a time. "
+        "This reduces the number of sequential steps (and GPU kernel launches) for long rollouts at the cost of "
+        "O(rollout * block_size) memory and compute per trajectory, so it is mostly useful for GPU learners. "
+        "0 means regular step-by-step calculation",
+    )
     p.add_argument(
         "--ppo_clip_ratio",
         default=0.1,
@@ -397,6 +530,40 @@ def add_rl_args(p: ArgumentParser):
         type=int,
         help="Niceness of the highest priority process (the learner). Values below zero require elevated privileges.",
     )
+    p.add_argument(
+        "--deferred_train_stats",
+        default=False,
+        type=str2bool,
+        help="Keep per-minibatch training statistics (losses, KL-divergence, summaries) in device tensors and read "
+        "them back once per training iteration instead of synchronizing with the device after every minibatch. "
+        "Early stopping is evaluated lazily (potentially one epoch later), warnings about high losses and KL are "
+        "reported at the end of the iteration, and new policy versions are published to inference workers once "
+        "per training iteration. Mostly useful for GPU learners.",
+    )
+    p.add_argument(
+        "--learner_prefetch_batches",
+        default=0,
+        type=int,
+        help="Number of training batches the learner prepares ahead of time (observation normalization, "
+        "next-step values, advantages) in a background thread while it is still training on the previous batch. "
+        "On GPU the preparation is issued on a separate CUDA stream. Experience that exceeds max_policy_lag by the "
+        "time the batch is trained on is still masked out. Effectively limited by num_batches_to_accumulate. "
+        "0 disables prefetching. Ignored in serial mode.",
+    )
+    p.add_argument(
+        "--weight_slots",
+        default=0,
+        type=int,
+        help="Number of shared copies of the policy weights used to publish updates to inference workers (2 or 3). "
+        "The learner writes new weights into an inactive copy and atomically marks it as the latest one, "
+        "inference workers copy the latest weights without taking the policy lock, so they never wait for "
+        "the optimizer step. The learner only takes the policy lock to publish weights with --learner_prefetch_batches, "
+        "since normalizer statistics are then updated concurrently by the prefetching thread. "
+        "New weights are only copied if inference workers took the previously published version, so with frequent "
+        "updates the learner does not copy the whole model after every minibatch. "
+        "0 means inference workers load the live learner weights under the policy lock. "
+        "Ignored in serial mode.",
+    )
 
     # logging and summaries
     p.add_argument(
@@ -418,6 +585,22 @@ def add_rl_args(p: ArgumentParser):
         type=int,
         help="How often do we flush tensorboard summaries (set to higher value for slow NFS-based server filesystems)",
     )
+    p.add_argument(
+        "--async_summaries_queue_size",
+        default=0,
+        type=int,
+        help="If > 0, tensorboard summaries are written by a separate process so that a slow filesystem does not "
+        "delay the runner's event loop. At most this many scalars can wait to be written, after that new summaries "
+        "are dropped (and counted). 0 means summaries are written by the runner itself. "
+        "Not compatible with --with_wandb (wandb syncs summaries written in the runner process).",
+    )
+    p.add_argument(
+        "--metrics_port",
+        default=None,
+        type=int,
+        help="If set, the runner serves experiment metrics (FPS, policy lag, timings, queue sizes, memory...) "
+        "in Prometheus text format at http://127.0.0.1:<metrics_port>/metrics. 0 picks any free port",
+    )
     p.add_argument(
         "--stats_avg",
         default=100,
@@ -430,6 +613,22 @@ def add_rl_args(p: ArgumentParser):
         type=str2bool,
         help="Whether to multiply training steps by frameskip when recording summaries, FPS, etc. When this flag is set to True, x-axis for all summaries corresponds to the total number of simulated steps, i.e. with frameskip=4 the x-axis value of 4 million will correspond to 1 million frames observed by the policy.",
     )
+    p.add_argument(
+        "--trace_events",
+        default=False,
+        type=str2bool,
+        help="Record begin/end timestamps of all profiled sections (the same ones reported in the profile tree views) "
+        "in every process and merge them into a Chrome trace-event timeline (trace.json in the experiment folder) "
+        "when the experiment finishes. Open in chrome://tracing or ui.perfetto.dev to see how components overlap "
+        "and where the pipeline stalls.",
+    )
+    p.add_argument(
+        "--trace_buffer_size",
+        default=1_000_000,
+        type=int,
+        help="Maximum number of trace events kept by each process (see --trace_events). "
+        "When the buffer is full, the oldest events are discarded.",
+    )
 
     p.add_argument(
         "--heartbeat_interval",
@@ -456,6 +655,15 @@ def add_rl_args(p: ArgumentParser):
     # model saving
     p.add_argument("--save_every_sec", default=120, type=int, help="Checkpointing rate")
     p.add_argument("--keep_checkpoints", default=2, type=int, help="Number of model checkpoints to keep")
+    p.add_argument(
+        "--async_checkpoint_queue_size",
+        default=0,
+        type=int,
+        help="If > 0, checkpoints are serialized and written to disk in a background thread of the learner, "
+        "the learner only takes a snapshot of the weights and optimizer state. At most this many snapshots can "
+        "wait to be written, after that saving a checkpoint blocks training until the disk catches up. "
+        "0 means checkpoints are written synchronously.",
+    )
     p.add_argument(
         "--load_checkpoint_kind",
         default="latest",
@@ -798,6 +1006,14 @@ def add_pbt_args(p: ArgumentParser):
         type=str2bool,
         help="Whether to optimize gamma, discount factor, or not (experimental)",
     )
+    p.add_argument(
+        "--pbt_in_memory_transfer",
+        default=True,
+        type=str2bool,
+        help="When a policy is replaced, copy the weights and optimizer state of the better policy directly to the "
+        "learner of the replaced policy through shared memory. If False, the better policy saves a checkpoint which "
+        "is then loaded from disk",
+    )
     p.add_argument(
         "--pbt_target_objective",
         default="true_objective",
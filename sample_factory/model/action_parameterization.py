@@ -32,7 +32,8 @@ class ActionParameterizationDefault(ActionsParameterization):
 
     def forward(self, actor_core_output, action_mask=None):
         """Just forward the FC layer and generate the distribution object."""
-        action_distribution_params = self.distribution_linear(actor_core_output)
+        # action distributions (and log-probs) are always calculated in float32, even if the model runs under autocast
+        action_distribution_params = self.distribution_linear(actor_core_output).float()
         action_distribution = get_action_distribution(
             self.action_space, raw_logits=action_distribution_params, action_mask=action_mask
         )
@@ -61,7 +62,7 @@ class ActionParameterizationContinuousNonAdaptiveStddev(ActionsParameterization)
         self.learned_stddev = nn.Parameter(initial_stddev, requires_grad=True)
 
     def forward(self, actor_core_output: Tensor, action_mask=None):
-        action_means = self.distribution_linear(actor_core_output)
+        action_means = self.distribution_linear(actor_core_output).float()
         if self.tanh_scale > 0:
             # scale the action means to be in the range [-tanh_scale, tanh_scale]
             # TODO: implement this for adaptive stddev case also?
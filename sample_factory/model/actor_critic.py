@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Dict, Optional
+from typing import ContextManager, Dict, Optional
 
 import gymnasium as gym
 import torch
@@ -95,8 +95,13 @@ class ActorCritic(nn.Module, Configurable):
             # do nothing
             pass
 
-    def normalize_obs(self, obs: Dict[str, Tensor]) -> Dict[str, Tensor]:
-        return self.obs_normalizer(obs)
+    def normalize_obs(
+        self,
+        obs: Dict[str, Tensor],
+        out: Optional[Dict[str, Tensor]] = None,
+        stats_lock: Optional[ContextManager] = None,
+    ) -> Dict[str, Tensor]:
+        return self.obs_normalizer(obs, out, stats_lock)
 
     def summaries(self) -> Dict:
         # Can add more summaries here, like weights statistics
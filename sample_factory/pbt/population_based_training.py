@@ -9,11 +9,11 @@ import time
 from os.path import join
 from typing import Dict, Optional, SupportsFloat
 
-import numpy as np
 from signal_slot.signal_slot import EventLoopObject
 from tensorboardX import SummaryWriter
 
 from sample_factory.algo.runners.runner import AlgoObserver, Runner
+from sample_factory.algo.sampling.stats import window_mean
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.misc import EPS
 from sample_factory.utils.dicts import iter_dicts_recursively, iterate_recursively
@@ -104,6 +104,10 @@ def load_model_signal(policy_id: PolicyID) -> str:
     return f"load_model{policy_id}"
 
 
+def export_model_signal(policy_id: PolicyID) -> str:
+    return f"export_model{policy_id}"
+
+
 class PopulationBasedTraining(AlgoObserver, EventLoopObject):
     def __init__(self, cfg: Config, runner: Runner):
         EventLoopObject.__init__(self, runner.event_loop, "PBT")
@@ -186,7 +190,9 @@ class PopulationBasedTraining(AlgoObserver, EventLoopObject):
             self.connect(update_cfg_signal(policy_id), learner_worker.on_update_cfg)
             self.connect(save_model_signal(policy_id), learner_worker.save)
             self.connect(load_model_signal(policy_id), learner_worker.load)
+            self.connect(export_model_signal(policy_id), learner_worker.export_model)
             learner_worker.saved_model.connect(self.on_saved_model)
+            learner_worker.exported_model.connect(self.on_exported_model)
 
     def on_start(self, runner: Runner) -> None:
         # send initial configuration to the system components
@@ -304,7 +310,7 @@ class PopulationBasedTraining(AlgoObserver, EventLoopObject):
             if len(objectives) <= 0:
                 return
 
-        target_objectives = [np.mean(o) for o in target_objectives]
+        target_objectives = [window_mean(o) for o in target_objectives]
 
         policies = list(range(self.cfg.num_policies))
         policies_sorted = sorted(zip(target_objectives, policies), reverse=True)
@@ -359,16 +365,27 @@ class PopulationBasedTraining(AlgoObserver, EventLoopObject):
             self.policy_cfg[policy_id] = self._perturb_cfg(self.policy_cfg[replacement_policy])
             self.policy_reward_shaping[policy_id] = self._perturb_reward(self.policy_reward_shaping[replacement_policy])
 
-        # force replacement policy learner to save its model so we get the latest version
+        # force replacement policy learner to export (or save) its model so we get the latest version
         # for simplicity we do this even if the policy is replaced by itself (so no replacement happens)
         self.replacement_policy[policy_id] = replacement_policy
-        self.emit(save_model_signal(replacement_policy))
+        if self.cfg.pbt_in_memory_transfer:
+            self.emit(export_model_signal(replacement_policy))
+        else:
+            self.emit(save_model_signal(replacement_policy))
 
     def on_saved_model(self, replacement_policy: PolicyID) -> None:
         """
         Called when learner saves its model. At this point we're free to use this model to
         replace other policies.
         """
+        if not self.cfg.pbt_in_memory_transfer:
+            self._replace_policies(replacement_policy)
+
+    def on_exported_model(self, replacement_policy: PolicyID, state: Dict) -> None:
+        """Called when learner shared its state in memory, we pass it directly to the learners being replaced."""
+        self._replace_policies(replacement_policy, state)
+
+    def _replace_policies(self, replacement_policy: PolicyID, state: Optional[Dict] = None) -> None:
         for policy_id in range(self.cfg.num_policies):
             if self.replacement_policy[policy_id] != replacement_policy:
                 continue
@@ -376,7 +393,7 @@ class PopulationBasedTraining(AlgoObserver, EventLoopObject):
             if replacement_policy != policy_id:
                 # only load the model if it's not already loaded
                 log.debug(f"Asking learner {policy_id} to load model from {replacement_policy}")
-                self.emit(load_model_signal(policy_id), replacement_policy)
+                self.emit(load_model_signal(policy_id), replacement_policy, state)
 
             self.replacement_policy[policy_id] = None
 
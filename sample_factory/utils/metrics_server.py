@@ -0,0 +1,111 @@
+"""
+Minimal HTTP endpoint that exposes experiment metrics in Prometheus text format (see --metrics_port).
+
+The owner of the server renders the metrics on its own thread and hands over the text with update(),
+the server thread only ever returns the latest rendered text, so scrapes never touch the experiment state.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@dataclass
+class Metric:
+    name: str
+    help: str
+    type: str = "gauge"
+    # (labels, value) pairs
+    samples: List[Tuple[Dict[str, str], float]] = field(default_factory=list)
+
+    def add(self, value: float, **labels) -> None:
+        self.samples.append((labels, value))
+
+
+def sanitize_metric_name(name: str) -> str:
+    name = re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_metrics(metrics: List[Metric]) -> str:
+    lines = []
+    for metric in metrics:
+        if not metric.samples:
+            continue
+
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for labels, value in metric.samples:
+            labels_str = ",".join(f'{sanitize_metric_name(k)}="{_escape_label_value(v)}"' for k, v in labels.items())
+            labels_str = f"{{{labels_str}}}" if labels_str else ""
+            lines.append(f"{metric.name}{labels_str} {_format_value(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int):
+        self._lock = Lock()
+        self._text = ""
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = server.text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # scrapes every few seconds should not spam the experiment log
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = Thread(target=self.httpd.serve_forever, name="metrics_server", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        """Actual port, i.e. when the server was started with port 0."""
+        return self.httpd.server_address[1]
+
+    def text(self) -> str:
+        with self._lock:
+            return self._text
+
+    def update(self, metrics: List[Metric]) -> None:
+        text = format_metrics(metrics)
+        with self._lock:
+            self._text = text
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
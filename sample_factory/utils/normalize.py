@@ -8,10 +8,12 @@ We do this normalization step as preprocessing before inference or learning. It
 before each learning iteration (not before each epoch or minibatch), since this is just redundant work.
 
 If no data normalization is needed we just keep the original data.
-Otherwise, we create a copy of data and do all of the operations operations in-place.
+Otherwise, we create a copy of data (or write it into preallocated output buffers) and do all of the operations
+in-place.
 """
 
-from typing import Dict
+from contextlib import nullcontext
+from typing import ContextManager, Dict, Optional
 
 import torch
 from torch import nn
@@ -19,6 +21,7 @@ from torch import nn
 from sample_factory.algo.utils.misc import EPS
 from sample_factory.algo.utils.running_mean_std import RunningMeanStdDictInPlace, running_mean_std_summaries
 from sample_factory.utils.dicts import copy_dict_structure, iter_dicts_recursively
+from sample_factory.utils.utils import log
 
 
 class ObservationNormalizer(nn.Module):
@@ -36,6 +39,8 @@ class ObservationNormalizer(nn.Module):
         self.should_scale = abs(self.scale - 1.0) > EPS
         self.should_normalize = self.should_sub_mean or self.should_scale or self.running_mean_std is not None
 
+        self._buffer_mismatch_logged = False
+
     @staticmethod
     def _clone_tensordict(obs_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         obs_clone = copy_dict_structure(obs_dict)  # creates an identical dict but with None values
@@ -48,13 +53,57 @@ class ObservationNormalizer(nn.Module):
 
         return obs_clone
 
-    def forward(self, obs_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    def _copy_to_buffers(
+        self, obs_dict: Dict[str, torch.Tensor], out: Dict[str, torch.Tensor]
+    ) -> Dict[str, torch.Tensor]:
+        obs_copy = dict()
+        for k, x in obs_dict.items():
+            buffer = out.get(k)
+            if (
+                buffer is None
+                or buffer.dtype != torch.float
+                or buffer.device != x.device
+                or buffer.shape[1:] != x.shape[1:]
+                or len(buffer) < len(x)
+            ):
+                if not self._buffer_mismatch_logged:
+                    # this defeats the purpose of the preallocated buffers, most likely they were allocated incorrectly
+                    self._buffer_mismatch_logged = True
+                    buffer_desc = None if buffer is None else (tuple(buffer.shape), buffer.dtype, buffer.device)
+                    log.warning(
+                        f"Can't normalize observations {k!r} {(tuple(x.shape), x.dtype, x.device)} into the output "
+                        f"buffer {buffer_desc}, allocating new tensors instead (logged only once)"
+                    )
+                obs_copy[k] = x.float() if x.dtype != torch.float else x.clone()
+            else:
+                # single pass over the input, type conversion (i.e. from uint8) is fused with the copy
+                obs_copy[k] = buffer[: len(x)].copy_(x)
+
+        return obs_copy
+
+    def forward(
+        self,
+        obs_dict: Dict[str, torch.Tensor],
+        out: Optional[Dict[str, torch.Tensor]] = None,
+        stats_lock: Optional[ContextManager] = None,
+    ) -> Dict[str, torch.Tensor]:
+        """
+        :param out: optional preallocated float32 buffers [max_batch_size, *obs_shape] that are reused to hold
+            the normalized observations instead of allocating new tensors. Returned tensors are views into these
+            buffers, so they are only valid until the next call.
+        :param stats_lock: lock to hold while we update the running statistics (if the normalizer is shared
+            with other processes or threads). Statistics of the batch are calculated without holding the lock,
+            the running statistics used for normalization are copied under the lock.
+        """
         if not self.should_normalize:
             return obs_dict
 
         with torch.no_grad():
-            # since we are creating a clone, it is safe to use in-place operations
-            obs_clone = self._clone_tensordict(obs_dict)
+            # since we are creating a copy, it is safe to use in-place operations
+            if out is None:
+                obs_clone = self._clone_tensordict(obs_dict)
+            else:
+                obs_clone = self._copy_to_buffers(obs_dict, out)
 
             # subtraction of mean and scaling is only applied to default "obs"
             # this should be modified for custom obs dicts
@@ -65,7 +114,15 @@ class ObservationNormalizer(nn.Module):
                 obs_clone["obs"].mul_(1.0 / self.scale)
 
             if self.running_mean_std:
-                self.running_mean_std(obs_clone)  # in-place normalization
+                moments = self.running_mean_std.batch_moments(obs_clone) if self.training else None
+                with stats_lock if stats_lock is not None else nullcontext():
+                    if moments is not None:
+                        self.running_mean_std.update_from_moments(moments)
+                    # other users can update the statistics as soon as we release the lock,
+                    # so we normalize with a copy to make sure mean and var come from the same update
+                    stats = self.running_mean_std.snapshot() if stats_lock is not None else None
+
+                self.running_mean_std.normalize(obs_clone, stats)  # in-place normalization
 
         return obs_clone
 
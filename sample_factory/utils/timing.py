@@ -9,6 +9,7 @@ from typing import Any, Optional, Union
 import psutil
 
 from sample_factory.algo.utils.misc import EPS
+from sample_factory.utils import tracing
 from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.utils import log
 
@@ -40,6 +41,7 @@ class TimingContext:
         self._additive = additive
         self._average = average
         self._time_enter = None
+        self._trace_enter_ns = None
         self._time = 0
 
     def set_tree_node(self, node):
@@ -63,12 +65,16 @@ class TimingContext:
 
     def __enter__(self):
         self._time_enter = time.time()
+        if tracing.TRACER is not None:
+            self._trace_enter_ns = time.perf_counter_ns()
         self._timing._open_contexts_stack.append(self)
 
     def __exit__(self, type_, value, traceback):
         time_passed = max(time.time() - self._time_enter, EPS)  # EPS to prevent div by zero
         self._record_measurement(self._key, time_passed)
         self._timing._open_contexts_stack.pop()
+        if tracing.TRACER is not None and self._trace_enter_ns is not None:
+            tracing.TRACER.record(self._timing._name, self._key, self._trace_enter_ns, time.perf_counter_ns())
 
 
 class Timing(AttrDict):
@@ -107,6 +113,15 @@ class Timing(AttrDict):
     def time_avg(self, key, average=10):
         return self._init_context(key, average=average)
 
+    def add_value(self, key: str, value: float) -> None:
+        """Add time measured outside of a timing context, e.g. a part of a call that we only identify afterwards."""
+        ctx = self._init_context(key, additive=True)
+        ctx._record_measurement(key, value)
+        if tracing.TRACER is not None:
+            # we only know the duration, so the event ends now
+            end_ns = time.perf_counter_ns()
+            tracing.TRACER.record(self._name, key, end_ns - int(value * 1e9), end_ns)
+
     @staticmethod
     def _time_str(value):
         return f"{value:.4f}" if isinstance(value, float) else str(value)
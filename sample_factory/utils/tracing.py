@@ -0,0 +1,118 @@
+"""
+Opt-in timeline of all Timing measurements (--trace_events) in Chrome trace-event format.
+
+Every process keeps the begin/end timestamps of timeit()/add_time()/time_avg() contexts in a ring buffer and
+writes them to a separate file when it stops. The runner merges these files into a single trace.json in the
+experiment directory which can be opened in chrome://tracing or https://ui.perfetto.dev to see how rollout workers,
+inference workers, the batcher and the learner overlap or wait for one another.
+
+Timestamps come from time.perf_counter_ns() which uses a system-wide monotonic clock, so events recorded
+in different processes can be placed on the same timeline.
+"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import shutil
+from collections import deque
+from os.path import join
+from typing import Dict, List, Optional, Tuple
+
+from sample_factory.utils.typing import Config
+from sample_factory.utils.utils import ensure_dir_exists, experiment_dir, log
+
+# (track, name, begin_ns, end_ns), track is the name of the Timing object that recorded the event
+TraceEvent = Tuple[str, str, int, int]
+
+
+class Tracer:
+    def __init__(self, buffer_size: int):
+        # when full, the oldest events are discarded
+        self.events: deque[TraceEvent] = deque(maxlen=buffer_size)
+
+    def record(self, track: str, name: str, begin_ns: int, end_ns: int) -> None:
+        # deque.append() is thread-safe, i.e. for Timing objects used by background threads
+        self.events.append((track, name, begin_ns, end_ns))
+
+    def chrome_trace_events(self, pid: int, process_name: str) -> List[Dict]:
+        """Complete ("X") events, with one thread (tid) per Timing object. Chrome timestamps are in microseconds."""
+        tids: Dict[str, int] = dict()
+        events = [dict(name="process_name", ph="M", pid=pid, tid=0, args=dict(name=process_name))]
+        for track, name, begin_ns, end_ns in list(self.events):
+            if track not in tids:
+                tids[track] = len(tids) + 1
+                events.append(dict(name="thread_name", ph="M", pid=pid, tid=tids[track], args=dict(name=track)))
+
+            events.append(
+                dict(
+                    name=name,
+                    cat=track,
+                    ph="X",
+                    ts=begin_ns / 1000,
+                    dur=(end_ns - begin_ns) / 1000,
+                    pid=pid,
+                    tid=tids[track],
+                )
+            )
+
+        return events
+
+
+TRACER: Optional[Tracer] = None
+
+
+def init_tracing(cfg: Config) -> None:
+    """Start recording Timing events in the current process (if enabled by --trace_events)."""
+    global TRACER
+    if cfg.trace_events and TRACER is None:
+        TRACER = Tracer(cfg.trace_buffer_size)
+
+
+def traces_dir(cfg: Config) -> str:
+    return join(experiment_dir(cfg=cfg), ".traces")
+
+
+def trace_file(cfg: Config) -> str:
+    return join(experiment_dir(cfg=cfg), "trace.json")
+
+
+def save_process_trace(cfg: Config) -> None:
+    """Write events recorded in the current process, to be merged by merge_traces()."""
+    if TRACER is None:
+        return
+
+    process = multiprocessing.current_process()
+    events = TRACER.chrome_trace_events(os.getpid(), process.name)
+    filename = join(ensure_dir_exists(traces_dir(cfg)), f"{process.name}_{os.getpid()}.json")
+    with open(filename, "w") as f:
+        json.dump(events, f)
+
+
+def merge_traces(cfg: Config) -> None:
+    """Merge the events of all processes into a single trace file. Called by the runner once all processes stopped."""
+    global TRACER
+    if TRACER is None:
+        return
+
+    save_process_trace(cfg)
+
+    trace_events = []
+    per_process_dir = traces_dir(cfg)
+    for filename in sorted(os.listdir(per_process_dir)):
+        with open(join(per_process_dir, filename)) as f:
+            trace_events.extend(json.load(f))
+    shutil.rmtree(per_process_dir, ignore_errors=True)
+
+    with open(trace_file(cfg), "w") as f:
+        json.dump(dict(traceEvents=trace_events, displayTimeUnit="ms"), f)
+    log.info(f"Saved {len(trace_events)} trace events to {trace_file(cfg)}")
+
+    # the next run in the same process (i.e. benchmarks in serial mode) starts with an empty timeline
+    TRACER = None
+
+
+def clear_traces(cfg: Config) -> None:
+    """Remove per-process traces left by a previous run of the same experiment."""
+    shutil.rmtree(traces_dir(cfg), ignore_errors=True)
@@ -4,6 +4,7 @@ import argparse
 import getpass
 import importlib
 import logging
+import multiprocessing
 import operator
 import os
 import tempfile
@@ -12,6 +13,7 @@ from os.path import join
 from queue import Full
 from subprocess import SubprocessError, check_output, run
 from sys import platform
+from typing import Dict
 
 import numpy as np
 import psutil
@@ -257,6 +259,18 @@ def memory_consumption_mb():
     return process.memory_info().rss / (1024 * 1024)
 
 
+def child_processes_memory_mb() -> Dict[str, float]:
+    """Memory consumption of the (alive) child processes started with multiprocessing, by process name."""
+    memory = dict()
+    for child in multiprocessing.active_children():
+        try:
+            memory[child.name] = psutil.Process(child.pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            # process exited in the meantime
+            pass
+    return memory
+
+
 def kill(proc_pid):
     process = psutil.Process(proc_pid)
     for proc in process.children(recursive=True):
@@ -0,0 +1,44 @@
+import glob
+from os.path import join
+
+import pytest
+
+from sample_factory.algo.utils.async_summary_writer import AsyncSummaryWriter
+
+
+def _read_scalars(summary_dir):
+    event_accumulator = pytest.importorskip("tensorboard.backend.event_processing.event_accumulator")
+    scalars = dict()
+    for event_file in glob.glob(join(summary_dir, "events.out.tfevents.*")):
+        acc = event_accumulator.EventAccumulator(event_file)
+        acc.Reload()
+        for tag in acc.Tags()["scalars"]:
+            scalars[tag] = [(e.step, e.value) for e in acc.Scalars(tag)]
+    return scalars
+
+
+class TestAsyncSummaryWriter:
+    def test_write(self, tmp_path):
+        summary_dirs = {0: str(tmp_path / "0"), 1: str(tmp_path / "1")}
+        writer = AsyncSummaryWriter(summary_dirs, flush_secs=1, queue_size=1000)
+        for step in range(10):
+            writer.writers[0].add_scalar("train/loss", step * 0.5, step)
+            writer.writers[1].add_scalar("perf/_fps", 100 + step, step)
+        writer.close()
+
+        assert writer.num_dropped == 0
+        assert _read_scalars(summary_dirs[0]) == {"train/loss": [(step, step * 0.5) for step in range(10)]}
+        assert _read_scalars(summary_dirs[1]) == {"perf/_fps": [(step, 100.0 + step) for step in range(10)]}
+
+    def test_drop_on_overflow(self, tmp_path):
+        summary_dirs = {0: str(tmp_path / "0")}
+        writer = AsyncSummaryWriter(summary_dirs, flush_secs=1, queue_size=5)
+        # the writer process can't possibly consume all of these while they're being added
+        num_records = 10000
+        for step in range(num_records):
+            writer.writers[0].add_scalar("stats/x", step, step)
+        writer.close()
+
+        assert writer.num_dropped > 0
+        num_written = len(_read_scalars(summary_dirs[0]).get("stats/x", []))
+        assert num_written + writer.num_dropped == num_records
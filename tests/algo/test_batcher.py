@@ -0,0 +1,103 @@
+import pytest
+import torch
+from signal_slot.signal_slot import EventLoop
+
+from sample_factory.algo.learning.batcher import Batcher
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+@pytest.fixture(scope="module")
+def cfg_and_env_info():
+    register_custom_components()
+    cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_env_v1", "--experiment=test_batcher"])
+    cfg.num_workers = 2
+    cfg.num_envs_per_worker = 2
+    cfg.rollout = 8
+    cfg.batch_size = 4 * cfg.rollout
+    cfg.serial_mode = True
+    cfg.device = "cpu"
+    cfg.env_gpu_observations = False
+
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+    tmp_env.close()
+    return cfg, env_info
+
+
+def _num_buffers(buffer_mgr: BufferMgr) -> int:
+    return buffer_mgr.traj_tensors_torch["cpu"]["rewards"].shape[0]
+
+
+class TestZeroCopyBatches:
+    def test_buffer_accounting(self, cfg_and_env_info):
+        cfg, env_info = cfg_and_env_info
+        num_buffers = _num_buffers(BufferMgr(cfg, env_info))
+
+        cfg.zero_copy_batches = True
+        buffer_mgr = BufferMgr(cfg, env_info)
+        assert buffer_mgr.zero_copy_batches
+        # trajectories held by the batches are not compensated for with extra buffers
+        assert _num_buffers(buffer_mgr) == num_buffers
+
+        # training batches are not preallocated
+        batcher = Batcher(EventLoop("test_evt_loop"), 0, buffer_mgr, cfg, env_info)
+        batcher.init()
+        assert all(batch is None for batch in batcher.batch_buffers)
+
+    def test_batch_views(self, cfg_and_env_info):
+        cfg, env_info = cfg_and_env_info
+        cfg.zero_copy_batches = True
+        buffer_mgr = BufferMgr(cfg, env_info)
+        traj_tensors = buffer_mgr.traj_tensors_torch["cpu"]
+        traj_tensors["rewards"][:] = torch.arange(_num_buffers(buffer_mgr)).unsqueeze(1)
+
+        batcher = Batcher(EventLoop("test_evt_loop"), 0, buffer_mgr, cfg, env_info)
+        batcher.init()
+        traj_per_batch = batcher.traj_per_training_iteration
+
+        # contiguous trajectories, the batch is a view into the shared buffers
+        batcher.on_new_trajectories([dict(policy_id=0, traj_buffer_idx=i) for i in range(traj_per_batch)], "cpu")
+        batch = batcher.training_batches[0]
+        assert batch["rewards"].data_ptr() == traj_tensors["rewards"].data_ptr()
+        assert batch["obs"]["obs"].data_ptr() == traj_tensors["obs"]["obs"].data_ptr()
+
+        # trajectories are only returned to the samplers when the learner is done with the batch
+        queue = buffer_mgr.traj_buffer_queues["cpu"]
+        queue.get_many(block=False, max_messages_to_get=1000000)  # drain initially available buffers
+        assert queue.empty()
+        batcher.on_training_batch_released(0, 1)
+        assert queue.get_many(block=False, max_messages_to_get=1000000) == list(range(traj_per_batch))
+        assert batcher.training_batches[0] is batcher.batch_buffers[0]
+
+    def test_non_contiguous_batches(self, cfg_and_env_info):
+        cfg, env_info = cfg_and_env_info
+        cfg.zero_copy_batches = True
+        buffer_mgr = BufferMgr(cfg, env_info)
+        traj_tensors = buffer_mgr.traj_tensors_torch["cpu"]
+        traj_tensors["rewards"][:] = torch.arange(_num_buffers(buffer_mgr)).unsqueeze(1)
+        queue = buffer_mgr.traj_buffer_queues["cpu"]
+        queue.get_many(block=False, max_messages_to_get=1000000)
+
+        batcher = Batcher(EventLoop("test_evt_loop"), 0, buffer_mgr, cfg, env_info)
+        batcher.init()
+        traj_per_batch = batcher.traj_per_training_iteration
+
+        # trajectories in different parts of the buffer are copied into training batches allocated on demand
+        for batch_idx in range(2):
+            indices = [batch_idx + 2 * i for i in range(traj_per_batch)]
+            batcher.on_new_trajectories([dict(policy_id=0, traj_buffer_idx=i) for i in indices], "cpu")
+            batch = batcher.training_batches[batch_idx]
+            assert batch is batcher.batch_buffers[batch_idx]
+            assert batch["rewards"].data_ptr() != traj_tensors["rewards"].data_ptr()
+            assert torch.equal(batch["rewards"][:, 0], torch.tensor(indices, dtype=torch.float32))
+
+            if cfg.async_rl:
+                # copied trajectories are released right away, just like without zero-copy batches
+                assert queue.get_many(block=False, max_messages_to_get=1000000) == indices
+
+        for batch_idx in range(2):
+            batcher.on_training_batch_released(batch_idx, batch_idx + 1)
+        assert all(batch is buffer for batch, buffer in zip(batcher.training_batches, batcher.batch_buffers))
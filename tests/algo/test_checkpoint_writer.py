@@ -0,0 +1,52 @@
+import os
+from os.path import join
+
+import torch
+
+from sample_factory.algo.learning.checkpoint_writer import CheckpointJob, CheckpointWriter, snapshot_state
+
+
+def _job(checkpoint_dir, checkpoint, step: int, keep_checkpoints: int = 2) -> CheckpointJob:
+    return CheckpointJob(
+        snapshot_state(checkpoint),
+        join(checkpoint_dir, "checkpoint_temp"),
+        join(checkpoint_dir, f"checkpoint_{step:09d}.pth"),
+        "checkpoint_*",
+        keep_checkpoints,
+        notify=True,
+    )
+
+
+class TestCheckpointWriter:
+    def test_write_and_rotate(self, tmp_path):
+        checkpoint_dir = str(tmp_path)
+        weights = torch.zeros(16)
+        checkpoint = dict(model=dict(weights=weights), optimizer=dict(state={0: dict(step=torch.tensor(0.0))}))
+
+        writer = CheckpointWriter(policy_id=0, max_pending=2)
+        for step in range(5):
+            writer.submit(_job(checkpoint_dir, checkpoint, step))
+            # training continues modifying the weights while the snapshot is being written
+            weights.add_(1.0)
+
+        writer.flush()
+        assert writer.pop_completed() == 5
+        assert writer.pop_completed() == 0
+
+        # only the latest checkpoints are kept, and no temporary files are left behind
+        assert sorted(os.listdir(checkpoint_dir)) == ["checkpoint_000000003.pth", "checkpoint_000000004.pth"]
+        for step in [3, 4]:
+            loaded = torch.load(join(checkpoint_dir, f"checkpoint_{step:09d}.pth"))
+            assert torch.equal(loaded["model"]["weights"], torch.full((16,), float(step)))
+
+        writer.close()
+
+    def test_failed_write(self, tmp_path):
+        writer = CheckpointWriter(policy_id=0, max_pending=1)
+        writer.submit(_job(join(str(tmp_path), "does_not_exist"), dict(model=dict()), 0))
+        writer.submit(_job(str(tmp_path), dict(model=dict()), 1))
+        writer.close()
+
+        # the writer survives the error and only reports checkpoints that made it to disk
+        assert writer.pop_completed() == 1
+        assert os.listdir(str(tmp_path)) == ["checkpoint_000000001.pth"]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.inference_batching import AdaptiveInferenceBatching
+
+
+def _simulate(batching: AdaptiveInferenceBatching, arrival_rate: float, fixed_cost: float, per_request_cost: float):
+    """
+    Requests arrive at a steady rate, forward pass cost is linear in the number of requests (with some noise).
+    Requests that arrive while a batch is processed are queued until the next one.
+    """
+    rng = np.random.default_rng(0)
+    latencies = []
+    t, next_arrival = 0.0, 0.0
+    queue = []  # arrival times of the pending requests
+    for _ in range(2000):
+        wait_started = t
+        deadline = t + batching.wait_deadline
+        while len(queue) < batching.min_num_requests and next_arrival <= deadline:
+            queue.append(next_arrival)
+            next_arrival += 1.0 / arrival_rate
+        t = max(t, queue[-1]) if len(queue) >= batching.min_num_requests else deadline
+        if not queue:
+            batching.record_idle(t - wait_started)
+            continue
+
+        batch, queue = queue[: batching.max_num_requests], queue[batching.max_num_requests :]
+        step_time = (fixed_cost + per_request_cost * len(batch)) * rng.uniform(0.9, 1.1)
+        t += step_time
+        while next_arrival <= t:
+            queue.append(next_arrival)
+            next_arrival += 1.0 / arrival_rate
+
+        batch_latencies = [t - arrival for arrival in batch]
+        batching.record_step(len(batch), t - wait_started, step_time, batch_latencies)
+        latencies.extend(batch_latencies)
+
+    # only look at the second half, after the operating point has settled
+    return float(np.percentile(latencies[len(latencies) // 2 :], 99))
+
+
+class TestAdaptiveInferenceBatching:
+    @pytest.mark.parametrize("arrival_rate", [100, 2000, 20000])
+    def test_meets_latency_target(self, arrival_rate):
+        target = 0.02
+        batching = AdaptiveInferenceBatching(
+            target, min_num_requests=1, wait_deadline=0.025, max_num_requests=10000, update_every=10
+        )
+        p99 = _simulate(batching, arrival_rate, fixed_cost=0.002, per_request_cost=0.00001)
+        assert p99 <= target
+
+        summaries = batching.summaries()
+        assert summaries["inference_p99_latency_ms"] <= target * 1000
+        assert summaries["inference_min_num_requests"] == batching.min_num_requests
+
+    def test_batches_more_under_heavy_load(self):
+        def operating_point(arrival_rate):
+            batching = AdaptiveInferenceBatching(0.02, 1, 0.025, max_num_requests=10000, update_every=10)
+            _simulate(batching, arrival_rate, fixed_cost=0.002, per_request_cost=0.00001)
+            return batching.min_num_requests
+
+        assert operating_point(100) < operating_point(2000) < operating_point(20000)
+
+    def test_max_num_requests(self):
+        batching = AdaptiveInferenceBatching(0.1, 1, 0.025, max_num_requests=8, update_every=10)
+        _simulate(batching, 20000, fixed_cost=0.001, per_request_cost=0.0)
+        assert batching.min_num_requests == 8
@@ -0,0 +1,79 @@
+import numpy as np
+import torch
+
+from sample_factory.algo.sampling.inference_staging import InferenceStaging
+from sample_factory.algo.utils.tensor_dict import TensorDict, to_numpy
+
+
+def _traj_tensors(num_traj: int, rollout: int) -> TensorDict:
+    return TensorDict(
+        obs=TensorDict(
+            obs=torch.randint(0, 255, (num_traj, rollout + 1, 3, 4, 4), dtype=torch.uint8),
+            measurements=torch.randn(num_traj, rollout + 1, 2),
+        ),
+        rnn_states=torch.randn(num_traj, rollout + 1, 8),
+    )
+
+
+class TestInferenceStaging:
+    def test_gather_slices(self):
+        num_workers, num_splits, envs_per_split, rollout = 3, 2, 4, 5
+        traj_tensors = _traj_tensors(num_workers * num_splits * envs_per_split * 2, rollout)
+        policy_output_tensors = TensorDict(values=torch.zeros(num_workers, num_splits, envs_per_split))
+        staging = InferenceStaging(
+            traj_tensors, policy_output_tensors, num_workers * num_splits * envs_per_split, "cpu"
+        )
+        assert staging.outputs is None  # outputs are already on the right device
+
+        traj_tensors_np = to_numpy(traj_tensors)
+        for num_requests in [1, 2, 5]:
+            traj_indices = [
+                (slice(i * envs_per_split, (i + 1) * envs_per_split), i % rollout) for i in range(num_requests)
+            ]
+            obs, rnn_states = staging.gather_slices(traj_tensors_np, traj_indices)
+
+            expected_rnn_states = torch.cat([traj_tensors["rnn_states"][idx] for idx in traj_indices])
+            assert torch.equal(rnn_states, expected_rnn_states)
+            for key in ["obs", "measurements"]:
+                expected = torch.cat([traj_tensors["obs"][key][idx] for idx in traj_indices])
+                assert obs[key].dtype == expected.dtype
+                assert torch.equal(obs[key], expected)
+
+        # buffers are reused between batches
+        assert obs["obs"].data_ptr() == staging.obs["obs"].data_ptr()
+
+    def test_gather_steps_and_concat_outputs(self):
+        num_workers, num_splits, num_envs, num_agents, rollout = 2, 1, 3, 2, 4
+        max_batch_size = num_workers * num_envs * num_agents
+        traj_tensors = _traj_tensors(max_batch_size, rollout)
+        output_names, output_sizes = ["actions", "values", "new_rnn_states"], [1, 1, 8]
+        policy_output_tensors = torch.zeros(num_workers, num_splits, num_envs, num_agents, sum(output_sizes))
+        staging = InferenceStaging(traj_tensors, policy_output_tensors, max_batch_size, "cpu")
+
+        traj_tensors_np = to_numpy(traj_tensors)
+        for num_samples in [1, 7, max_batch_size]:
+            traj_buffer_idx = np.random.choice(max_batch_size, num_samples, replace=False)
+            rollout_step = np.random.randint(0, rollout + 1, num_samples)
+            obs, rnn_states = staging.gather_steps(traj_tensors_np, traj_buffer_idx, rollout_step)
+
+            indices = (torch.from_numpy(traj_buffer_idx), torch.from_numpy(rollout_step))
+            assert torch.equal(rnn_states, traj_tensors["rnn_states"][indices])
+            for key in ["obs", "measurements"]:
+                assert torch.equal(obs[key], traj_tensors["obs"][key][indices])
+
+            policy_outputs = TensorDict(
+                actions=torch.randint(0, 5, (num_samples,)),
+                values=torch.randn(num_samples),
+                new_rnn_states=torch.randn(num_samples, 8),
+            )
+            outputs = staging.concat_outputs(policy_outputs, output_names, output_sizes, num_samples)
+            expected = torch.cat(
+                [
+                    policy_outputs["actions"].float().unsqueeze(-1),
+                    policy_outputs["values"].unsqueeze(-1),
+                    policy_outputs["new_rnn_states"],
+                ],
+                dim=1,
+            )
+            assert outputs.shape == (num_samples, sum(output_sizes))
+            assert torch.equal(outputs, expected)
@@ -1,10 +1,15 @@
 import copy
 import random
+import time
 
+import numpy as np
 import pytest
 import torch
+from signal_slot.signal_slot import EventLoop
 
-from sample_factory.algo.learning.learner import Learner
+from sample_factory.algo.learning import learner as learner_module
+from sample_factory.algo.learning.batch_prefetcher import BatchPrefetcher
+from sample_factory.algo.learning.learner import Learner, _MinibatchStat
 from sample_factory.algo.sampling.sync_sampling_api import SyncSamplingAPI
 from sample_factory.algo.utils.env_info import extract_env_info
 from sample_factory.algo.utils.make_env import make_env_func_batched
@@ -16,6 +21,7 @@ from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.dicts import iterate_recursively
 from sf_examples.mujoco.mujoco_utils import mujoco_available
 from sf_examples.mujoco.train_mujoco import parse_mujoco_cfg, register_mujoco_components
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
 
 
 def _learner_losses_res(learner: Learner, dataset: AttrDict, num_invalids: int) -> AttrDict:
@@ -166,3 +172,251 @@ class TestValidMasks:
         assert torch.allclose(res.exploration_loss, invalid_res.exploration_loss, atol=atol, rtol=rtol)
         assert torch.allclose(res.kl_loss, invalid_res.kl_loss, atol=atol, rtol=rtol)
         assert torch.allclose(res.value_loss, invalid_res.value_loss, atol=atol, rtol=rtol)
+
+
+class TestMixedPrecision:
+    @pytest.mark.parametrize("use_rnn", [False, True])
+    def test_bf16_losses_close_to_fp32(self, use_rnn: bool):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_env_v1", "--experiment=test_learner_bf16"])
+        cfg.num_workers = 1
+        cfg.rollout = 8
+        cfg.batch_size = 32
+        cfg.device = "cpu"
+        cfg.serial_mode = True
+        cfg.env_gpu_observations = False
+        cfg.use_rnn = use_rnn
+        cfg.recurrence = cfg.rollout if cfg.use_rnn else 1
+        cfg.exploration_loss_coeff = 0.001
+
+        tmp_env = make_env_func_batched(cfg, env_config=None)
+        env_info = extract_env_info(tmp_env, cfg)
+        tmp_env.close()
+
+        policy_id = 0
+        policy_versions = torch.zeros([cfg.num_policies], dtype=torch.int32)
+        param_server = ParameterServer(policy_id, policy_versions, cfg.serial_mode)
+        learner: Learner = Learner(cfg, env_info, policy_versions, policy_id, param_server)
+        init_model_data = learner.init()
+
+        sampler = SyncSamplingAPI(cfg, env_info, param_servers={policy_id: param_server})
+        sampler.start({policy_id: init_model_data})
+        trajectories = []
+        sampled = 0
+        while sampled < cfg.batch_size:
+            traj = sampler.get_trajectories_sync()
+            sampled += samples_per_trajectory(traj)
+            trajectories.append(traj)
+        sampler.stop()
+
+        dataset, _, invalids = learner._prepare_batch(cat_tensordicts(trajectories))
+        dataset = AttrDict(dataset)
+
+        learner.cfg.bf16_autocast = False
+        res_fp32 = _learner_losses_res(learner, dataset, invalids)
+        learner.cfg.bf16_autocast = True
+        res_bf16 = _learner_losses_res(learner, dataset, invalids)
+
+        for key, fp32_loss in res_fp32.items():
+            bf16_loss = res_bf16[key]
+            if not torch.is_tensor(fp32_loss):
+                continue  # disabled losses
+            assert bf16_loss.dtype == torch.float32, key
+            assert torch.allclose(bf16_loss, fp32_loss, rtol=0.05, atol=0.01), key
+
+        # gradients flow back to the float32 master weights
+        res_bf16.policy_loss.backward()
+        assert all(p.dtype == torch.float32 for p in learner.actor_critic.parameters())
+
+
+def _custom_env_cfg_and_info(experiment: str):
+    register_custom_components()
+    cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_env_v1", f"--experiment={experiment}"])
+    cfg.num_workers = 1
+    cfg.rollout = 8
+    cfg.batch_size = 32
+    cfg.device = "cpu"
+    cfg.serial_mode = True
+    cfg.env_gpu_observations = False
+    cfg.normalize_returns = True
+    cfg.recurrence = cfg.rollout if cfg.use_rnn else 1
+
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+    tmp_env.close()
+    return cfg, env_info
+
+
+def _make_learner(cfg, env_info) -> Learner:
+    policy_id = 0
+    policy_versions = torch.zeros([cfg.num_policies], dtype=torch.int32)
+    param_server = ParameterServer(policy_id, policy_versions, cfg.serial_mode)
+    learner = Learner(cfg, env_info, policy_versions, policy_id, param_server)
+    learner.init()
+    return learner
+
+
+def _sample_batch(cfg, env_info, learner: Learner):
+    sampler = SyncSamplingAPI(cfg, env_info, param_servers={learner.policy_id: learner.param_server})
+    sampler.start({learner.policy_id: (learner.policy_id, learner.actor_critic.state_dict(), learner.device, 0)})
+    trajectories = []
+    sampled = 0
+    while sampled < cfg.batch_size:
+        traj = sampler.get_trajectories_sync()
+        sampled += samples_per_trajectory(traj)
+        trajectories.append(traj)
+    sampler.stop()
+    return cat_tensordicts(trajectories)
+
+
+class TestBatchPrefetching:
+    @pytest.mark.parametrize("stale_steps", [False, True])
+    def test_prefetched_batch_matches_sync(self, stale_steps: bool):
+        cfg, env_info = _custom_env_cfg_and_info("test_learner_prefetch")
+        assert cfg.normalize_returns
+        learner = _make_learner(cfg, env_info)
+        batch = _sample_batch(cfg, env_info, learner)
+
+        prefetch_cfg = copy.deepcopy(cfg)
+        prefetch_cfg.serial_mode = False
+        prefetch_cfg.learner_prefetch_batches = 1
+        prefetch_learner = _make_learner(prefetch_cfg, env_info)
+        assert prefetch_learner.prefetching
+        prefetch_learner.actor_critic.load_state_dict(learner.actor_critic.state_dict())
+
+        if stale_steps:
+            # policy versions grow along the trajectory, the earliest steps become stale while the batch is prefetched
+            rollout = batch["policy_version"].shape[1]
+            batch["policy_version"][:] = torch.arange(rollout, dtype=batch["policy_version"].dtype)
+            cfg.max_policy_lag = prefetch_cfg.max_policy_lag = rollout // 2
+            prefetch_learner.train_step = rollout
+            learner.train_step = rollout + 2
+
+        prefetched = prefetch_learner.prefetch_batch(copy.deepcopy(batch))
+        prefetch_learner.train_step = learner.train_step
+        buff, experience_size, num_invalids = prefetch_learner._use_prefetched_batch(prefetched)
+        sync_buff, sync_experience_size, sync_num_invalids = learner._prepare_batch(copy.deepcopy(batch))
+
+        assert experience_size == sync_experience_size
+        assert num_invalids == sync_num_invalids
+        assert (num_invalids > 0) == stale_steps
+        assert torch.equal(buff["valids"], sync_buff["valids"])
+
+        valids = sync_buff["valids"]
+        for key in ["advantages", "returns", "actions", "log_prob_actions", "rewards"]:
+            assert torch.allclose(buff[key][valids], sync_buff[key][valids], atol=1e-6), key
+        assert torch.allclose(buff["normalized_obs"]["obs"][valids], sync_buff["normalized_obs"]["obs"][valids])
+
+        # statistics updated in the prefetcher thread end up in the same state, stale steps are excluded from them
+        for key, value in learner.actor_critic.state_dict().items():
+            assert torch.allclose(prefetch_learner.actor_critic.state_dict()[key], value), key
+
+    def test_batches_in_flight(self):
+        class _Learner:
+            policy_id = 0
+
+            @staticmethod
+            def prefetch_batch(batch):
+                return AttrDict(batch=batch)
+
+        batcher = AttrDict(training_batches=["batch0", "batch1", "batch2"])
+        prefetcher = BatchPrefetcher(EventLoop("test_evt_loop"), _Learner(), batcher, max_prefetched_batches=1)
+
+        for batch_idx in range(3):
+            prefetcher.on_new_training_batch(batch_idx)
+        # the batch being trained on and one batch prepared ahead of time
+        assert list(prefetcher.prefetched_batches) == [0, 1]
+        assert list(prefetcher.pending_batches) == [2]
+
+        assert prefetcher.pop_prefetched_batch(0).batch == "batch0"
+        prefetcher.on_training_batch_released(0, 1)
+        assert list(prefetcher.prefetched_batches) == [1, 2]
+        assert prefetcher.pop_prefetched_batch(2).batch == "batch2"
+
+
+class TestDeferredTrainStats:
+    @pytest.mark.parametrize("learning_rate", [1e-4, 0.0])
+    def test_deferred_matches_eager(self, learning_rate: float):
+        cfg, env_info = _custom_env_cfg_and_info("test_learner_deferred_stats")
+        cfg.num_epochs = 4
+        # with zero learning rate the loss does not change and we stop early after the second epoch
+        cfg.learning_rate = learning_rate
+        learner = _make_learner(cfg, env_info)
+        batch = _sample_batch(cfg, env_info, learner)
+
+        deferred_cfg = copy.deepcopy(cfg)
+        deferred_cfg.deferred_train_stats = True
+        deferred_learner = _make_learner(deferred_cfg, env_info)
+        deferred_learner.actor_critic.load_state_dict(learner.actor_critic.state_dict())
+
+        # summaries that are read back at the end of the iteration should not hold on to the autograd graph
+        summaries_to_scalars = deferred_learner._summaries_to_scalars
+        requires_grad = []
+
+        def check_summaries_to_scalars(stats):
+            requires_grad.extend(key for key, value in stats.items() if torch.is_tensor(value) and value.requires_grad)
+            return summaries_to_scalars(stats)
+
+        deferred_learner._summaries_to_scalars = check_summaries_to_scalars
+
+        results = []
+        for learner_ in [learner, deferred_learner]:
+            buff, experience_size, num_invalids = learner_._prepare_batch(copy.deepcopy(batch))
+            learner_.last_summary_time = 0  # record summaries in this iteration
+            np.random.seed(42)
+            torch.manual_seed(42)
+            stats = learner_._train(buff, cfg.batch_size, experience_size, num_invalids)
+            results.append((stats, learner_.train_step))
+
+        (stats, train_step), (deferred_stats, deferred_train_step) = results
+        assert not requires_grad
+        assert train_step == deferred_train_step == (2 if learning_rate == 0 else cfg.num_epochs)
+
+        assert stats is not None and deferred_stats.keys() == stats.keys()
+        for key, value in stats.items():
+            assert isinstance(deferred_stats[key], type(value)), key
+            assert deferred_stats[key] == pytest.approx(value, rel=1e-5, abs=1e-6), key
+
+        for key, value in learner.actor_critic.state_dict().items():
+            assert torch.allclose(deferred_learner.actor_critic.state_dict()[key], value), key
+
+    @pytest.mark.parametrize("deferred_train_stats", [False, True])
+    def test_publish_and_forced_summaries(self, monkeypatch, deferred_train_stats: bool):
+        cfg, env_info = _custom_env_cfg_and_info("test_learner_deferred_publish")
+        cfg.num_epochs = 3
+        cfg.learning_rate = 0.0  # loss does not change, we stop early after the second epoch
+        cfg.deferred_train_stats = deferred_train_stats
+        learner = _make_learner(cfg, env_info)
+        batch = _sample_batch(cfg, env_info, learner)
+
+        published = []
+        monkeypatch.setattr(learner, "_publish_policy_version", lambda: published.append(learner.train_step))
+        messages = []
+        monkeypatch.setattr(learner_module.log, "debug", lambda msg, *args: messages.append(msg % args))
+        # every loss is a "high loss", this forces summaries even if it is not time to record them
+        monkeypatch.setattr(learner_module, "_HIGH_LOSS", -1.0)
+
+        buff, experience_size, num_invalids = learner._prepare_batch(batch)
+        learner.last_summary_time = time.time()
+        stats = learner._train(buff, cfg.batch_size, experience_size, num_invalids)
+
+        # weights are published after every minibatch, deferred stats or not
+        assert published == list(range(1, learner.train_step + 1))
+        assert stats is not None
+        assert any(m.startswith("Early stopping after 2 epochs") for m in messages)
+
+    def test_deferred_warnings(self, monkeypatch):
+        warnings = []
+        monkeypatch.setattr(learner_module.log, "warning", lambda msg, *args: warnings.append(msg % args))
+
+        # (epochs, minibatches, stats)
+        minibatch_stats = torch.zeros((2, 3, len(_MinibatchStat)))
+        learner_module.Learner._report_deferred_warnings(None, minibatch_stats)
+        assert not warnings
+
+        minibatch_stats[1, 2, _MinibatchStat.LOSS_ABS] = 100.0
+        minibatch_stats[0, 1, _MinibatchStat.KL_MAX] = 1000.0
+        learner_module.Learner._report_deferred_warnings(None, minibatch_stats)
+        assert len(warnings) == 2
+        assert "High loss value: 100.0000" in warnings[0]
+        assert "KL-divergence is very high: 1000.0000" in warnings[1]
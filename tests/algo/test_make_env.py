@@ -0,0 +1,129 @@
+import threading
+from typing import Optional
+
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import SequentialVectorizeWrapper, make_env_func_batched
+from sample_factory.algo.utils.subprocess_vec_env import SubprocessVectorizeWrapper
+from sample_factory.utils.attr_dict import AttrDict
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+class _CounterEnv(gym.Env):
+    """Batched single-agent env, observation is env index + sum of all actions so far."""
+
+    def __init__(self, env_idx: int, barrier: Optional[threading.Barrier] = None):
+        self.observation_space = gym.spaces.Dict(obs=gym.spaces.Box(-1e6, 1e6, (2,)))
+        self.action_space = gym.spaces.Discrete(10)
+        self.num_agents = 1
+        self.env_idx = env_idx
+        self.total = 0.0
+        self.barrier = barrier
+
+    def _obs(self):
+        return dict(obs=torch.tensor([[self.env_idx, self.total]]))
+
+    def reset(self, **kwargs):
+        self.total = 0.0
+        return self._obs(), [dict()]
+
+    def step(self, actions):
+        if self.barrier is not None:
+            # only passes if all envs are stepped at the same time
+            self.barrier.wait(timeout=10)
+
+        self.total += float(actions.sum())
+        rew = torch.tensor([self.env_idx * 0.5])
+        terminated = torch.tensor([self.total > 20])
+        truncated = torch.tensor([False])
+        return self._obs(), rew, terminated, truncated, [dict(env_idx=self.env_idx)]
+
+
+def _rollout(vec_env: SequentialVectorizeWrapper, num_steps: int):
+    vec_env.reset()
+    results = []
+    for step in range(num_steps):
+        actions = torch.arange(vec_env.num_agents) + step
+        obs, rew, terminated, truncated, infos = vec_env.step(actions)
+        results.append((obs["obs"].clone(), rew.clone(), terminated.clone(), truncated.clone(), infos))
+    return results
+
+
+class TestSequentialVectorizeWrapper:
+    @pytest.mark.parametrize("num_threads", [1, 2, 4])
+    def test_threaded_step(self, num_threads):
+        num_envs, num_steps = 4, 10
+        sequential = SequentialVectorizeWrapper([_CounterEnv(i) for i in range(num_envs)])
+        threaded = SequentialVectorizeWrapper([_CounterEnv(i) for i in range(num_envs)], num_threads=num_threads)
+
+        for (obs, rew, terminated, truncated, infos), threaded_results in zip(
+            _rollout(sequential, num_steps), _rollout(threaded, num_steps)
+        ):
+            t_obs, t_rew, t_terminated, t_truncated, t_infos = threaded_results
+            assert torch.equal(obs, t_obs)
+            assert torch.equal(rew, t_rew)
+            assert torch.equal(terminated, t_terminated)
+            assert torch.equal(truncated, t_truncated)
+            assert infos == t_infos
+
+        sequential.close()
+        threaded.close()
+
+    def test_envs_stepped_concurrently(self):
+        num_envs = 4
+        barrier = threading.Barrier(num_envs)
+        vec_env = SequentialVectorizeWrapper([_CounterEnv(i, barrier) for i in range(num_envs)], num_threads=num_envs)
+        vec_env.reset()
+        vec_env.step(torch.ones(num_envs))
+        vec_env.close()
+
+
+class TestSubprocessVectorizeWrapper:
+    @pytest.mark.parametrize("num_processes", [1, 3])
+    def test_step(self, num_processes):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--env=my_custom_env_v1", "--experiment=test_subprocess_vec_env"])
+        cfg.custom_env_episode_len = 3
+
+        tmp_env = make_env_func_batched(cfg, env_config=None)
+        env_info = extract_env_info(tmp_env, cfg)
+        tmp_env.close()
+
+        num_envs, num_steps = 4, 8
+        env_configs = [AttrDict(worker_index=0, vector_index=i, env_id=i) for i in range(num_envs)]
+        sequential = SequentialVectorizeWrapper([make_env_func_batched(cfg, c) for c in env_configs])
+        subprocess = SubprocessVectorizeWrapper(cfg, env_info, env_configs, num_processes=num_processes)
+        assert subprocess.num_agents == sequential.num_agents == num_envs
+
+        try:
+            # reward shaping scheme of the second half of the envs, envs in different processes
+            reward_shaping = dict(action_rew_coeff=2.0)
+            for vec_env in [sequential, subprocess]:
+                assert vec_env.get_default_reward_shaping() == dict(action_rew_coeff=0.01)
+                vec_env.set_reward_shaping(reward_shaping, slice(2, num_envs))
+
+            obs, infos = subprocess.reset()
+            assert obs["obs"].shape == (num_envs,) + env_info.obs_space["obs"].shape
+            assert len(infos) == num_envs
+            sequential.reset()
+
+            for _ in range(num_steps):
+                actions = np.random.randint(0, env_info.action_space.n, num_envs)
+                results = sequential.step(actions)
+                sub_results = subprocess.step(actions)
+                for x, sub_x in zip(results[1:4], sub_results[1:4]):
+                    assert torch.equal(torch.as_tensor(x).to(sub_x.dtype), sub_x)
+
+                sub_obs, infos = sub_results[0], sub_results[4]
+                assert sub_obs["obs"].data_ptr() == obs["obs"].data_ptr()  # shared buffers are reused
+                assert sub_obs["obs"].std() > 0  # obs are random
+                assert len(infos) == num_envs
+        finally:
+            sequential.close()
+            subprocess.close()
+
+        assert not any(p.is_alive() for p in subprocess.processes)
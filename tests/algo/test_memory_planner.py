@@ -0,0 +1,105 @@
+import pytest
+from signal_slot.signal_slot import EventLoop
+
+from sample_factory.algo.learning.batcher import Batcher
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.memory_planner import (
+    GB,
+    check_memory_budget,
+    largest_feasible_num_envs_per_worker,
+    largest_feasible_rollout,
+    memory_per_device,
+    plan_buffer_memory,
+)
+from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.algo.utils.tensor_dict import TensorDict
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+def _make_cfg(**kwargs):
+    cfg = parse_custom_args(argv=["--env=my_custom_env_v1", "--experiment=test_memory_planner"])
+    cfg.num_workers = 2
+    cfg.num_envs_per_worker = 4
+    cfg.rollout = 8
+    cfg.batch_size = 8 * cfg.rollout
+    cfg.serial_mode = True
+    cfg.device = "cpu"
+    cfg.env_gpu_observations = False
+    for key, value in kwargs.items():
+        setattr(cfg, key, value)
+    return cfg
+
+
+@pytest.fixture(scope="module")
+def env_info():
+    register_custom_components()
+    cfg = _make_cfg()
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+    tmp_env.close()
+    return env_info
+
+
+def _nbytes(tensors: TensorDict) -> int:
+    return sum(_nbytes(t) if isinstance(t, TensorDict) else t.numel() * t.element_size() for t in tensors.values())
+
+
+class TestMemoryPlanner:
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    @pytest.mark.parametrize("async_rl", [False, True])
+    @pytest.mark.parametrize("zero_copy_batches", [False, True])
+    def test_plan_matches_allocation(self, env_info, batched_sampling, async_rl, zero_copy_batches):
+        cfg = _make_cfg(batched_sampling=batched_sampling, async_rl=async_rl, zero_copy_batches=zero_copy_batches)
+
+        buffer_mgr = BufferMgr(cfg, env_info)
+        batcher = Batcher(EventLoop("test_evt_loop"), 0, buffer_mgr, cfg, env_info)
+        batcher.init()
+
+        allocated = _nbytes(buffer_mgr.traj_tensors_torch["cpu"])
+        allocated += _nbytes(TensorDict(outputs=buffer_mgr.policy_output_tensors_torch["cpu"]))
+        allocated += sum(_nbytes(batch) for batch in batcher.batch_buffers if batch is not None)
+
+        plan = plan_buffer_memory(cfg, env_info)
+        assert memory_per_device(plan) == {"cpu": allocated}
+
+        # with zero-copy batches training batches are only allocated if trajectories are not contiguous
+        assert ("training_batches_p0" in [buffer.name for buffer in plan]) != zero_copy_batches
+        for buffer in plan:
+            assert buffer.nbytes == sum(buffer.tensor_nbytes.values())
+
+    @pytest.mark.parametrize("batched_sampling", [False, True])
+    @pytest.mark.parametrize("async_rl", [False, True])
+    def test_zero_copy_saves_memory(self, env_info, batched_sampling, async_rl):
+        cfg = _make_cfg(batched_sampling=batched_sampling, async_rl=async_rl)
+        copy_mode = memory_per_device(plan_buffer_memory(cfg, env_info))["cpu"]
+        cfg.zero_copy_batches = True
+        zero_copy = memory_per_device(plan_buffer_memory(cfg, env_info))["cpu"]
+        assert zero_copy < copy_mode
+
+    def test_budget(self, env_info):
+        # sampling buffers dominate, so we can fit into the budget with fewer envs or shorter rollouts
+        cfg = _make_cfg(async_rl=True, num_envs_per_worker=16)
+        total = memory_per_device(plan_buffer_memory(cfg, env_info))["cpu"]
+
+        cfg.buffer_memory_budget_gb = None
+        assert check_memory_budget(cfg, env_info)
+        cfg.buffer_memory_budget_gb = total / GB
+        assert check_memory_budget(cfg, env_info)
+
+        budget = total * 3 // 4
+        cfg.buffer_memory_budget_gb = budget / GB
+        assert not check_memory_budget(cfg, env_info)
+
+        num_envs = largest_feasible_num_envs_per_worker(cfg, env_info, budget)
+        assert num_envs is not None and 0 < num_envs < cfg.num_envs_per_worker
+        assert num_envs % cfg.worker_num_splits == 0
+        for num_envs_per_worker, fits in [(num_envs, True), (num_envs + cfg.worker_num_splits, False)]:
+            candidate = _make_cfg(async_rl=True, num_envs_per_worker=num_envs_per_worker)
+            assert (memory_per_device(plan_buffer_memory(candidate, env_info))["cpu"] <= budget) == fits
+
+        rollout = largest_feasible_rollout(cfg, env_info, budget)
+        assert rollout is not None and 0 < rollout < cfg.rollout
+        assert cfg.batch_size % rollout == 0
+        candidate = _make_cfg(async_rl=True, num_envs_per_worker=16, rollout=rollout)
+        assert memory_per_device(plan_buffer_memory(candidate, env_info))["cpu"] <= budget
@@ -0,0 +1,98 @@
+import shutil
+import urllib.error
+import urllib.request
+
+import pytest
+
+from sample_factory.algo.runners.runner import AlgoObserver, Runner
+from sample_factory.algo.utils.misc import ExperimentStatus
+from sample_factory.train import make_runner
+from sample_factory.utils.metrics_server import PROMETHEUS_CONTENT_TYPE, Metric, MetricsServer
+from sample_factory.utils.utils import experiment_dir
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+from tests.utils import clean_test_dir
+
+
+def _scrape(port: int, path: str = "/metrics"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.headers["Content-Type"], response.read().decode("utf-8")
+
+
+def _samples(text: str):
+    """Metric samples without HELP/TYPE comments."""
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+class MetricsScraper(AlgoObserver):
+    def __init__(self):
+        self.text = None
+
+    def on_training_step(self, runner: Runner, training_iteration_since_resume: int) -> None:
+        # components report some of the stats only periodically, so we keep the latest scrape
+        runner._update_metrics()
+        _, self.text = _scrape(runner.metrics_server.port)
+
+
+class TestMetricsServer:
+    def test_scrape(self):
+        server = MetricsServer("127.0.0.1", 0)
+        try:
+            fps = Metric("sf_fps", "Frames per second")
+            fps.add(123.5, interval_sec=10)
+            fps.add(float("nan"), interval_sec=60)
+            lag = Metric("sf_policy_lag", "Policy lag")
+            lag.add(2, policy=0, stat="max")
+            memory = Metric("sf_process_memory_mb", "Memory")
+            memory.add(1.0, process='with "quotes"')
+            server.update([fps, lag, memory, Metric("sf_empty", "Not reported")])
+
+            content_type, text = _scrape(server.port)
+            assert content_type == PROMETHEUS_CONTENT_TYPE
+            assert "# TYPE sf_fps gauge" in text
+            assert "sf_empty" not in text
+            assert _samples(text) == [
+                'sf_fps{interval_sec="10"} 123.5',
+                'sf_fps{interval_sec="60"} NaN',
+                'sf_policy_lag{policy="0",stat="max"} 2.0',
+                'sf_process_memory_mb{process="with \\"quotes\\""} 1.0',
+            ]
+
+            with pytest.raises(urllib.error.HTTPError):
+                _scrape(server.port, "/something_else")
+        finally:
+            server.close()
+
+    def test_runner_metrics(self):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--env=my_custom_env_v1", "--experiment=test_metrics_server"])
+        cfg.serial_mode = True
+        cfg.device = "cpu"
+        cfg.num_workers = 2
+        cfg.num_envs_per_worker = 2
+        cfg.batch_size = 64
+        cfg.train_for_env_steps = 1000
+        cfg.metrics_port = 0
+        clean_test_dir(cfg)
+
+        cfg, runner = make_runner(cfg)
+        scraper = MetricsScraper()
+        runner.register_observer(scraper)
+        try:
+            assert runner.init() == ExperimentStatus.SUCCESS
+            assert runner.run() == ExperimentStatus.SUCCESS
+        finally:
+            shutil.rmtree(experiment_dir(cfg=cfg, mkdir=False), ignore_errors=True)
+
+        assert scraper.text is not None
+        # timings and other stats of the components are reported every few seconds and might not be there yet
+        names = {line.split("{")[0].split(" ")[0] for line in _samples(scraper.text)}
+        for name in [
+            "sf_fps",
+            "sf_env_steps_total",
+            "sf_samples_collected_total",
+            "sf_trajectory_buffers_free",
+            "sf_trajectory_buffers_occupancy",
+            "sf_process_memory_mb",
+        ]:
+            assert name in names, name
+        assert 'sf_process_memory_mb{process="runner"}' in scraper.text
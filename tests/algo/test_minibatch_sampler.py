@@ -0,0 +1,57 @@
+import torch
+
+from sample_factory.algo.learning.minibatch_sampler import MinibatchSampler
+from sample_factory.algo.utils.tensor_dict import TensorDict
+
+
+def _training_batch(experience_size: int) -> TensorDict:
+    steps = torch.arange(experience_size)
+    return TensorDict(
+        normalized_obs=TensorDict(obs=torch.randn(experience_size, 3, 4, 4), measurements=torch.randn(experience_size)),
+        actions=steps.clone(),
+        rewards=steps.float(),
+        values=torch.randn(experience_size),
+        rnn_states=torch.randn(experience_size, 8),
+        valids=torch.rand(experience_size) < 0.5,
+        dones_cpu=steps.float() * 2,
+    )
+
+
+class TestMinibatchSampler:
+    def test_minibatches(self):
+        experience_size, batch_size, recurrence = 64, 16, 4
+        buffer = _training_batch(experience_size)
+
+        sampler = MinibatchSampler(buffer, experience_size, batch_size, recurrence, "cpu")
+        # float32 fields are fused, the rest of the fields are the only ones of their dtype
+        assert len(sampler.fused) == 1 and len(sampler.separate) == 2
+
+        for epoch in range(3):
+            num_minibatches = sampler.shuffle()
+            assert num_minibatches == experience_size // batch_size
+
+            all_indices = []
+            for batch_num in range(num_minibatches):
+                mb = sampler.get_minibatch(batch_num)
+                indices = mb["actions"]
+                assert len(indices) == batch_size
+
+                # minibatches consist of complete trajectory segments of length recurrence
+                segments = indices.view(-1, recurrence)
+                assert torch.all(segments[:, 0] % recurrence == 0)
+                assert torch.equal(segments - segments[:, :1], torch.arange(recurrence).expand_as(segments))
+
+                # every field matches regular indexing of the training batch
+                expected = buffer[indices]
+                assert list(mb.keys()) == list(expected.keys())
+                assert torch.equal(mb["normalized_obs"]["obs"], expected["normalized_obs"]["obs"])
+                assert torch.equal(mb["normalized_obs"]["measurements"], expected["normalized_obs"]["measurements"])
+                for key in ["actions", "rewards", "values", "rnn_states", "valids", "dones_cpu"]:
+                    assert mb[key].shape == expected[key].shape
+                    assert mb[key].dtype == expected[key].dtype
+                    assert torch.equal(mb[key], expected[key])
+
+                all_indices.append(indices)
+
+            # every step is used exactly once per epoch
+            assert torch.equal(torch.cat(all_indices).sort().values, torch.arange(experience_size))
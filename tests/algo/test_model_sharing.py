@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+import torch
+
+from sample_factory.algo.utils.model_sharing import ParameterServer, VersionedWeights
+from sample_factory.algo.utils.multiprocessing_utils import get_mp_ctx
+
+
+def _state_dict(value: float):
+    # large enough so that copying takes a while and readers and the writer actually overlap
+    return {f"layer{i}": torch.full((256, 256), value) for i in range(8)}
+
+
+def _check_consistent(state_dict, policy_version: int) -> bool:
+    return all(bool((t == policy_version).all()) for t in state_dict.values())
+
+
+def _reader(weights: VersionedWeights, num_reads: int, results):
+    local_state = _state_dict(-1)
+    prev_version = -1
+    num_torn = 0
+    for _ in range(num_reads):
+        policy_version = weights.read_into(local_state)
+        if not _check_consistent(local_state, policy_version) or policy_version < prev_version:
+            num_torn += 1
+        prev_version = policy_version
+    results.put((num_torn, prev_version))
+
+
+class TestVersionedWeights:
+    def test_read_latest(self):
+        weights = VersionedWeights(_state_dict(0), num_slots=2, policy_version=0)
+        local_state = _state_dict(-1)
+        assert weights.read_into(local_state) == 0 and _check_consistent(local_state, 0)
+
+        for policy_version in range(1, 5):
+            weights.publish(_state_dict(policy_version), policy_version)
+            assert weights.read_into(local_state) == policy_version
+            assert _check_consistent(local_state, policy_version)
+
+    def test_publish_only_taken_versions(self):
+        model = torch.nn.Linear(4, 4)
+        policy_versions = torch.zeros(1, dtype=torch.int32)
+        param_server = ParameterServer(0, policy_versions, serial_mode=False, num_weight_slots=2)
+        param_server.init(model, 0, torch.device("cpu"))
+        weights = param_server.versioned_weights
+        local_state = {k: torch.zeros_like(v) for k, v in model.state_dict().items()}
+
+        param_server.update_weights(1)
+        assert policy_versions[0] == 1
+
+        # nobody took version 1 yet, no need to copy the weights again
+        param_server.update_weights(2)
+        assert policy_versions[0] == 1 and not weights.latest_taken()
+
+        assert weights.read_into(local_state) == 1 and weights.latest_taken()
+        with torch.no_grad():
+            model.weight.fill_(3.0)
+        param_server.update_weights(3, state_lock=threading.Lock())
+        assert policy_versions[0] == 3
+        assert weights.read_into(local_state) == 3 and torch.equal(local_state["weight"], model.weight)
+
+        # i.e. policy replacement in PBT, these weights have to be published in any case
+        param_server.update_weights(4)
+        param_server.update_weights(5, force=True)
+        assert policy_versions[0] == 5 and weights.read_into(local_state) == 5
+
+    @pytest.mark.parametrize("num_slots", [2, 3])
+    def test_no_torn_reads(self, num_slots):
+        num_readers, num_reads, num_versions = 2, 100, 300
+        weights = VersionedWeights(_state_dict(0), num_slots=num_slots, policy_version=0)
+
+        # readers in separate processes, the writer is this process, like inference workers and the learner
+        mp_ctx = get_mp_ctx(serial=False)
+        results = mp_ctx.Queue()
+        readers = [mp_ctx.Process(target=_reader, args=(weights, num_reads, results)) for _ in range(num_readers)]
+        for r in readers:
+            r.start()
+
+        # also read concurrently from a thread of the writer process
+        thread_results = mp_ctx.Queue()
+        reader_thread = threading.Thread(target=_reader, args=(weights, num_reads, thread_results))
+        reader_thread.start()
+
+        for policy_version in range(1, num_versions + 1):
+            weights.publish(_state_dict(policy_version), policy_version)
+
+        reader_thread.join()
+        for r in readers:
+            r.join(timeout=60)
+            assert r.exitcode == 0
+
+        for q, n in [(results, num_readers), (thread_results, 1)]:
+            for _ in range(n):
+                num_torn, last_version = q.get(timeout=10)
+                assert num_torn == 0
+                assert 0 <= last_version <= num_versions
+
+
+class TestExportState:
+    @pytest.mark.parametrize("serial_mode", [False, True])
+    def test_export_state(self, serial_mode):
+        param_server = ParameterServer(0, torch.zeros(1, dtype=torch.int32), serial_mode=serial_mode)
+        state = {
+            "train_step": 10,
+            "model": _state_dict(1),
+            "optimizer": {"state": {0: {"exp_avg": torch.ones(3)}}, "param_groups": [{"lr": 1e-4}]},
+        }
+
+        exported = param_server.export_state(state)
+        assert param_server.exported_state is exported
+        assert exported["train_step"] == 10 and exported["optimizer"]["param_groups"][0]["lr"] == 1e-4
+
+        exported_tensors = list(exported["model"].values()) + [exported["optimizer"]["state"][0]["exp_avg"]]
+        assert all(t.device.type == "cpu" and t.is_shared() != serial_mode for t in exported_tensors)
+
+        # the learner keeps training after the export, the snapshot must not change
+        for t in state["model"].values():
+            t.fill_(2)
+        assert _check_consistent(exported["model"], 1)
@@ -0,0 +1,100 @@
+import pytest
+import torch
+from torch import nn
+
+from sample_factory.algo.sampling import quantized_inference
+from sample_factory.algo.sampling.quantized_inference import QuantizedPolicy, round_conv_weights_to_int8
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.model.model_utils import get_rnn_size
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+class TestQuantizedInference:
+    @pytest.mark.parametrize("use_rnn", [False, True])
+    @pytest.mark.parametrize("quantize_conv", [False, True])
+    def test_quantized_policy(self, use_rnn: bool, quantize_conv: bool):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--env=my_custom_env_v1", "--experiment=test_quantized_inference"])
+        cfg.use_rnn = use_rnn
+        cfg.quantize_conv_layers = quantize_conv
+        cfg.quantized_kl_interval = 2
+        cfg.quantized_refresh_interval_sec = 0.0
+
+        tmp_env = make_env_func_batched(cfg, env_config=None)
+        env_info = extract_env_info(tmp_env, cfg)
+        tmp_env.close()
+
+        actor_critic = create_actor_critic(cfg, env_info.obs_space, env_info.action_space)
+        actor_critic.eval()
+
+        assert QuantizedPolicy.is_supported(torch.device("cpu"))
+        quantized_policy = QuantizedPolicy(cfg, env_info, policy_id=0)
+        assert quantized_policy.update(actor_critic, policy_version=1)
+        assert not quantized_policy.update(actor_critic, policy_version=1)
+
+        # float model is untouched, all linear and recurrent layers of the copy are quantized
+        quantized = quantized_policy.actor_critic
+        assert not any(type(m).__module__.startswith("torch.ao") for m in actor_critic.modules())
+        assert not any(type(m) in (nn.Linear, nn.GRU) for m in quantized.modules())
+
+        batch_size = 16
+        obs = dict(obs=torch.rand((batch_size,) + env_info.obs_space["obs"].shape))
+        rnn_states = torch.rand(batch_size, get_rnn_size(cfg))
+
+        with torch.inference_mode():
+            normalized_obs = actor_critic.normalize_obs(obs)
+            outputs = actor_critic(normalized_obs, rnn_states)
+            quantized_outputs = quantized(normalized_obs, rnn_states)
+
+            for key in ["action_logits", "values", "new_rnn_states"]:
+                assert quantized_outputs[key].shape == outputs[key].shape
+                assert torch.allclose(quantized_outputs[key], outputs[key], atol=0.05)
+
+            assert not quantized_policy.should_measure_kl()
+            assert quantized_policy.should_measure_kl()
+            quantized_policy.record_kl(actor_critic.action_distribution(), quantized.action_distribution())
+
+        summaries = quantized_policy.summaries()
+        assert 0 <= summaries["quantized_kl_p0"] < 1e-2
+        assert summaries["quantize_time_ms_p0"] > 0
+
+        # new weights -> new quantized copy
+        with torch.no_grad():
+            actor_critic.critic_linear.bias.add_(1.0)
+        assert quantized_policy.update(actor_critic, policy_version=2)
+        assert quantized_policy.actor_critic is not quantized
+
+    def test_refresh_interval(self, monkeypatch):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--env=my_custom_env_v1", "--experiment=test_quantized_inference"])
+        cfg.quantized_refresh_interval_sec = 10.0
+
+        tmp_env = make_env_func_batched(cfg, env_config=None)
+        env_info = extract_env_info(tmp_env, cfg)
+        tmp_env.close()
+        actor_critic = create_actor_critic(cfg, env_info.obs_space, env_info.action_space)
+
+        now = [100.0]
+        monkeypatch.setattr(quantized_inference.time, "time", lambda: now[0])
+        quantized_policy = QuantizedPolicy(cfg, env_info, policy_id=0)
+
+        # new weights after every minibatch, but we re-quantize only once per interval
+        num_updates = 0
+        for policy_version in range(1, 31):
+            num_updates += quantized_policy.update(actor_critic, policy_version)
+            now[0] += 1.0
+        assert num_updates == 3
+        assert quantized_policy.policy_version == 21
+        assert len(quantized_policy.update_times) == num_updates
+
+    def test_round_conv_weights(self):
+        conv = nn.Conv2d(3, 4, kernel_size=3)
+        weights = conv.weight.detach().clone()
+        round_conv_weights_to_int8(conv)
+
+        scale = weights.abs().amax(dim=(1, 2, 3), keepdim=True) / 127
+        levels = conv.weight.detach() / scale
+        assert torch.allclose(levels, levels.round(), atol=1e-3)
+        assert torch.all((conv.weight.detach() - weights).abs() <= scale / 2 + 1e-6)
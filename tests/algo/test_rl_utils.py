@@ -0,0 +1,100 @@
+import pytest
+import torch
+
+from sample_factory.algo.utils.rl_utils import (
+    calculate_discounted_sum_blocked,
+    calculate_discounted_sum_torch,
+    gae_advantages,
+    vtrace,
+)
+
+
+def _vtrace_loop(ratios, values, rewards, dones, rho_hat: float, c_hat: float, gamma: float, recurrence: int):
+    """Reference per-step implementation on flat [num_trajectories * recurrence] tensors."""
+    num_trajectories = len(values) // recurrence
+
+    vtrace_rho = torch.min(torch.Tensor([rho_hat]), ratios)
+    vtrace_c = torch.min(torch.Tensor([c_hat]), ratios)
+
+    vs = torch.zeros((num_trajectories * recurrence))
+    adv = torch.zeros((num_trajectories * recurrence))
+
+    next_values = values[recurrence - 1 :: recurrence] - rewards[recurrence - 1 :: recurrence]
+    next_values /= gamma
+    next_vs = next_values
+
+    for i in reversed(range(recurrence)):
+        curr_rewards = rewards[i::recurrence]
+        not_done_gamma = (1.0 - dones[i::recurrence]) * gamma
+
+        curr_values = values[i::recurrence]
+        curr_vtrace_rho = vtrace_rho[i::recurrence]
+        curr_vtrace_c = vtrace_c[i::recurrence]
+
+        delta_s = curr_vtrace_rho * (curr_rewards + not_done_gamma * next_values - curr_values)
+        adv[i::recurrence] = curr_vtrace_rho * (curr_rewards + not_done_gamma * next_vs - curr_values)
+        next_vs = curr_values + delta_s + not_done_gamma * curr_vtrace_c * (next_vs - next_values)
+        vs[i::recurrence] = next_vs
+
+        next_values = curr_values
+
+    return vs, adv
+
+
+class TestVTrace:
+    @pytest.mark.parametrize("num_trajectories", [1, 17])
+    @pytest.mark.parametrize("recurrence", [2, 32])
+    @pytest.mark.parametrize("rho_hat, c_hat", [(1.0, 1.0), (2.0, 0.5)])
+    def test_vtrace_matches_loop(self, num_trajectories, recurrence, rho_hat, c_hat):
+        gamma = 0.99
+        n = num_trajectories * recurrence
+
+        for _ in range(10):
+            ratios = torch.rand(n) * 2.0
+            values = torch.randn(n)
+            rewards = torch.randn(n)
+            dones = torch.rand(n) < 0.1
+
+            vs_ref, adv_ref = _vtrace_loop(ratios, values, rewards, dones.float(), rho_hat, c_hat, gamma, recurrence)
+
+            shape = (num_trajectories, recurrence)
+            vs, adv = vtrace(
+                ratios.view(shape), values.view(shape), rewards.view(shape), dones.view(shape), rho_hat, c_hat, gamma
+            )
+
+            assert vs.shape == shape and adv.shape == shape
+            assert torch.allclose(vs.reshape(-1), vs_ref, atol=1e-5)
+            assert torch.allclose(adv.reshape(-1), adv_ref, atol=1e-5)
+
+
+class TestGAE:
+    @pytest.mark.parametrize("rollout", [1, 16, 37])
+    @pytest.mark.parametrize("block_size", [1, 4, 16, 64])
+    @pytest.mark.parametrize("gamma, gae_lambda", [(0.99, 0.95), (0.99, 0.0), (0.0, 0.95)])
+    def test_blocked_gae_matches_loop(self, rollout, block_size, gamma, gae_lambda):
+        num_trajectories = 9
+
+        for _ in range(10):
+            rewards = torch.randn(num_trajectories, rollout)
+            dones = (torch.rand(num_trajectories, rollout) < 0.1).float()
+            values = torch.randn(num_trajectories, rollout + 1)
+            valids = (torch.rand(num_trajectories, rollout + 1) < 0.9).float()
+
+            adv_ref = gae_advantages(rewards, dones, values, valids, gamma, gae_lambda)
+            adv = gae_advantages(rewards, dones, values, valids, gamma, gae_lambda, block_size)
+
+            assert adv.shape == adv_ref.shape
+            assert torch.isfinite(adv).all()
+            assert torch.allclose(adv, adv_ref, atol=1e-5)
+
+    def test_blocked_discounted_sum_with_last_value(self):
+        x = torch.randn(50, 3, dtype=torch.float64)
+        # float64 dones and valids, otherwise the reference implementation discounts in float32
+        dones = (torch.rand(50, 3) < 0.05).double()
+        valids = torch.ones(50, 3, dtype=torch.float64)
+        x_last = torch.randn(3, dtype=torch.float64)
+
+        expected = calculate_discounted_sum_torch(x, dones, valids, 0.9, x_last)
+        actual = calculate_discounted_sum_blocked(x, dones, valids, 0.9, 8, x_last)
+        assert actual.dtype == torch.float64
+        assert torch.allclose(actual, expected, atol=1e-10)
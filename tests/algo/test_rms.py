@@ -1,11 +1,18 @@
+import copy
+import threading
 from typing import Optional, Tuple
 
+import gymnasium as gym
+import numpy as np
 import pytest
 import torch
 from torch import Tensor
 
 from sample_factory.algo.utils.misc import EPS
 from sample_factory.algo.utils.running_mean_std import RunningMeanStdInPlace
+from sample_factory.utils import normalize as normalize_module
+from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.normalize import ObservationNormalizer
 
 
 class TestRMS:
@@ -66,3 +73,97 @@ class TestRMS:
 
     def test_jit(self):
         self.test_rms_sanity(batch_size=10, shape=(1,), norm_only=False, use_jit=True)
+
+    @pytest.mark.parametrize("per_channel", [False, True])
+    def test_update_from_moments(self, per_channel: bool):
+        shape = (3, 5, 4)
+        normalizer = RunningMeanStdInPlace(shape, per_channel=per_channel)
+        axis = [0, 2, 3] if per_channel else [0]
+
+        running_mean, running_var, count = normalizer.running_mean, normalizer.running_var, normalizer.count
+        for batch_size in [7, 64]:
+            x = torch.rand((batch_size,) + shape) * 10 + 3
+            expected = RunningMeanStdInPlace._update_mean_var_count_from_moments(
+                running_mean.clone(), running_var.clone(), count.clone(), x.mean(axis), x.var(axis), batch_size
+            )
+
+            normalizer.update_from_moments(*normalizer.batch_moments(x))
+            for actual_value, expected_value in zip([running_mean, running_var, count], expected):
+                assert torch.allclose(actual_value, expected_value.double(), rtol=1e-5)
+
+
+class TestObservationNormalizer:
+    @pytest.mark.parametrize("dtype", [torch.uint8, torch.float32])
+    def test_normalize_into_buffers(self, dtype: torch.dtype):
+        obs_space = gym.spaces.Dict(
+            obs=gym.spaces.Box(0, 255, (3, 4, 4), dtype=np.uint8),
+            measurements=gym.spaces.Box(-1, 1, (2,)),
+        )
+        cfg = AttrDict(obs_subtract_mean=128.0, obs_scale=64.0, normalize_input=True, normalize_input_keys=None)
+        normalizer = ObservationNormalizer(obs_space, cfg)
+        normalizer_copy = copy.deepcopy(normalizer)
+        normalizer.train()
+        normalizer_copy.train()
+
+        max_batch_size = 32
+        out = {key: torch.empty((max_batch_size,) + space.shape) for key, space in obs_space.spaces.items()}
+        for batch_size in [max_batch_size, 9]:
+            obs = dict(
+                obs=torch.randint(0, 255, (batch_size, 3, 4, 4)).to(dtype),
+                measurements=torch.rand(batch_size, 2) * 2 - 1,
+            )
+            orig_obs = {key: x.clone() for key, x in obs.items()}
+
+            normalized = normalizer(obs, out=out, stats_lock=threading.Lock())
+            expected = normalizer_copy(obs)
+
+            for key in obs:
+                # inputs are not modified, outputs are views into the preallocated buffers
+                assert torch.equal(obs[key], orig_obs[key])
+                assert normalized[key].data_ptr() == out[key].data_ptr()
+                assert torch.allclose(normalized[key], expected[key], atol=1e-5)
+
+        for key, buf in normalizer.state_dict().items():
+            assert torch.allclose(buf, normalizer_copy.state_dict()[key])
+
+    def test_normalize_with_stats_from_the_lock(self):
+        obs_space = gym.spaces.Dict(obs=gym.spaces.Box(-1, 1, (3,)))
+        cfg = AttrDict(obs_subtract_mean=0.0, obs_scale=1.0, normalize_input=True, normalize_input_keys=None)
+        normalizer = ObservationNormalizer(obs_space, cfg)
+        normalizer_copy = copy.deepcopy(normalizer)
+        normalizer.train()
+        normalizer_copy.train()
+        rms = normalizer.running_mean_std.running_mean_std["obs"]
+
+        class ConcurrentUpdateLock:
+            """Another thread updates the statistics right after we release the lock."""
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                rms.running_mean.fill_(100.0)
+                rms.running_var.fill_(100.0)
+
+        obs = dict(obs=torch.rand(8, 3))
+        expected = normalizer_copy(obs)["obs"]
+        normalized = normalizer(obs, stats_lock=ConcurrentUpdateLock())["obs"]
+        assert torch.allclose(normalized, expected)
+
+    def test_normalize_into_mismatched_buffers(self, monkeypatch):
+        obs_space = gym.spaces.Dict(obs=gym.spaces.Box(0, 255, (3, 4, 4), dtype=np.uint8))
+        cfg = AttrDict(obs_subtract_mean=128.0, obs_scale=64.0, normalize_input=False, normalize_input_keys=None)
+        normalizer = ObservationNormalizer(obs_space, cfg)
+
+        warnings = []
+        monkeypatch.setattr(normalize_module.log, "warning", lambda msg, *args: warnings.append(msg))
+
+        # buffer is too small for the batch, normalized observations are allocated instead
+        out = dict(obs=torch.empty((4, 3, 4, 4)))
+        for _ in range(2):
+            obs = dict(obs=torch.randint(0, 255, (8, 3, 4, 4), dtype=torch.uint8))
+            normalized = normalizer(obs, out=out)
+            assert normalized["obs"].data_ptr() != out["obs"].data_ptr()
+            assert torch.allclose(normalized["obs"], (obs["obs"].float() - 128.0) / 64.0)
+
+        assert len(warnings) == 1
@@ -3,21 +3,29 @@ import pytest
 import torch
 import torch.nn as nn
 
-from sample_factory.algo.learning.rnn_utils import build_core_out_from_seq, build_rnn_inputs
+from sample_factory.algo.learning.rnn_utils import (
+    build_core_out_from_seq,
+    build_rnn_inputs,
+    clear_pack_info_cache,
+    pack_info_cache_size,
+)
 
 
 class TestPackedSequences:
     @staticmethod
-    def check_packed_version_matching_loopy_version(T, N, D, random_dones, norm_tolerance=4e-6):
+    def check_packed_version_matching_loopy_version(T, N, D, dones_layout, norm_tolerance=4e-6):
         rnn = nn.GRU(D, D, 1)
+        clear_pack_info_cache()
 
         for _ in range(100):
-            if random_dones:
+            if dones_layout == "random":
                 dones = torch.randint(0, 2, (N * T,))
-            else:
+            elif dones_layout == "fixed":
                 dones = torch.zeros((N * T,))
                 for i in range(1, N * T, 7):
                     dones[i] = 1.0
+            else:
+                dones = torch.zeros((N * T,))
 
             rnn_hidden_states_random = torch.rand(T * N, D)
 
@@ -48,17 +56,44 @@ class TestPackedSequences:
             assert norm < norm_tolerance
             assert np.allclose(packed_out.detach().numpy(), loopy_out.detach().numpy(), atol=4e-6)
 
+        if dones_layout != "random":
+            # every iteration after the first one used the memoized pack info
+            assert pack_info_cache_size() == 1
+
     @pytest.mark.parametrize("T", [37])
     @pytest.mark.parametrize("N", [64])
     @pytest.mark.parametrize("D", [42])
-    @pytest.mark.parametrize("random_dones", [True, False])
+    @pytest.mark.parametrize("dones_layout", ["random", "fixed"])
     @pytest.mark.parametrize("norm_tolerance", [9e-6])
-    def test_full_with_larger_param(self, T, N, D, random_dones, norm_tolerance):
-        self.check_packed_version_matching_loopy_version(T, N, D, random_dones, norm_tolerance)
+    def test_full_with_larger_param(self, T, N, D, dones_layout, norm_tolerance):
+        self.check_packed_version_matching_loopy_version(T, N, D, dones_layout, norm_tolerance)
 
     @pytest.mark.parametrize("T", [5, 27])
     @pytest.mark.parametrize("N", [1, 64])
     @pytest.mark.parametrize("D", [1, 10])
-    @pytest.mark.parametrize("random_dones", [True, False])
-    def test_trivial(self, T, N, D, random_dones):
-        self.check_packed_version_matching_loopy_version(T, N, D, random_dones)
+    @pytest.mark.parametrize("dones_layout", ["random", "fixed"])
+    def test_trivial(self, T, N, D, dones_layout):
+        self.check_packed_version_matching_loopy_version(T, N, D, dones_layout)
+
+    @pytest.mark.parametrize("T", [1, 16])
+    @pytest.mark.parametrize("N", [1, 64])
+    def test_no_dones(self, T, N):
+        # fast path for rollouts without episode boundaries
+        self.check_packed_version_matching_loopy_version(T, N, 10, dones_layout="none")
+
+    def test_pack_info_cache(self):
+        T, N, D = 8, 4, 3
+        dones = torch.zeros(N * T)
+        dones[5] = dones[20] = 1.0
+
+        clear_pack_info_cache()
+        _, _, inverted_select_inds = build_rnn_inputs(torch.randn(N * T, D), dones, torch.rand(N * T, D), T)
+        _, _, cached_inverted_select_inds = build_rnn_inputs(
+            torch.randn(N * T, D), dones.clone(), torch.rand(N * T, D), T
+        )
+        assert pack_info_cache_size() == 1
+        assert cached_inverted_select_inds is inverted_select_inds
+
+        dones[5] = 0.0
+        build_rnn_inputs(torch.randn(N * T, D), dones, torch.rand(N * T, D), T)
+        assert pack_info_cache_size() == 2
@@ -0,0 +1,60 @@
+import math
+from collections import deque
+
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.stats import WindowedStats, window_max, window_mean, window_min
+
+
+class TestWindowedStats:
+    @pytest.mark.parametrize("maxlen", [1, 7, 100])
+    @pytest.mark.parametrize("dtype", [np.float64, np.float32, np.int64])
+    def test_sliding_window(self, maxlen, dtype):
+        rng = np.random.default_rng(0)
+        # values of very different magnitudes, summation order matters for these
+        values = (rng.normal(size=1000) * 10.0 ** rng.integers(-8, 8, size=1000)).astype(dtype)
+
+        stats = WindowedStats(maxlen=maxlen)
+        reference = deque(maxlen=maxlen)
+        for v in values:
+            stats.append(v)
+            reference.append(v)
+
+            assert len(stats) == len(reference)
+            assert list(stats) == list(reference)
+            assert stats.window_min() == float(min(reference))
+            assert stats.window_max() == float(max(reference))
+            assert stats.quantile(0.5) == float(np.quantile(reference, 0.5))
+            assert stats.quantile(0.9) == float(np.quantile(reference, 0.9))
+
+            # exactly the same value the runner reported when the stats were kept in plain deques
+            assert stats.window_mean() == float(np.mean(reference))
+
+    def test_special_values(self):
+        stats = WindowedStats([1.0, float("nan"), 3.0], maxlen=3)
+        assert math.isnan(stats.window_mean())
+        assert stats.window_min() == 1.0 and stats.window_max() == 3.0
+
+        stats.extend([float("inf"), 2.0, 4.0])
+        assert stats.window_mean() == math.inf
+        stats.append(float("-inf"))
+        assert stats.window_mean() == -math.inf
+        stats.append(float("inf"))
+        assert math.isnan(stats.window_mean())
+
+        stats.extend([5.0, 6.0, 7.0])
+        assert stats.window_mean() == 6.0
+        assert (stats.window_min(), stats.window_max()) == (5.0, 7.0)
+
+        assert math.isnan(WindowedStats(maxlen=5).window_mean())
+
+    def test_deque_compatibility(self):
+        stats = WindowedStats(maxlen=3)
+        stats.extend(np.array([1, 2, 3, 4]))
+        assert np.mean(stats) == window_mean(stats) == 3.0
+        assert (window_min(stats), window_max(stats)) == (2.0, 4.0)
+
+        # helpers also work with the plain deques that some environments insert into the stats
+        plain = deque([1, 2, 3, 4], maxlen=3)
+        assert (window_mean(plain), window_min(plain), window_max(plain)) == (3.0, 2.0, 4.0)
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+import torch
+from torch import nn
+from torch._dynamo.callback import CallbackTrigger
+
+from sample_factory.algo.utils.torch_compile import CompiledFunc, _num_compiles, compile_actor_critic, maybe_compile
+from sample_factory.utils.timing import Timing
+
+
+class _TinyActorCritic(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.head = nn.Linear(4, 8)
+        self.tail = nn.Linear(8, 2)
+
+    def forward_head(self, x):
+        return torch.relu(self.head(x))
+
+    def forward_core(self, x, rnn_states):
+        return x, rnn_states
+
+    def forward_tail(self, x):
+        return self.tail(x)
+
+    def forward(self, x, rnn_states):
+        x, rnn_states = self.forward_core(self.forward_head(x), rnn_states)
+        return self.forward_tail(x), rnn_states
+
+
+class TestTorchCompile:
+    def test_compile_actor_critic(self):
+        timing = Timing()
+        model = _TinyActorCritic()
+        compile_actor_critic(model, timing, dynamic=True, mode="default")
+        assert isinstance(model.forward_head, CompiledFunc)
+
+        # compiling again (e.g. the same model shared by the learner and the inference worker) is a no-op
+        compiled_head = model.forward_head
+        compile_actor_critic(model, timing, dynamic=True, mode="default")
+        assert model.forward_head is compiled_head
+
+        for batch_size in [3, 5, 17]:
+            x = torch.randn(batch_size, 4)
+            out, _ = model(x, None)
+            expected = model.tail(torch.relu(model.head(x)))
+            assert torch.allclose(out, expected, atol=1e-6)
+
+        assert not any(getattr(model, unit).failed for unit in ["forward_head", "forward_core", "forward_tail"])
+        assert timing.torch_compile > 0
+
+    def test_compile_time_per_thread(self):
+        timing, thread_timing = Timing(), Timing()
+        compiled = CompiledFunc(lambda x: x * 2, "double", timing, dynamic=None, mode=None)
+        thread_compiled = CompiledFunc(lambda x: x * 3, "triple", thread_timing, dynamic=None, mode=None)
+
+        # compilation in another thread is not charged to the calls made in this thread
+        num_compiles = _num_compiles()
+        thread = threading.Thread(target=thread_compiled, args=(torch.ones(3),))
+        thread.start()
+        thread.join()
+        assert _num_compiles() == num_compiles
+        assert thread_timing.torch_compile > 0
+
+        compiled(torch.ones(3))
+        assert timing.torch_compile > 0
+        compile_time = timing.torch_compile
+        compiled(torch.ones(3))
+        assert timing.torch_compile == compile_time
+
+    def test_runtime_errors_are_raised(self):
+        # i.e. a shape bug in the model, this is not a reason to silently switch to eager mode
+        compiled = CompiledFunc(lambda x: x.view(5), "bad_view", Timing(), dynamic=None, mode=None)
+        with pytest.raises(RuntimeError):
+            compiled(torch.ones(3))
+        assert not compiled.failed
+
+    def test_internal_compile_error(self, monkeypatch):
+        # dynamo does not wrap some of its internal errors, but they are still compilation failures
+        def failing_compile(func, **kwargs):
+            def compiled(*args, **kwargs_):
+                with torch._dynamo.callback_handler.install_callbacks(CallbackTrigger.DYNAMO, "0/0"):
+                    raise AssertionError("Guard failed on the same frame it was created")
+
+            return compiled
+
+        monkeypatch.setattr(torch, "compile", failing_compile)
+        compiled = CompiledFunc(lambda x: x + 1, "add_one", Timing(), dynamic=None, mode=None)
+        assert compiled(1) == 2
+        assert compiled.failed
+
+    def test_fallback_to_eager(self, monkeypatch):
+        def failing_compile(func, **kwargs):
+            def compiled(*args, **kwargs_):
+                raise torch._dynamo.exc.Unsupported("unsupported op")
+
+            return compiled
+
+        monkeypatch.setattr(torch, "compile", failing_compile)
+        compiled = CompiledFunc(lambda x: x + 1, "add_one", Timing(), dynamic=None, mode=None)
+        assert compiled(1) == 2
+        assert compiled.failed
+        assert compiled(2) == 3
+
+        # no torch.compile() at all, e.g. old PyTorch versions
+        monkeypatch.delattr(torch, "compile")
+        add_one = lambda x: x + 1  # noqa: E731
+        assert maybe_compile(add_one, "add_one", Timing(), dynamic=None, mode=None) is add_one
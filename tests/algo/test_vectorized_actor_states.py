@@ -0,0 +1,102 @@
+import copy
+import random
+from typing import Type
+
+import numpy as np
+import pytest
+
+from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
+from sample_factory.algo.sampling.vectorized_actor_states import NonBatchedVectorizedEnvRunner
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.shared_buffers import BufferMgr
+from sample_factory.envs.env_utils import set_reward_shaping
+from sample_factory.utils.timing import Timing
+from sf_examples.train_custom_multi_env import parse_custom_args, register_custom_components
+
+
+def _sample(runner_cls: Type[NonBatchedVectorEnvRunner], cfg, env_info, num_steps: int, reward):
+    """Drive the vector runner with fake policy outputs, record everything it sends to the other components."""
+    random.seed(0)
+    np.random.seed(0)
+    outputs_rng = np.random.default_rng(0)
+
+    buffer_mgr = BufferMgr(cfg, env_info)
+    action_col = int(np.sum(buffer_mgr.output_sizes[: buffer_mgr.output_names.index("actions")]))
+
+    timing = Timing()
+    runner = runner_cls(cfg, env_info, cfg.num_envs_per_worker, 0, 0, buffer_mgr, "cpu", [None] * cfg.num_policies)
+    runner.init(timing)
+    for env in runner.envs:
+        for agent_i in range(env_info.num_agents):
+            set_reward_shaping(env, dict(rew=reward), agent_i)
+
+    requests, trajectories, episodic_stats = [], [], []
+    for _ in range(num_steps):
+        assert runner.update_trajectory_buffers(timing)
+        policy_request = runner.generate_policy_request()
+        requests.append(policy_request)
+
+        for policy_id, agents in policy_request.items():
+            for env_i, agent_i, _, _ in agents:
+                outputs = runner.policy_output_tensors[env_i, agent_i]
+                outputs[:] = outputs_rng.random(len(outputs))
+                outputs[action_col] = outputs_rng.integers(0, env_info.action_space.n)
+
+        # same as the rollout worker, if all agents are inactive we advance the rollout with a fake policy id
+        for policy_id in policy_request or [-1]:
+            rollouts, stats = runner.advance_rollouts(policy_id, timing)
+            episodic_stats.extend(stats)
+            for r in rollouts:
+                trajectories.append((r, copy.deepcopy(runner.traj_tensors[r["traj_buffer_idx"]])))
+                # pretend the learner is done with this trajectory
+                runner.traj_buffer_queue.put(r["traj_buffer_idx"])
+
+    runner.close()
+    return requests, trajectories, episodic_stats
+
+
+def _assert_tensors_equal(d1, d2):
+    assert d1.keys() == d2.keys()
+    for k in d1:
+        if isinstance(d1[k], dict):
+            _assert_tensors_equal(d1[k], d2[k])
+        else:
+            assert np.array_equal(d1[k], d2[k]), k
+
+
+class TestVectorizedActorStates:
+    @pytest.mark.parametrize("num_policies", [1, 3])
+    # fractional float32 rewards accumulate differently depending on the dtype of the episode reward
+    @pytest.mark.parametrize("reward", [-1.0, np.float32(-0.1)])
+    def test_same_as_actor_states(self, num_policies, reward):
+        register_custom_components()
+        cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_multi_env_v1", "--experiment=test_vectorized"])
+        cfg.num_workers = 1
+        cfg.num_envs_per_worker = 4
+        cfg.worker_num_splits = 1
+        cfg.num_policies = num_policies
+        cfg.rollout = 8
+        cfg.custom_env_episode_len = 13
+        cfg.decorrelate_envs_on_one_worker = False
+        cfg.serial_mode = True
+        cfg.env_gpu_observations = False
+        cfg.device = "cpu"
+
+        tmp_env = make_env_func_batched(cfg, env_config=None)
+        env_info = extract_env_info(tmp_env, cfg)
+        tmp_env.close()
+
+        num_steps = 5 * cfg.rollout
+        requests, trajectories, stats = _sample(NonBatchedVectorEnvRunner, cfg, env_info, num_steps, reward)
+        vec_requests, vec_trajectories, vec_stats = _sample(
+            NonBatchedVectorizedEnvRunner, cfg, env_info, num_steps, reward
+        )
+
+        assert requests == vec_requests
+        assert stats == vec_stats
+        assert any(s["episodic"]["reward"] != 0 for s in stats)
+        assert len(trajectories) == len(vec_trajectories) > 0
+        for (traj, data), (vec_traj, vec_data) in zip(trajectories, vec_trajectories):
+            assert traj == vec_traj
+            _assert_tensors_equal(data, vec_data)
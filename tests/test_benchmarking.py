@@ -0,0 +1,74 @@
+import numpy as np
+
+from sample_factory.algo.utils.context import (
+    global_env_registry,
+    global_model_factory,
+    reset_global_context,
+    sf_global_context,
+)
+from sample_factory.benchmarking.benchmark_envs import BENCHMARK_ENVS, register_benchmark_envs
+from sample_factory.benchmarking.compare_benchmarks import compare
+from sample_factory.benchmarking.run_benchmark import run_benchmarks
+from sample_factory.utils.attr_dict import AttrDict
+
+
+def _rollout(env, num_steps):
+    obs, _ = env.reset()
+    trajectory = [obs]
+    for i in range(num_steps):
+        actions = i % 4
+        if getattr(env, "is_multiagent", False):
+            actions = [actions] * env.num_agents
+        obs, rew, terminated, truncated, _ = env.step(actions)
+        trajectory.extend([obs, rew, terminated, truncated])
+    return trajectory
+
+
+def test_benchmark_envs_deterministic():
+    register_benchmark_envs()
+    for env_name in BENCHMARK_ENVS:
+        make_env_func = global_env_registry()[env_name]
+        envs = [make_env_func(env_name, None, AttrDict(env_id=1)) for _ in range(2)]
+        trajectories = [_rollout(env, 40) for env in envs]
+        for a, b in zip(*trajectories):
+            assert np.array_equal(a, b)
+
+        other_env = make_env_func(env_name, None, AttrDict(env_id=2))
+        assert not np.array_equal(_rollout(other_env, 1)[0], trajectories[0][0])
+
+
+def test_compare_benchmarks():
+    def _results(fps, latency):
+        return dict(scenarios=dict(s=dict(metrics=dict(fps=fps, inference_latency_mean_ms=latency))))
+
+    baseline = _results(1000.0, 2.0)
+    diffs = {d.metric: d for d in compare(baseline, _results(850.0, 1.5))}
+    assert diffs["fps"].regressed(tolerance=0.1)
+    assert not diffs["fps"].regressed(tolerance=0.2)
+    assert not diffs["inference_latency_mean_ms"].regressed(tolerance=0.1)
+
+    diffs = {d.metric: d for d in compare(baseline, _results(1000.0, 2.5))}
+    assert not diffs["fps"].regressed(tolerance=0.1)
+    assert diffs["inference_latency_mean_ms"].regressed(tolerance=0.1)
+
+
+def test_run_benchmark():
+    def broken_encoder(*_args):
+        raise AssertionError("benchmark should not use model components registered by the caller")
+
+    caller_context = sf_global_context()
+    global_model_factory().register_encoder_factory(broken_encoder)
+    try:
+        results = run_benchmarks(["benchmark_vector_serial"], env_steps=1000)
+        assert sf_global_context() is caller_context
+    finally:
+        reset_global_context()
+
+    scenario = results["scenarios"]["benchmark_vector_serial"]
+    assert scenario["env_steps"] >= 1000
+    for metric in ["fps", "rollout_env_steps_per_sec", "inference_samples_per_sec", "learner_samples_per_sec"]:
+        assert scenario["metrics"][metric] > 0
+    # latency is measured in a separate traced run
+    assert scenario["metrics"]["inference_latency_mean_ms"] > 0
+    assert scenario["metrics"]["traced_fps"] > 0
+    assert "env_step" in scenario["components"]["RolloutWorker_w0"]
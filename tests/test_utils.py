@@ -1,5 +1,8 @@
+import json
 import time
 
+from sample_factory.utils import tracing
+from sample_factory.utils.attr_dict import AttrDict
 from sample_factory.utils.dicts import list_of_dicts_to_dict_of_lists
 from sample_factory.utils.network import is_udp_port_available
 from sample_factory.utils.timing import Timing
@@ -53,6 +56,34 @@ class TestUtils:
         log.debug(t.flat_str())
         log.debug(t)  # tree view
 
+    def test_trace_events(self, tmp_path):
+        cfg = AttrDict(train_dir=str(tmp_path), experiment="test_trace", trace_events=True, trace_buffer_size=4)
+        try:
+            tracing.init_tracing(cfg)
+            t = Timing("Test profile")
+            with t.timeit("outer"):
+                for _ in range(3):
+                    with t.add_time("inner"):
+                        time.sleep(0.001)
+            t.add_value("measured_afterwards", 0.5)
+            tracing.merge_traces(cfg)
+        finally:
+            tracing.TRACER = None
+
+        with open(tracing.trace_file(cfg)) as f:
+            events = json.load(f)["traceEvents"]
+
+        metadata = {e["name"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+        assert metadata["thread_name"] == "Test profile"
+        complete = [e for e in events if e["ph"] == "X"]
+        # the oldest event was discarded when the ring buffer overflowed
+        assert [e["name"] for e in complete] == ["inner", "inner", "outer", "measured_afterwards"]
+        assert len({(e["pid"], e["tid"]) for e in complete}) == 1
+
+        inner, outer = complete[1], complete[2]
+        assert outer["ts"] <= inner["ts"] and inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+        assert abs(complete[-1]["dur"] - 0.5e6) < 1.0
+
     def test_list_of_dicts_to_dict_of_lists(self):
         """Test list_of_dicts_to_dict_of_lists() with recursive dicts."""
         lt = [{"a": 1, "b": {"c": 2, "d": 3}}, {"a": 4, "b": {"c": 5, "d": 6}}]